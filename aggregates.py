@@ -0,0 +1,269 @@
+import argparse
+import logging
+from datetime import date
+from instrumentation import execute # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Time grains from finest to coarsest
+GRAINS = ["hour", "day", "week", "month", "year"]
+
+
+class Aggregate:
+    """
+    A materialized view of play counts over songplays, grouped by a time `grain` and
+    `dimensions`. Only COUNT(*) and GROUP BY are used, so Redshift can refresh it
+    incrementally when songplays is appended to.
+    """
+    def __init__(self, name, grain, dimensions):
+        if grain not in GRAINS:
+            raise ValueError(f"{name}: unknown grain {grain}")
+        self.name = name
+        self.grain = grain
+        self.dimensions = list(dimensions)
+
+    def create_sql(self):
+        dimensions = "".join(f",\n    {d}" for d in self.dimensions)
+        return f"""
+CREATE MATERIALIZED VIEW {self.name}
+DISTSTYLE ALL
+SORTKEY (period)
+AS
+SELECT
+    DATE_TRUNC('{self.grain}', start_time) as period{dimensions},
+    COUNT(*) as plays
+FROM songplays
+GROUP BY {", ".join(str(i) for i in range(1, len(self.dimensions) + 2))}
+"""
+
+    def drop_sql(self):
+        return f"DROP MATERIALIZED VIEW IF EXISTS {self.name}"
+
+    def refresh_sql(self):
+        return f"REFRESH MATERIALIZED VIEW {self.name}"
+
+    def answers(self, request):
+        """
+        True when this aggregate holds every column `request` needs at a fine enough grain.
+        The request's dates filter on day boundaries, so the grain must be a day or finer
+        whether or not the request breaks the result down by time.
+        """
+        grain = GRAINS.index(self.grain)
+        grain_ok = grain <= GRAINS.index("day") and (request.grain is None or grain <= GRAINS.index(request.grain))
+        return grain_ok and set(request.dimensions()) <= set(self.dimensions)
+
+
+# In routing preference order: the smallest aggregate that can answer a request wins
+AGGREGATES = [
+    Aggregate("agg_plays_hourly", "hour", ["level"]),
+    Aggregate("agg_song_plays_daily", "day", ["song_id", "artist_id"]),
+    Aggregate("agg_user_plays_daily", "day", ["user_id", "level"]),
+]
+
+AGGREGATES_BY_NAME = {aggregate.name: aggregate for aggregate in AGGREGATES}
+
+
+def enabled_aggregates(config):
+    """
+    The aggregates listed in AGGREGATES in the `[ETL]` section (all of them when the option is absent).
+    """
+    names = config.get('ETL', 'AGGREGATES', fallback=",".join(AGGREGATES_BY_NAME))
+    enabled = []
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        if name not in AGGREGATES_BY_NAME:
+            raise ValueError(f"Unknown aggregate {name} in [ETL] AGGREGATES; known: {', '.join(AGGREGATES_BY_NAME)}")
+        enabled.append(AGGREGATES_BY_NAME[name])
+    return enabled
+
+
+def drop_aggregates(cur, conn, aggregates, metrics=None):
+    for aggregate in aggregates:
+        execute(cur, conn, aggregate.drop_sql(), metrics, label=f"DROP {aggregate.name}")
+
+
+def create_aggregates(cur, conn, aggregates, metrics=None):
+    for aggregate in aggregates:
+        execute(cur, conn, aggregate.create_sql(), metrics, label=f"CREATE {aggregate.name}")
+
+
+def refresh_aggregates(cur, conn, aggregates, metrics=None):
+    """
+    Refreshes each aggregate after a load. Redshift applies only the new songplays rows
+    when it can and falls back to a full recompute otherwise.
+    """
+    # REFRESH MATERIALIZED VIEW runs as its own transaction, outside any open block
+    conn.commit()
+    conn.autocommit = True
+    try:
+        for aggregate in aggregates:
+            execute(cur, conn, aggregate.refresh_sql(), metrics, label=f"REFRESH {aggregate.name}")
+    finally:
+        conn.autocommit = False
+
+
+# METRICS
+# key column (if any), measure over an aggregate, measure over songplays
+METRICS = {
+    "plays": (None, "SUM(plays)", "COUNT(*)"),
+    "active_users": ("user_id", "COUNT(DISTINCT user_id)", "COUNT(DISTINCT user_id)"),
+    "top_songs": ("song_id", "SUM(plays)", "COUNT(*)"),
+    "top_artists": ("artist_id", "SUM(plays)", "COUNT(*)"),
+}
+
+# Names joined onto the top-N results
+LABELS = {
+    "song_id": "LEFT JOIN songs d ON r.song_id = d.song_id",
+    "artist_id": "LEFT JOIN (SELECT artist_id, MAX(name) as name FROM artists GROUP BY artist_id) d ON r.artist_id = d.artist_id",
+}
+LABEL_COLUMNS = {"song_id": "d.title", "artist_id": "d.name"}
+
+
+class AnalyticsRequest:
+    """
+    One analytics question: a metric between two dates (end exclusive), optionally per
+    time `grain` and broken down by `group_by` columns, with `limit` rows for top-N metrics.
+    """
+    def __init__(self, metric, start, end, grain=None, group_by=(), limit=10):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric}; choose from {', '.join(METRICS)}")
+        if grain is not None and grain not in GRAINS:
+            raise ValueError(f"Unknown grain {grain}; choose from {', '.join(GRAINS)}")
+        self.metric = metric
+        self.start = start
+        self.end = end
+        self.grain = grain
+        self.group_by = list(group_by)
+        self.limit = limit
+
+    @property
+    def key(self):
+        return METRICS[self.metric][0]
+
+    @property
+    def top_n(self):
+        return self.metric.startswith("top_")
+
+    def dimensions(self):
+        if self.metric == "active_users":
+            return ["user_id"] + self.group_by
+        return ([self.key] if self.key else []) + self.group_by
+
+
+def route(request, aggregates):
+    """
+    Returns the first aggregate in `aggregates` that can answer `request`, or None to
+    fall back to songplays.
+    """
+    for aggregate in aggregates:
+        if aggregate.answers(request):
+            return aggregate
+    return None
+
+
+def render(request, aggregate=None):
+    """
+    Returns (sql, params) answering `request` from `aggregate`, or from songplays when None.
+    """
+    key, aggregate_measure, base_measure = METRICS[request.metric]
+    source, time_column, measure = (aggregate.name, "period", aggregate_measure) if aggregate else ("songplays", "start_time", base_measure)
+
+    columns = []
+    if request.grain:
+        columns.append(f"DATE_TRUNC('{request.grain}', {time_column}) as period")
+    columns.extend(request.group_by)
+    if request.top_n:
+        columns.append(key)
+    groups = ", ".join(str(i) for i in range(1, len(columns) + 1))
+    columns.append(f"{measure} as {request.metric if not request.top_n else 'plays'}")
+
+    sql = f"SELECT {', '.join(columns)}\nFROM {source}\nWHERE {time_column} >= %s AND {time_column} < %s"
+    if groups:
+        sql += f"\nGROUP BY {groups}"
+    if request.top_n:
+        # Top `limit` rows within each period (and breakdown), with names joined on
+        partitions = (["period"] if request.grain else []) + request.group_by
+        partition = f"PARTITION BY {', '.join(partitions)} " if partitions else ""
+        order = ", ".join([f"r.{column}" for column in partitions] + ["r.plays DESC"])
+        sql = (f"SELECT r.*, {LABEL_COLUMNS[key]}\nFROM (\n"
+               f"SELECT i.*, ROW_NUMBER() OVER ({partition}ORDER BY plays DESC) as play_rank\nFROM (\n{sql}\n) i\n"
+               f") r\n{LABELS[key]}\nWHERE r.play_rank <= {int(request.limit)}\nORDER BY {order}")
+    elif groups:
+        sql += f"\nORDER BY {groups}"
+    return sql, (request.start, request.end)
+
+
+def run_request(cur, request, aggregates):
+    """
+    Routes `request`, runs it and returns (source name, column names, rows).
+    """
+    aggregate = route(request, aggregates)
+    sql, params = render(request, aggregate)
+    logger.info(f"Answering {request.metric} from {aggregate.name if aggregate else 'songplays'}")
+    cur.execute(sql, params)
+    return (aggregate.name if aggregate else "songplays"), [c[0] for c in cur.description], cur.fetchall()
+
+
+def request_parser():
+    """
+    The options describing an AnalyticsRequest, as an argparse parent parser shared with analytics.py.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("metric", choices=sorted(METRICS))
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, required=True, help="day after the last one (YYYY-MM-DD)")
+    parser.add_argument("--grain", choices=GRAINS, help="break the result down per hour/day/week/month/year")
+    parser.add_argument("--by", action="append", default=[], choices=["level"], help="extra breakdown column")
+    parser.add_argument("--limit", type=int, default=10, help="rows for top_songs / top_artists")
+    return parser
+
+
+def request_from_args(args):
+    """
+    Builds the AnalyticsRequest from arguments parsed with `request_parser`.
+    """
+    return AnalyticsRequest(args.metric, args.start, args.end, args.grain, args.by, args.limit)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Answer common songplays questions, from an aggregate when one can.",
+                                     parents=[request_parser()])
+    parser.add_argument("--no-aggregates", action="store_true", help="always scan songplays")
+    parser.add_argument("--show-sql", action="store_true", help="print the routed SQL instead of running it")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Builds the request from the command line and routes it to an enabled aggregate or songplays.
+    - Prints the rows tab-separated (or just the SQL with --show-sql).
+    """
+    from dwh_config import load_config # type: ignore
+
+    args = parse_args(argv)
+    config = load_config()
+    aggregates = [] if args.no_aggregates else enabled_aggregates(config)
+    request = request_from_args(args)
+
+    if args.show_sql:
+        aggregate = route(request, aggregates)
+        print(f"-- source: {aggregate.name if aggregate else 'songplays'}")
+        print(render(request, aggregate)[0])
+        return
+
+    from db import connect # type: ignore
+    conn = connect(config.conn_string)
+    try:
+        source, columns, rows = run_request(conn.cursor(), request, aggregates)
+    finally:
+        conn.close()
+    print(f"-- source: {source}")
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
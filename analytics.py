@@ -0,0 +1,95 @@
+import argparse
+import logging
+import sys
+from aggregates import enabled_aggregates, render, request_from_args, request_parser, route # type: ignore
+from query_cache import ResultCache, cached_query # type: ignore
+from dwh_config import load_config # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def cache_from_config(config):
+    """
+    Opens the result cache configured in the `[ANALYTICS]` section.
+    """
+    return ResultCache(
+        config.get('ANALYTICS', 'CACHE_PATH', fallback='.query_cache/results.sqlite'),
+        max_bytes=config.getint('ANALYTICS', 'CACHE_MAX_MB', fallback=256) * 2 ** 20,
+        ttl=config.getint('ANALYTICS', 'CACHE_TTL_SECONDS', fallback=3600),
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run analytics queries against the warehouse through a local result cache.")
+    parser.add_argument("--dsn", help="connect here instead of the cluster in dwh.cfg (e.g. a local Postgres)")
+    parser.add_argument("--no-cache", action="store_true", help="always run the query")
+    parser.add_argument("--stats", action="store_true", help="print cache hit/miss statistics and exit")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the cache and exit")
+    commands = parser.add_subparsers(dest="command")
+
+    sql = commands.add_parser("sql", help="run parameterized SQL")
+    sql.add_argument("query", nargs="?", help="the SQL, with %%s placeholders")
+    sql.add_argument("--file", help="read the SQL from this file instead")
+    sql.add_argument("--param", action="append", default=[], help="a placeholder value, in order")
+
+    commands.add_parser("metric", help="a routed songplays metric (see aggregates.py)", parents=[request_parser()])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Builds the SQL from the command line (raw SQL or a metric routed to an aggregate).
+    - Answers it from the on-disk cache while the underlying tables' load-commit marker is unchanged.
+    - Otherwise runs it, caches the result and prints it tab-separated.
+    """
+    args = parse_args(argv)
+    config = load_config()
+    cache = cache_from_config(config)
+    try:
+        if args.clear_cache:
+            cache.clear()
+            logger.info("Cache cleared")
+            return
+        if args.stats:
+            for name, value in cache.stats().items():
+                print(f"{name}\t{value}")
+            return
+
+        if args.command == "sql":
+            if args.file:
+                with open(args.file) as f:
+                    sql = f.read()
+            elif args.query:
+                sql = args.query
+            else:
+                sys.exit("Give the SQL as an argument or with --file.")
+            params = tuple(args.param)
+        elif args.command == "metric":
+            request = request_from_args(args)
+            sql, params = render(request, route(request, enabled_aggregates(config)))
+        else:
+            sys.exit("Choose a command: sql or metric.")
+
+        from db import connect # type: ignore
+        conn = connect(args.dsn or config.conn_string)
+        try:
+            cur = conn.cursor()
+            if args.no_cache:
+                cur.execute(sql, params)
+                columns, rows, hit = [c[0] for c in cur.description], cur.fetchall(), False
+            else:
+                columns, rows, hit = cached_query(cur, cache, sql, params)
+        finally:
+            conn.close()
+
+        logger.info(f"{'Cache hit' if hit else 'Ran query'}: {len(rows)} rows")
+        print("\t".join(columns))
+        for row in rows:
+            print("\t".join("" if value is None else str(value) for value in row))
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
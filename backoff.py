@@ -0,0 +1,35 @@
+import random
+import time
+
+
+def backoff_delays(base=1.0, cap=30.0, attempts=None, rng=random):
+    """
+    Yields "full jitter" exponential backoff delays: a random wait between 0 and
+    min(cap, base * 2**attempt). Runs forever when `attempts` is None.
+    """
+    attempt = 0
+    while attempts is None or attempt < attempts:
+        yield rng.uniform(0, min(cap, base * 2 ** attempt))
+        attempt += 1
+
+
+def retry(func, exceptions=(Exception,), attempts=5, base=1.0, cap=30.0, on_retry=None, sleep=time.sleep):
+    """
+    Calls `func()` until it succeeds, waiting a jittered exponential backoff between tries.
+
+    Only `exceptions` are retried; the last one is re-raised once `attempts` calls have
+    failed. `on_retry(attempt, error, delay)` is called before each wait.
+    """
+    delays = backoff_delays(base, cap, attempts - 1)
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except exceptions as e:
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(attempt, e, delay)
+            sleep(delay)
+            attempt += 1
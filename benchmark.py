@@ -0,0 +1,196 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from local_ingest import ingest_table, read_jsonpaths # type: ignore
+from pg_compat import to_postgres # type: ignore
+from preprocess import convert_table # type: ignore
+from sql_queries import create_table_queries, drop_table_queries, insert_table_steps # type: ignore
+from synthetic_data import SONGS_PER_FILE, generate_events, generate_songs, write_jsonpaths # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """
+    Context manager measuring wall time and peak Python memory for one benchmark stage.
+    Set `rows` inside the block to get a rows/sec figure.
+    """
+    def __init__(self, results, name):
+        self.results = results
+        self.name = name
+        self.rows = 0
+
+    def __enter__(self):
+        tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if exc_type is None:
+            self.results[self.name] = {
+                "seconds": round(seconds, 4),
+                "rows": self.rows,
+                "rows_per_sec": round(self.rows / seconds, 1) if seconds > 0 else 0.0,
+                "peak_mem_mb": round(peak / 2 ** 20, 2),
+            }
+        return False
+
+
+def prepare_data(data_dir, events, songs, songs_per_file):
+    """
+    Generates the synthetic dataset into `data_dir` unless one of the same scale is already there.
+    The log jsonpaths file is always (re)written.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    write_jsonpaths(os.path.join(data_dir, "log_json_path.json"))
+    marker = os.path.join(data_dir, ".scale")
+    scale = f"{events}/{songs}/{songs_per_file}"
+    if os.path.exists(marker) and open(marker).read() == scale:
+        logger.info(f"Reusing synthetic data in {data_dir}")
+        return
+    logger.info(f"Generating {events} events and {songs} songs in {data_dir}")
+    generate_songs(os.path.join(data_dir, "song_data"), songs, songs_per_file)
+    generate_events(os.path.join(data_dir, "log_data"), events, songs)
+    with open(marker, "w") as f:
+        f.write(scale)
+
+
+def run_pipeline(conn, data_dir, workers=None, log_jsonpath=None):
+    """
+    Runs the real create/load/insert statements (adapted to Postgres) and returns per-stage metrics.
+    Events are mapped through the `log_jsonpath` file, as the cluster's COPY maps them
+    through LOG_JSONPATH; without one, keys are matched to columns case-insensitively.
+    """
+    jsonpaths = read_jsonpaths(log_jsonpath) if log_jsonpath else None
+    results = {}
+    cur = conn.cursor()
+
+    with StageTimer(results, "create_tables"):
+        for query in drop_table_queries + create_table_queries:
+            cur.execute(to_postgres(query))
+        conn.commit()
+
+    for table_name, source, paths in [("staging_events", "log_data", jsonpaths), ("staging_songs", "song_data", None)]:
+        with StageTimer(results, f"load_{table_name}") as stage:
+            stage.rows = ingest_table(cur, table_name, os.path.join(data_dir, source), paths, workers=workers)
+            conn.commit()
+
+    for name, query, _, writes in insert_table_steps:
+        with StageTimer(results, f"insert_{name}") as stage:
+            cur.execute(to_postgres(query))
+            conn.commit()
+            cur.execute(f"SELECT COUNT(*) FROM {writes[0]}")
+            stage.rows = cur.fetchone()[0]
+
+    cur.close()
+    return results
+
+
+def run_preprocess(data_dir, file_format, num_files):
+    """
+    Times the JSON to Parquet / gzip CSV conversion of both sources on local disk.
+    Peak memory covers the parent process only; parsing happens in the worker processes.
+    """
+    results = {}
+    for table_name, source in [("staging_events", "log_data"), ("staging_songs", "song_data")]:
+        with StageTimer(results, f"preprocess_{table_name}") as stage:
+            _, stage.rows = convert_table(table_name, os.path.join(data_dir, source),
+                                          os.path.join(data_dir, f"preprocessed_{file_format}"), num_files, file_format)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Returns the stages whose rows/sec dropped more than `tolerance` (a fraction) below the baseline.
+    """
+    regressions = []
+    for stage, metrics in results.items():
+        expected = baseline.get(stage)
+        if not expected or not expected.get("rows_per_sec") or not metrics["rows"]:
+            continue
+        change = metrics["rows_per_sec"] / expected["rows_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append((stage, expected["rows_per_sec"], metrics["rows_per_sec"], change))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':<28} {'rows':>12} {'seconds':>10} {'rows/sec':>12} {'peak MB':>9}")
+    for stage, m in results.items():
+        print(f"{stage:<28} {m['rows']:>12} {m['seconds']:>10.3f} {m['rows_per_sec']:>12.0f} {m['peak_mem_mb']:>9.2f}")
+
+
+def main():
+    """
+    - Generates (or reuses) synthetic log_data and song_data at the requested scale.
+    - Runs create_table_queries, the local_ingest.py load and insert_table_queries on a local Postgres.
+    - Prints rows/sec, latency and peak memory per stage.
+    - Compares against the stored baseline and exits non-zero on a regression.
+    """
+    from db import connect # type: ignore
+
+    parser = argparse.ArgumentParser(description="Benchmark the ETL pipeline against a local Postgres.")
+    parser.add_argument("--events", type=int, default=10_000, help="number of log events (10k to 100M)")
+    parser.add_argument("--songs", type=int, help="song catalog size (default: events / 10)")
+    parser.add_argument("--songs-per-file", type=int, default=SONGS_PER_FILE)
+    parser.add_argument("--data-dir", help="where to put the synthetic data (default: bench_data/<events>)")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN", "postgresql://localhost/sparkify_bench"))
+    parser.add_argument("--baseline", default="benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline for its scale")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed rows/sec drop before failing")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    parser.add_argument("--preprocess", choices=["parquet", "csv"], help="also time the pre-COPY conversion to this format")
+    parser.add_argument("--workers", type=int, help="JSON parser processes for the staging load (default: CPU count)")
+    parser.add_argument("--preprocess-files", type=int, default=8, help="output files per table for --preprocess")
+    parser.add_argument("--log-jsonpath", help="jsonpaths file for the events (default: the one generated with the data)")
+    args = parser.parse_args()
+
+    songs = args.songs if args.songs is not None else max(1, args.events // 10)
+    data_dir = args.data_dir or os.path.join("bench_data", str(args.events))
+    prepare_data(data_dir, args.events, songs, args.songs_per_file)
+
+    results = run_preprocess(data_dir, args.preprocess, args.preprocess_files) if args.preprocess else {}
+    conn = connect(args.dsn)
+    try:
+        log_jsonpath = args.log_jsonpath or os.path.join(data_dir, "log_json_path.json")
+        results.update(run_pipeline(conn, data_dir, args.workers, log_jsonpath))
+    finally:
+        conn.close()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    scale = str(args.events)
+
+    if args.save_baseline:
+        baselines[scale] = results
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        logger.info(f"Saved baseline for {scale} events to {args.baseline}")
+    elif scale in baselines:
+        regressions = compare_to_baseline(results, baselines[scale], args.tolerance)
+        for stage, before, after, change in regressions:
+            logger.error(f"Regression in {stage}: {before:.0f} -> {after:.0f} rows/sec ({change:.0%})")
+        if regressions:
+            sys.exit(1)
+        logger.info(f"No regressions against the {scale}-event baseline")
+    else:
+        logger.info(f"No baseline for {scale} events; run with --save-baseline to record one")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
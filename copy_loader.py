@@ -0,0 +1,147 @@
+import heapq
+import json
+import logging
+from scheduler import QueryTask # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def parse_s3_url(url):
+    """
+    Splits an `s3://bucket/prefix` URL (optionally quoted, as in dwh.cfg) into bucket and prefix.
+    """
+    url = url.strip().strip("'\"")
+    if not url.startswith("s3://"):
+        raise ValueError(f"Not an S3 URL: {url}")
+    bucket, _, prefix = url[len("s3://"):].partition("/")
+    return bucket, prefix
+
+
+def list_objects(s3, bucket, prefix, suffix=".json"):
+    """
+    Lists every object under `prefix` ending with `suffix` as (key, size) pairs.
+    `s3` is a boto3 S3 client.
+    """
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(suffix) and obj["Size"] > 0:
+                objects.append((obj["Key"], obj["Size"]))
+    return objects
+
+
+def shard_objects(objects, num_shards):
+    """
+    Splits (key, size) pairs into at most `num_shards` shards of roughly equal total size.
+
+    Objects are placed largest first (ties by key, so the result does not depend on
+    the listing order) onto the currently lightest shard, which keeps the heaviest
+    shard within one object of the average.
+    """
+    num_shards = max(1, min(num_shards, len(objects)))
+    heap = [(0, i) for i in range(num_shards)]
+    shards = [[] for _ in range(num_shards)]
+    for key, size in sorted(objects, key=lambda obj: (-obj[1], obj[0])):
+        total, i = heapq.heappop(heap)
+        shards[i].append((key, size))
+        heapq.heappush(heap, (total + size, i))
+    return [shard for shard in shards if shard]
+
+
+def build_manifest(bucket, shard):
+    """
+    Returns the COPY manifest document for one shard.
+    """
+    return {
+        "entries": [
+            {"url": f"s3://{bucket}/{key}", "mandatory": True, "meta": {"content_length": size}}
+            for key, size in shard
+        ]
+    }
+
+
+def write_manifests(s3, bucket, shards, manifest_url, table):
+    """
+    Uploads one manifest per shard under `manifest_url` and returns their S3 URLs.
+    """
+    manifest_bucket, manifest_prefix = parse_s3_url(manifest_url)
+    manifest_prefix = manifest_prefix.rstrip("/")
+    urls = []
+    for i, shard in enumerate(shards):
+        key = f"{manifest_prefix}/{table}/shard-{i:04d}.manifest".lstrip("/")
+        s3.put_object(Bucket=manifest_bucket, Key=key, Body=json.dumps(build_manifest(bucket, shard)).encode("utf-8"))
+        urls.append(f"s3://{manifest_bucket}/{key}")
+    return urls
+
+
+def read_shard_plan(s3, plan_url):
+    """
+    The manifest URLs recorded at `plan_url`, or None if no plan was written there.
+    """
+    bucket, key = parse_s3_url(plan_url)
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body)["manifests"]
+
+
+def shard_plan_url(manifest_url, table, run_id=None):
+    """
+    Where `plan_sharded_copies` saves the shard plan of `table` for `run_id`.
+    """
+    manifest_bucket, manifest_prefix = parse_s3_url(manifest_url)
+    return f"s3://{manifest_bucket}/" + "/".join(filter(None, [manifest_prefix.strip("/"), run_id, table, "shards.json"]))
+
+
+def planned_objects(s3, plan_url):
+    """
+    The (key, size) pairs listed in the shard manifests recorded at `plan_url`, or None
+    if no plan was written there.
+    """
+    urls = read_shard_plan(s3, plan_url)
+    if urls is None:
+        return None
+    objects = []
+    for url in urls:
+        bucket, key = parse_s3_url(url)
+        manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+        objects.extend((parse_s3_url(entry["url"])[1], entry["meta"]["content_length"]) for entry in manifest["entries"])
+    return objects
+
+
+def plan_sharded_copies(s3, copy_sources, manifest_url, num_shards, run_id=None):
+    """
+    Lists, shards and writes manifests for every staging table in `copy_sources`.
+
+    `copy_sources` holds (table, source S3 URL, COPY template) triples; the template
+    takes the manifest URL as `{manifest}`. Returns one QueryTask per shard.
+
+    With `run_id`, the manifests go under `manifest_url/<run_id>/` and each table's list
+    of them is saved last, as `shards.json`. A resumed run reuses that plan instead of
+    listing the sources again, so its shards hold the same files as the steps already done.
+    """
+    manifest_bucket, manifest_prefix = parse_s3_url(manifest_url)
+    manifest_prefix = "/".join(filter(None, [manifest_prefix.strip("/"), run_id]))
+    manifest_url = f"s3://{manifest_bucket}/{manifest_prefix}"
+    tasks = []
+    for table, source_url, template in copy_sources:
+        plan_url = shard_plan_url(manifest_url, table)
+        urls = read_shard_plan(s3, plan_url) if run_id else None
+        if urls is not None:
+            logger.info(f"{table}: reusing the {len(urls)} shards planned for run {run_id}")
+        else:
+            bucket, prefix = parse_s3_url(source_url)
+            objects = list_objects(s3, bucket, prefix)
+            shards = shard_objects(objects, num_shards)
+            total = sum(size for _, size in objects)
+            logger.info(f"{table}: {len(objects)} files, {total} bytes in {len(shards)} shards")
+            urls = write_manifests(s3, bucket, shards, manifest_url, table)
+            if run_id:
+                plan_bucket, plan_key = parse_s3_url(plan_url)
+                s3.put_object(Bucket=plan_bucket, Key=plan_key, Body=json.dumps({"manifests": urls}).encode("utf-8"))
+        for i, url in enumerate(urls):
+            # Shards only append to their table, so they carry no dependencies on each other
+            tasks.append(QueryTask(f"{table}-shard-{i:04d}", template.format(manifest=url)))
+    return tasks
@@ -1,125 +1,77 @@
-import configparser
-import psycopg2 # type: ignore
 import logging
-import pandas as pd # type: ignore
-from sql_queries import create_table_queries, drop_table_queries # type: ignore
+from sql_queries import create_table_queries, drop_table_queries, calendar_pregenerate_query # type: ignore
+from instrumentation import MetricsRecorder, execute, report # type: ignore
+from db import pool_from_config # type: ignore
+from aggregates import AGGREGATES, create_aggregates, drop_aggregates, enabled_aggregates # type: ignore
+from dwh_config import load_config # type: ignore
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def drop_tables(cur, conn):
+def drop_tables(cur, conn, metrics=None):
     """
     Drops each table using the queries in `drop_table_queries` list.
     """
     for query in drop_table_queries:
         try:
-            logger.info(f"Dropping table with query: {query}")
-            cur.execute(query)
-            conn.commit()
-            logger.info("Table dropped successfully")
+            execute(cur, conn, query, metrics)
         except Exception as e:
             logger.error(f"Error dropping table: {e}")
             conn.rollback()
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, metrics=None):
     """
     Creates each table using the queries in `create_table_queries` list.
     """
     for query in create_table_queries:
         try:
-            logger.info(f"Creating table with query: {query}")
-            cur.execute(query)
-            conn.commit()
-            logger.info("Table created successfully")
+            execute(cur, conn, query, metrics)
         except Exception as e:
             logger.error(f"Error creating table: {e}")
             conn.rollback()
 
-def read_dwh_config(file_path):
-    """
-    Reads the configuration file and returns a DataFrame with configuration parameters.
-    """
-    config = configparser.ConfigParser()
-    config.read_file(open(file_path))
-
-    data = {
-        "Param": ["KEY", "SECRET", "DWH_CLUSTER_TYPE", "DWH_NUM_NODES", "DWH_NODE_TYPE", "DWH_CLUSTER_IDENTIFIER", "DWH_DB", "DWH_DB_USER", "DWH_DB_PASSWORD", "DWH_PORT", "DWH_IAM_ROLE_NAME", "DWH_ENDPOINT"],
-        "Value": [
-            config.get('AWS', 'KEY'),
-            config.get('AWS', 'SECRET'),
-            config.get("DWH", "DWH_CLUSTER_TYPE"),
-            config.get("DWH", "DWH_NUM_NODES"),
-            config.get("DWH", "DWH_NODE_TYPE"),
-            config.get("DWH", "DWH_CLUSTER_IDENTIFIER"),
-            config.get("DWH", "DWH_DB"),
-            config.get("DWH", "DWH_DB_USER"),
-            config.get("DWH", "DWH_DB_PASSWORD"),
-            config.get("DWH", "DWH_PORT"),
-            config.get("DWH", "DWH_IAM_ROLE_NAME"),
-            config.get("DWH", "DWH_ENDPOINT")
-        ]
-    }
-
-    return pd.DataFrame(data)
-
-def get_config_value(df, param_name):
-    """
-    Retrieves a configuration value from the DataFrame given the parameter name.
-    """
-    value = df[df['Param'] == param_name]['Value']
-    if not value.empty:
-        return value.values[0]
-    else:
-        raise ValueError(f"Parameter {param_name} not found in configuration.")
-
 def main():
     """
     - Reads the configuration file to get the Redshift cluster details.
     - Establishes a connection to the Redshift cluster.
     - Drops all the existing tables.
     - Creates all the tables needed for the analytics.
+    - With TIME_DIMENSION = calendar, pre-generates the hourly calendar once.
+    - Creates the materialized aggregates listed in AGGREGATES.
     - Closes the connection.
     """
-    config_file_path = 'dwh.cfg'
-    df = read_dwh_config(config_file_path)
-    
-    # Extract data from the configuration DataFrame
     try:
-        KEY                     = get_config_value(df, 'KEY')
-        SECRET                  = get_config_value(df, 'SECRET')
-        DWH_IAM_ROLE_NAME       = get_config_value(df, 'DWH_IAM_ROLE_NAME')
-        DWH_CLUSTER_TYPE        = get_config_value(df, 'DWH_CLUSTER_TYPE')
-        DWH_NUM_NODES           = get_config_value(df, 'DWH_NUM_NODES')
-        DWH_NODE_TYPE           = get_config_value(df, 'DWH_NODE_TYPE')
-        DWH_CLUSTER_IDENTIFIER  = get_config_value(df, 'DWH_CLUSTER_IDENTIFIER')
-        DWH_DB                  = get_config_value(df, 'DWH_DB')
-        DWH_DB_USER             = get_config_value(df, 'DWH_DB_USER')
-        DWH_DB_PASSWORD         = get_config_value(df, 'DWH_DB_PASSWORD')
-        DWH_PORT                = get_config_value(df, 'DWH_PORT')
-        DWH_ENDPOINT            = get_config_value(df, 'DWH_ENDPOINT')
-    except ValueError as e:
+        config = load_config()
+    except (OSError, ValueError) as e:
         logger.error(e)
         exit(1)
 
-    # Create the connection string
-    conn_string = f"postgresql://{DWH_DB_USER}:{DWH_DB_PASSWORD}@{DWH_ENDPOINT}:{DWH_PORT}/{DWH_DB}"
+    pool = pool_from_config(config, maxconn=1)
+    metrics = MetricsRecorder.from_config(config)
 
     try:
         logger.info("Connecting to Redshift")
-        conn = psycopg2.connect(conn_string)
-        cur = conn.cursor()
-        logger.info("Connection established")
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            logger.info("Connection established")
 
-        logger.info("Dropping tables")
-        drop_tables(cur, conn)
-        logger.info("Creating tables")
-        create_tables(cur, conn)
+            logger.info("Dropping tables")
+            drop_aggregates(cur, conn, AGGREGATES, metrics)
+            drop_tables(cur, conn, metrics)
+            logger.info("Creating tables")
+            create_tables(cur, conn, metrics)
+            if config.time_dimension == 'calendar':
+                logger.info(f"Generating the calendar from {config.calendar_start} to {config.calendar_end}")
+                execute(cur, conn, calendar_pregenerate_query(config.calendar_start, config.calendar_end), metrics, label="INSERT calendar")
+            logger.info("Creating aggregates")
+            create_aggregates(cur, conn, enabled_aggregates(config), metrics)
     except Exception as e:
         logger.error(f"Error in main process: {e}")
     finally:
-        conn.close()
+        pool.closeall()
         logger.info("Connection closed")
+        report(metrics, config, "create_table")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
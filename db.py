@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2 # type: ignore
+from psycopg2 import extensions # type: ignore
+from backoff import retry # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def connect(conn_string, statement_timeout_ms=0, query_group=None, retries=5, backoff=1.0, max_backoff=30.0):
+    """
+    Opens a connection, retrying with jittered exponential backoff, and applies the session settings.
+
+    `statement_timeout_ms` (0 disables it) cancels runaway statements; `query_group`
+    routes the session's queries to the matching Redshift WLM queue.
+    """
+    def on_retry(attempt, error, delay):
+        logger.warning(f"Connection attempt {attempt} failed ({error}), retrying in {delay:.1f}s")
+
+    conn = retry(lambda: psycopg2.connect(conn_string), exceptions=(psycopg2.OperationalError,),
+                 attempts=retries, base=backoff, cap=max_backoff, on_retry=on_retry)
+    cur = conn.cursor()
+    if statement_timeout_ms:
+        cur.execute("SET statement_timeout TO %s", (int(statement_timeout_ms),))
+    if query_group:
+        cur.execute("SET query_group TO %s", (query_group,))
+    cur.close()
+    conn.commit()
+    return conn
+
+
+class ConnectionPool:
+    """
+    A bounded, thread-safe pool of connections sharing one set of session settings.
+
+    `getconn` blocks while `maxconn` connections are checked out. Connections idle for
+    longer than `health_check_interval` seconds are pinged before being handed out and
+    replaced if they are dead. Keyword arguments are passed on to `connect`.
+    """
+    def __init__(self, conn_string, maxconn=4, health_check_interval=30.0, **session):
+        self.conn_string = conn_string
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.session = session
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding dead pooled connection: {e}")
+            return False
+
+    def getconn(self):
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, idle_since = self._idle.pop()
+                if self._healthy(conn, idle_since):
+                    return conn
+                self._close_quietly(conn)
+            return connect(self.conn_string, **self.session)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """
+        Returns `conn` to the pool, rolling back any open transaction. Broken or
+        discarded connections are closed and their slot freed for a fresh one.
+        """
+        try:
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            if discard or conn.closed or self._closed:
+                self._close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        except Exception as e:
+            logger.warning(f"Discarding pooled connection: {e}")
+            self._close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection for the duration of a `with` block.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            self.putconn(conn, discard=True)
+            raise
+        except Exception:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        self._closed = True
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def pool_from_config(config, maxconn=None):
+    """
+    Creates a ConnectionPool for the cluster in `config`, sized and tuned by the `[ETL]`
+    options POOL_SIZE, STATEMENT_TIMEOUT_MS, QUERY_GROUP and CONNECT_RETRIES.
+    """
+    return ConnectionPool(
+        config.conn_string,
+        maxconn=maxconn or config.pool_size,
+        statement_timeout_ms=config.getint('ETL', 'STATEMENT_TIMEOUT_MS', fallback=0),
+        query_group=config.get('ETL', 'QUERY_GROUP', fallback='') or None,
+        retries=config.getint('ETL', 'CONNECT_RETRIES', fallback=5),
+    )
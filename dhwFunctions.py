@@ -1,8 +1,7 @@
 import json
 import boto3            # type: ignore
-import configparser
-import pandas as pd     # type: ignore
 import time
+from backoff import backoff_delays # type: ignore
 
 
 class AWSClients:
@@ -51,48 +50,26 @@ class AWSClients:
                                           aws_secret_access_key=self.secret)
         return self._redshift
     
-def read_dwh_config(file_path):
-    config = configparser.ConfigParser()
-    config.read_file(open(file_path))
-
-    data = {
-        "Param": ["KEY", "SECRET", "DWH_CLUSTER_TYPE", "DWH_NUM_NODES", "DWH_NODE_TYPE", "DWH_CLUSTER_IDENTIFIER", "DWH_DB", "DWH_DB_USER", "DWH_DB_PASSWORD", "DWH_PORT", "DWH_IAM_ROLE_NAME"],
-        "Value": [
-            config.get('AWS', 'KEY'),
-            config.get('AWS', 'SECRET'),
-            config.get("DWH", "DWH_CLUSTER_TYPE"),
-            config.get("DWH", "DWH_NUM_NODES"),
-            config.get("DWH", "DWH_NODE_TYPE"),
-            config.get("DWH", "DWH_CLUSTER_IDENTIFIER"),
-            config.get("DWH", "DWH_DB"),
-            config.get("DWH", "DWH_DB_USER"),
-            config.get("DWH", "DWH_DB_PASSWORD"),
-            config.get("DWH", "DWH_PORT"),
-            config.get("DWH", "DWH_IAM_ROLE_NAME")
-        ]
-    }
-
-    return pd.DataFrame(data)
-
 def prettyRedshiftProps(props):
+    import pandas as pd # type: ignore
     pd.set_option('display.max_colwidth', None)  # Use None instead of -1
     keysToShow = ["ClusterIdentifier", "NodeType", "ClusterStatus", "MasterUsername", "DBName", "Endpoint", "NumberOfNodes", 'VpcId']
     x = [(k, v) for k,v in props.items() if k in keysToShow]
     return pd.DataFrame(data=x, columns=["Key", "Value"])
 
-def cleanup_resources(redshift, iam, cluster_identifier, iam_role_name):
+def cleanup_resources(redshift, iam, cluster_identifier, iam_role_name, sleep=time.sleep):
     try:
         print("Deleting the Redshift cluster...")
         redshift.delete_cluster(ClusterIdentifier=cluster_identifier, SkipFinalClusterSnapshot=True)
         
-        # Wait for the cluster to be deleted
-        while True:
+        # Wait for the cluster to be deleted, backing off between checks
+        for delay in backoff_delays(base=5.0, cap=60.0):
             try:
                 myClusterProps = redshift.describe_clusters(ClusterIdentifier=cluster_identifier)['Clusters'][0]
                 df = prettyRedshiftProps(myClusterProps)
                 print(df)
-                print("Waiting for the cluster to be deleted...")
-                time.sleep(30)
+                print(f"Waiting for the cluster to be deleted, next check in {delay:.0f}s...")
+                sleep(max(1.0, delay))
             except redshift.exceptions.ClusterNotFoundFault:
                 print("Cluster deleted successfully.")
                 break
@@ -0,0 +1,197 @@
+import configparser
+import os
+from datetime import date
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+CONFIG_FILE = 'dwh.cfg'
+
+CLUSTER_TYPES = ("single-node", "multi-node")
+
+PREPROCESS_FORMATS = ("parquet", "csv")
+
+TIME_DIMENSIONS = ("events", "calendar")
+
+SONGPLAY_SLICES = ("none", "day", "month")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def env_var_name(section, option):
+    """
+    The environment variable overriding `option` in `section`: DWH_DB_PASSWORD for
+    [DWH] DWH_DB_PASSWORD, AWS_KEY for [AWS] KEY, ETL_POOL_SIZE for [ETL] POOL_SIZE.
+    """
+    name = option.upper().replace(".", "_")
+    prefix = section.upper() + "_"
+    return name if name.startswith(prefix) else prefix + name
+
+
+@dataclass(frozen=True)
+class DwhConfig:
+    """
+    The typed contents of dwh.cfg. The cluster, S3 and IAM settings are fields; the
+    remaining sections ([ETL], [VALIDATION]) are read through the configparser-style
+    accessors (`config['ETL']`, `get`, `getint`, `getboolean`, `items`, `has_section`), so the
+    object can be passed anywhere a ConfigParser was expected.
+    """
+    key: str = field(repr=False)
+    secret: str = field(repr=False)
+    region: str
+    cluster_type: str
+    num_nodes: int
+    node_type: str
+    iam_role_name: str
+    cluster_identifier: str
+    db: str
+    db_user: str
+    db_password: str = field(repr=False)
+    port: int
+    endpoint: str
+    log_data: str
+    log_jsonpath: str
+    song_data: str
+    manifest_prefix: str
+    preprocessed_prefix: str
+    preprocess_format: str
+    time_dimension: str
+    calendar_start: str
+    calendar_end: str
+    songplay_slice: str
+    pool_size: int
+    insert_workers: int
+    copy_workers: int
+    role_arn: str
+    parser: configparser.ConfigParser = field(compare=False, repr=False)
+
+    @property
+    def conn_string(self):
+        return f"postgresql://{self.db_user}:{self.db_password}@{self.endpoint}:{self.port}/{self.db}"
+
+    def __getitem__(self, section):
+        return self.parser[section]
+
+    def get(self, section, option, **kwargs):
+        return self.parser.get(section, option, **kwargs)
+
+    def getint(self, section, option, **kwargs):
+        return self.parser.getint(section, option, **kwargs)
+
+    def getboolean(self, section, option, **kwargs):
+        return self.parser.getboolean(section, option, **kwargs)
+
+    def has_section(self, section):
+        return self.parser.has_section(section)
+
+    def items(self, section):
+        return self.parser.items(section)
+
+
+def apply_env_overrides(parser, environ):
+    for section in parser.sections():
+        for option in parser.options(section):
+            value = environ.get(env_var_name(section, option))
+            if value is not None:
+                parser.set(section, option, value)
+
+
+def _positive_int(section, option, value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ConfigError(f"[{section}] {option} must be an integer, got {value!r}") from None
+    if number <= 0:
+        raise ConfigError(f"[{section}] {option} must be positive, got {number}")
+    return number
+
+
+def parse_config(parser):
+    """
+    Builds a DwhConfig from `parser`, raising ConfigError for missing or invalid settings.
+    """
+    def get(section, option, required=False):
+        if not parser.has_option(section, option):
+            raise ConfigError(f"Parameter {option} not found in section [{section}] of the configuration.")
+        value = parser.get(section, option)
+        if required and not value:
+            raise ConfigError(f"Parameter {option} in section [{section}] must not be empty.")
+        return value
+
+    cluster_type = get('DWH', 'DWH_CLUSTER_TYPE', required=True)
+    if cluster_type not in CLUSTER_TYPES:
+        raise ConfigError(f"[DWH] DWH_CLUSTER_TYPE must be one of {', '.join(CLUSTER_TYPES)}, got {cluster_type!r}")
+
+    preprocess_format = parser.get('ETL', 'PREPROCESS_FORMAT', fallback='parquet').lower()
+    if preprocess_format not in PREPROCESS_FORMATS:
+        raise ConfigError(f"[ETL] PREPROCESS_FORMAT must be one of {', '.join(PREPROCESS_FORMATS)}, got {preprocess_format!r}")
+
+    time_dimension = parser.get('ETL', 'TIME_DIMENSION', fallback='events').lower()
+    if time_dimension not in TIME_DIMENSIONS:
+        raise ConfigError(f"[ETL] TIME_DIMENSION must be one of {', '.join(TIME_DIMENSIONS)}, got {time_dimension!r}")
+    calendar = []
+    for option, default in (('CALENDAR_START', '2018-01-01'), ('CALENDAR_END', '2028-12-31')):
+        value = parser.get('ETL', option, fallback=default)
+        try:
+            calendar.append(date.fromisoformat(value).isoformat())
+        except ValueError:
+            raise ConfigError(f"[ETL] {option} must be a YYYY-MM-DD date, got {value!r}") from None
+
+    songplay_slice = parser.get('ETL', 'SONGPLAY_SLICE', fallback='none').lower()
+    if songplay_slice not in SONGPLAY_SLICES:
+        raise ConfigError(f"[ETL] SONGPLAY_SLICE must be one of {', '.join(SONGPLAY_SLICES)}, got {songplay_slice!r}")
+
+    # The main connection holds one pooled slot for the whole run, so the DAG workers
+    # need the rest; with no slot left for them every task would wait forever
+    workers = {}
+    for option, default in (('POOL_SIZE', '5'), ('INSERT_WORKERS', '1'), ('COPY_WORKERS', '4')):
+        workers[option] = _positive_int('ETL', option, parser.get('ETL', option, fallback=default))
+    if workers['POOL_SIZE'] <= max(workers['INSERT_WORKERS'], workers['COPY_WORKERS']):
+        raise ConfigError(f"[ETL] POOL_SIZE must be greater than INSERT_WORKERS and COPY_WORKERS, got "
+                          f"{workers['POOL_SIZE']} for {workers['INSERT_WORKERS']} insert and "
+                          f"{workers['COPY_WORKERS']} copy workers")
+
+    return DwhConfig(
+        key=get('AWS', 'KEY'),
+        secret=get('AWS', 'SECRET'),
+        region=get('DWH', 'REGION', required=True),
+        cluster_type=cluster_type,
+        num_nodes=_positive_int('DWH', 'DWH_NUM_NODES', get('DWH', 'DWH_NUM_NODES')),
+        node_type=get('DWH', 'DWH_NODE_TYPE', required=True),
+        iam_role_name=get('DWH', 'DWH_IAM_ROLE_NAME', required=True),
+        cluster_identifier=get('DWH', 'DWH_CLUSTER_IDENTIFIER', required=True),
+        db=get('DWH', 'DWH_DB', required=True),
+        db_user=get('DWH', 'DWH_DB_USER', required=True),
+        db_password=get('DWH', 'DWH_DB_PASSWORD', required=True),
+        port=_positive_int('DWH', 'DWH_PORT', get('DWH', 'DWH_PORT')),
+        endpoint=get('DWH', 'DWH_ENDPOINT'),
+        log_data=get('S3', 'LOG_DATA', required=True),
+        log_jsonpath=get('S3', 'LOG_JSONPATH', required=True),
+        song_data=get('S3', 'SONG_DATA', required=True),
+        manifest_prefix=parser.get('S3', 'MANIFEST_PREFIX', fallback=''),
+        preprocessed_prefix=parser.get('S3', 'PREPROCESSED_PREFIX', fallback=''),
+        preprocess_format=preprocess_format,
+        time_dimension=time_dimension,
+        calendar_start=calendar[0],
+        calendar_end=calendar[1],
+        songplay_slice=songplay_slice,
+        pool_size=workers['POOL_SIZE'],
+        insert_workers=workers['INSERT_WORKERS'],
+        copy_workers=workers['COPY_WORKERS'],
+        role_arn=get('IAM_ROLE', 'ARN'),
+        parser=parser,
+    )
+
+
+@lru_cache(maxsize=None)
+def load_config(path=CONFIG_FILE):
+    """
+    Reads `path` once per process, applies environment variable overrides (see
+    `env_var_name`) and returns the validated DwhConfig.
+    """
+    parser = configparser.ConfigParser()
+    with open(path) as f:
+        parser.read_file(f)
+    apply_env_overrides(parser, os.environ)
+    return parse_config(parser)
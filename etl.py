@@ -1,7 +1,22 @@
-import configparser
-import psycopg2 # type: ignore
+import argparse
+import sys
 import logging
-from sql_queries import copy_table_queries, insert_table_queries # type: ignore
+from sql_queries import (STAGING_SOURCES, copy_table_sources_for, insert_table_steps, insert_steps_for, # type: ignore
+                         songplay_slice_steps, songplay_ts_range, time_slices, unmatched_events_count, unmatched_events_sample,
+                         full_load_copy_query, reconcile_steps, songplays_pending_count)
+from scheduler import QueryTask # type: ignore
+from copy_loader import plan_sharded_copies, planned_objects, shard_plan_url # type: ignore
+from dhwFunctions import AWSClients # type: ignore
+from incremental import list_log_objects, load_incremental, seed_incremental_state # type: ignore
+from instrumentation import MetricsRecorder, execute, report # type: ignore
+from validation import ValidationError, read_thresholds, validate # type: ignore
+from db import pool_from_config # type: ignore
+from aggregates import enabled_aggregates, refresh_aggregates # type: ignore
+from query_cache import mark_loaded # type: ignore
+from dwh_config import load_config # type: ignore
+from run_ledger import RunInProgress, RunLedger, StepFailed, run_dag_steps, run_step # type: ignore
+from maintenance import analyze_tables, touched_tables, truncate_staging, vacuum_tables # type: ignore
+from explain import check_plans # type: ignore
 
 # Configure logging
 logging.basicConfig(
@@ -12,89 +27,293 @@ logging.basicConfig(
     ]
 )
 
-def load_staging_tables(cur, conn):
+def _rolling_back(conn, func):
     """
-    Loads data from S3 into the staging tables on Redshift.
+    Wraps `func` so a failure rolls the connection back and it can be retried.
     """
-    for query in copy_table_queries:
+    def run():
         try:
-            logging.info(f"Executing query: {query}")
-            cur.execute(query)
-            conn.commit()
-            logging.info("Query executed successfully")
-        except Exception as e:
-            logging.error(f"Error executing query: {query}")
-            logging.error(e)
+            return func()
+        except Exception:
+            conn.rollback()
+            raise
+    return run
 
-def insert_tables(cur, conn):
+def _statement(cur, conn, query, metrics=None, label=None):
+    return _rolling_back(conn, lambda: execute(cur, conn, query, metrics, label=label)["rows"])
+
+def retry_options(config):
+    """
+    Attempts and backoff for each step, from STEP_ATTEMPTS, RETRY_BASE_SECONDS and RETRY_CAP_SECONDS in `[ETL]`.
+    """
+    return {
+        "attempts": config.getint('ETL', 'STEP_ATTEMPTS', fallback=3),
+        "base": float(config.get('ETL', 'RETRY_BASE_SECONDS', fallback='5')),
+        "cap": float(config.get('ETL', 'RETRY_CAP_SECONDS', fallback='60')),
+    }
+
+def open_ledger(config, conn):
+    """
+    The run ledger: a local SQLite file when LEDGER_PATH is set in `[ETL]`, otherwise
+    the etl_runs / etl_run_steps control tables on the cluster.
+    """
+    path = config.get('ETL', 'LEDGER_PATH', fallback='')
+    if path:
+        return RunLedger.sqlite(path)
+    ledger = RunLedger(conn)
+    ledger.ensure_tables()
+    return ledger
+
+def load_staging_tables(cur, conn, ledger, config, metrics=None, retries=None):
+    """
+    Loads data from S3 into the staging tables on Redshift, one ledger step per COPY.
+    """
+    for table in STAGING_SOURCES:
+        query = full_load_copy_query(config, table)
+        run_step(ledger, f"COPY {table}", _statement(cur, conn, query, metrics), **(retries or {}))
+
+def s3_client(config):
+    """
+    Returns a boto3 S3 client for the credentials and region in `config`.
+    """
+    aws_clients = AWSClients(key=config.key, secret=config.secret, region=config.region)
+    return aws_clients.s3.meta.client
+
+def load_staging_tables_concurrently(config, pool, ledger, metrics=None, retries=None):
+    """
+    Loads the staging tables through size-balanced manifest shards copied in parallel,
+    one ledger step per shard. The shard plan is kept per run, so --resume copies the
+    same shards.
+
+    Manifests are written under MANIFEST_PREFIX in the `[S3]` section; the shard
+    count and parallelism come from COPY_SHARDS and COPY_WORKERS in `[ETL]`.
+    """
+    tasks = plan_sharded_copies(
+        s3_client(config),
+        copy_table_sources_for(config),
+        config.manifest_prefix,
+        num_shards=config.getint('ETL', 'COPY_SHARDS', fallback=8),
+        run_id=ledger.run_id
+    )
+    if not tasks:
+        logging.warning("No source files found, nothing to copy")
+        return
+    run_dag_steps(ledger, tasks, pool, config.copy_workers, metrics, **(retries or {}))
+
+def insert_tables(cur, conn, ledger, metrics=None, steps=insert_table_steps, retries=None):
     """
     Inserts data from the staging tables into the analytics tables on Redshift.
     """
-    for query in insert_table_queries:
-        try:
-            logging.info(f"Executing query: {query}")
-            cur.execute(query)
-            conn.commit()
-            logging.info("Query executed successfully")
-        except Exception as e:
-            logging.error(f"Error executing query: {query}")
-            logging.error(e)
-
-def validate_counts(cur):
-    """
-    Validates the ETL process by counting the records in each table.
-    """
-    tables = [
-        "staging_events",
-        "staging_songs",
-        "songplays",
-        "users",
-        "songs",
-        "artists",
-        "time"
-    ]
-    
-    for table in tables:
-        cur.execute(f"SELECT COUNT(*) FROM {table}")
-        results = cur.fetchone()
-        logging.info(f"SELECT COUNT(*) FROM {table}: {results[0]}")
+    for name, query, _, _ in steps:
+        run_step(ledger, name, _statement(cur, conn, query, metrics, label=name), **(retries or {}))
+
+def insert_tables_concurrently(pool, max_workers, ledger, metrics=None, steps=insert_table_steps, retries=None):
+    """
+    Inserts data into the analytics tables, running independent queries at the same time.
 
-def main():
+    Each query declares the tables it reads and writes in `steps`;
+    queries with no dependency between them run on connections borrowed from
+    `pool`, up to `max_workers` at once.
     """
+    tasks = [QueryTask(name, query, reads, writes) for name, query, reads, writes in steps]
+    run_dag_steps(ledger, tasks, pool, max_workers, metrics, **(retries or {}))
+
+def songplay_steps(cur, conn, config):
+    """
+    The songplays insert split into SONGPLAY_SLICE (day or month) slices of the staged
+    events, each its own step and commit, or None to load it in one statement.
+    With SONGPLAY_SLICE_CONCURRENT, slices may run at the same time under INSERT_WORKERS.
+    """
+    if config.songplay_slice == 'none':
+        return None
+    cur.execute(songplay_ts_range)
+    min_ts, max_ts = cur.fetchone()
+    conn.rollback()
+    if min_ts is None:
+        return None
+    slices = time_slices(min_ts, max_ts, config.songplay_slice)
+    logging.info(f"Loading songplays in {len(slices)} {config.songplay_slice} slices")
+    return songplay_slice_steps(slices, config.getboolean('ETL', 'SONGPLAY_SLICE_CONCURRENT', fallback=False))
+
+def report_unmatched(cur, limit=10):
+    """
+    Logs how many NextSong events found no song on the match key, and the most played of them.
+    """
+    cur.execute(unmatched_events_count)
+    unmatched = cur.fetchone()[0]
+    logging.info(f"NextSong events without a matching song: {unmatched}")
+    if unmatched:
+        cur.execute(unmatched_events_sample, (limit,))
+        for song, artist, plays in cur.fetchall():
+            logging.info(f"  {plays:>6}  {artist} - {song}")
+    return unmatched
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load the Sparkify data warehouse from S3.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true",
+                      help="only load log partitions that arrived since the last run and merge them")
+    mode.add_argument("--reconcile", action="store_true",
+                      help="reload song_data and promote the pending events it now matches into songplays")
+    parser.add_argument("--report-unmatched", action="store_true",
+                        help="count and list the NextSong events that matched no song")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last run if it did not finish, skipping the steps it completed")
+    parser.add_argument("--force-resume", action="store_true",
+                        help="with --resume, continue the last run even if it is still marked running")
+    parser.add_argument("--explain", action="store_true",
+                        help="EXPLAIN every load statement without running it, report costly steps and "
+                             "exit non-zero on a full redistribution missing from the plan baseline")
+    parser.add_argument("--update-plan-baseline", action="store_true",
+                        help="with --explain, accept the current plans as the new baseline")
+    return parser.parse_args(argv)
+
+def explain_plans(config, pool, update=False):
+    """
+    Plans every load statement on the cluster and checks it against PLAN_BASELINE in `[ETL]`.
+    Returns True when a baseline exists and no statement gained a full redistribution.
+    """
+    with pool.connection() as conn:
+        return check_plans(conn.cursor(), conn, config.time_dimension,
+                           config.get('ETL', 'PLAN_BASELINE', fallback='plan_baseline.json'), update)
+
+def main(argv=None):
+    """
+    - With --explain, only plans the load statements and checks them against the baseline.
     - Reads the configuration file to get the Redshift cluster details.
-    - Establishes a connection to the Redshift cluster.
+    - Opens a connection pool to the Redshift cluster and the run ledger.
     - Loads data into staging tables.
-    - Inserts data into the analytics tables.
-    - Validates the ETL process.
-    - Closes the connection.
+    - Inserts data into the analytics tables, songplays in time slices when SONGPLAY_SLICE is set.
+    - Records the loaded log files and the watermark, so --incremental runs start from them.
+    - With --incremental, loads and merges only the new log partitions instead.
+    - With --reconcile, reloads song_data and promotes the pending events it now matches.
+    - Refreshes the materialized aggregates.
+    - Records every step in the ledger, retrying failures with backoff; with --resume,
+      steps already done by the last run are skipped if it did not finish.
+    - Validates counts and key quality.
+    - Analyzes the tables the run wrote, vacuums the ones left too unsorted and truncates staging.
+    - Exits non-zero when a step keeps failing or a threshold is breached.
+    - Closes the connections.
     """
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-    conn_string="postgresql://{}:{}@{}:{}/{}".format(config['DWH']['DWH_DB_USER'], config['DWH']['DWH_DB_PASSWORD'], config['DWH']['DWH_ENDPOINT'], config['DWH']['DWH_PORT'],config['DWH']['DWH_DB'])
+    args = parse_args(argv)
+    config = load_config()
+    pool = pool_from_config(config)
+    insert_workers = config.insert_workers
+    steps = insert_steps_for(config.time_dimension)
+    retries = retry_options(config)
+    metrics = MetricsRecorder.from_config(config)
+    ledger = None
+    failed = False
+
+    if args.explain:
+        try:
+            ok = explain_plans(config, pool, args.update_plan_baseline)
+        finally:
+            pool.closeall()
+        if not ok:
+            logging.error("Plan check failed; fix the layout or accept the plans with --update-plan-baseline")
+            sys.exit(1)
+        return
 
     try:
         logging.info("Connecting to Redshift")
-        conn = psycopg2.connect(conn_string)
-        cur = conn.cursor()
-        logging.info("Connection established")
+        with pool.connection() as conn:
+            cur = conn.cursor()
+            logging.info("Connection established")
+            ledger = open_ledger(config, conn)
+            ledger.start("incremental" if args.incremental else "reconcile" if args.reconcile else "full", resume=args.resume, force=args.force_resume)
+
+            manifest_prefix = config.manifest_prefix.strip("'\"")
+            if args.incremental:
+                if not manifest_prefix:
+                    raise ValueError("Incremental mode needs MANIFEST_PREFIX set in the [S3] section.")
+                logging.info("Loading new log partitions")
+                def incremental_load():
+                    files = load_incremental(cur, conn, s3_client(config), config, metrics)
+                    logging.info(f"Merged {files} new log files")
+                run_step(ledger, "incremental load", _rolling_back(conn, incremental_load), **retries)
+            elif args.reconcile:
+                logging.info("Loading song metadata")
+                run_step(ledger, "COPY staging_songs", _statement(cur, conn, full_load_copy_query(config, 'staging_songs'), metrics), **retries)
+                steps = reconcile_steps()
+                insert_tables(cur, conn, ledger, metrics, steps, retries)
+                cur.execute(songplays_pending_count)
+                logging.info(f"Events still waiting for song metadata: {cur.fetchone()[0]}")
+                conn.rollback()
+            else:
+                logging.info("Loading data into staging tables")
+                if manifest_prefix and not config.preprocessed_prefix:
+                    load_staging_tables_concurrently(config, pool, ledger, metrics, retries)
+                    # The shard manifests list exactly the log files this run copied
+                    log_objects = planned_objects(s3_client(config), shard_plan_url(manifest_prefix, 'staging_events', ledger.run_id)) or []
+                else:
+                    # Listed before the COPY: a file that lands during it is merged again by the
+                    # next incremental run rather than skipped. Preprocessed files may predate
+                    # the listing, so none are recorded and that run re-merges the recent months.
+                    log_objects = [] if config.preprocessed_prefix else list_log_objects(s3_client(config), config)
+                    load_staging_tables(cur, conn, ledger, config, metrics, retries)
+                logging.info("Data loaded into staging tables")
+                steps = insert_steps_for(config.time_dimension, songplay_steps(cur, conn, config))
 
-        logging.info("Loading data into staging tables")
-        load_staging_tables(cur, conn)
-        logging.info("Data loaded into staging tables")
+                logging.info("Inserting data into analytics tables")
+                if insert_workers > 1:
+                    insert_tables_concurrently(pool, insert_workers, ledger, metrics, steps, retries)
+                else:
+                    insert_tables(cur, conn, ledger, metrics, steps, retries)
+                logging.info("Data inserted into analytics tables")
+                run_step(ledger, "seed watermark", _rolling_back(conn, lambda: seed_incremental_state(cur, conn, log_objects)), **retries)
 
-        logging.info("Inserting data into analytics tables")
-        insert_tables(cur, conn)
-        logging.info("Data inserted into analytics tables")
+            aggregates = enabled_aggregates(config)
+            if aggregates:
+                logging.info("Refreshing aggregates")
+                run_step(ledger, "refresh aggregates", lambda: refresh_aggregates(cur, conn, aggregates, metrics), **retries)
 
-        logging.info("Validating data counts")
-        validate_counts(cur)
+            # Bump the load-commit marker of what this run wrote, so cached analytics results
+            # over those tables are recomputed and the rest stay cached
+            tables = touched_tables(steps, incremental=args.incremental)
+            loaded = tables + [aggregate.name for aggregate in aggregates]
+            run_step(ledger, "mark loaded", _rolling_back(conn, lambda: mark_loaded(cur, conn, loaded)), **retries)
 
-    except Exception as e:
-        logging.error("Error in ETL process")
+            if args.report_unmatched:
+                report_unmatched(cur)
+
+            logging.info("Validating the load")
+            validate(cur, read_thresholds(config), config.time_dimension)
+
+            logging.info("Running post-load maintenance")
+            run_step(ledger, "analyze", lambda: analyze_tables(cur, conn, tables, metrics), **retries)
+            vacuum_threshold = float(config.get('ETL', 'VACUUM_UNSORTED_PCT', fallback='10'))
+            def vacuum():
+                vacuumed = vacuum_tables(cur, conn, tables, vacuum_threshold, metrics)
+                logging.info(f"Vacuumed {', '.join(vacuumed) or 'no tables'}")
+            run_step(ledger, "vacuum", vacuum, **retries)
+            if config.getboolean('ETL', 'TRUNCATE_STAGING', fallback=True):
+                run_step(ledger, "truncate staging", _rolling_back(conn, lambda: truncate_staging(cur, conn, metrics)), **retries)
+            ledger.finish("success")
+
+    except StepFailed as e:
         logging.error(e)
+        logging.error(f"Run {ledger.run_id} stopped; fix the cause and rerun with --resume to continue from {e.step}")
+        failed = True
+    except (ValidationError, RunInProgress) as e:
+        logging.error(e)
+        failed = True
+    except Exception:
+        logging.exception("Error in ETL process")
+        failed = True
     finally:
-        conn.close()
-        logging.info("Connection closed")
+        if failed and ledger is not None and ledger.run_id is not None:
+            try:
+                ledger.conn.rollback()
+                ledger.finish("failed")
+            except Exception as e:
+                logging.error(f"Could not record the failed run: {e}")
+        pool.closeall()
+        logging.info("Connections closed")
+        report(metrics, config, "etl")
+
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
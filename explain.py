@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import re
+from schema import TABLES_BY_NAME # type: ignore
+from sql_queries import incremental_merge_queries_for, insert_steps_for, songplay_integrity_query_for, table_stats_query_for # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# A plan step: `XN Hash Join DS_BCAST_INNER  (cost=0.00..1.23 rows=45 width=67)`, optionally after `->`
+PLAN_STEP = re.compile(
+    r"^(?P<indent>\s*)(?:->\s*)?(?P<operation>\S.*?)\s+"
+    r"\(cost=(?P<startup>[\d.]+)\.\.(?P<cost>[\d.]+) rows=(?P<rows>\d+) width=(?P<width>\d+)\)"
+)
+SCANNED_TABLE = re.compile(r"\bScan on (\w+)")
+DISTRIBUTION = re.compile(r"\b(DS_\w+)\b")
+
+# Join steps that move a whole table across the cluster; a new one fails the --explain check
+FULL_REDISTRIBUTION = ("DS_BCAST_INNER", "DS_DIST_BOTH")
+
+
+class PlanNode:
+    """
+    One step of a Redshift query plan, with the detail lines (Filter, Hash Cond, ...) under it.
+    `depth` is the step's indentation, so children are deeper than their parent.
+    """
+    def __init__(self, depth, operation, cost, rows, width):
+        self.depth = depth
+        self.operation = operation
+        self.cost = cost
+        self.rows = rows
+        self.width = width
+        self.details = []
+
+    @property
+    def distribution(self):
+        match = DISTRIBUTION.search(self.operation)
+        return match.group(1) if match else None
+
+    @property
+    def table(self):
+        match = SCANNED_TABLE.search(self.operation)
+        return match.group(1) if match else None
+
+    def __repr__(self):
+        return f"PlanNode({self.operation!r}, cost={self.cost}, rows={self.rows})"
+
+
+def parse_plan(text):
+    """
+    Parses the text of an EXPLAIN (one plan line per row, joined with newlines) into
+    PlanNodes in plan order. Lines that are neither steps nor details are ignored.
+    """
+    nodes = []
+    for line in text.splitlines():
+        match = PLAN_STEP.match(line)
+        if match:
+            nodes.append(PlanNode(len(match.group("indent")), match.group("operation").strip(),
+                                  float(match.group("cost")), int(match.group("rows")), int(match.group("width"))))
+        elif nodes and line.strip() and not line.strip().startswith("-----"):
+            nodes[-1].details.append(line.strip())
+    return nodes
+
+
+def plan_issues(nodes, tables=TABLES_BY_NAME):
+    """
+    Returns (kind, message) pairs for the expensive steps in `nodes`: full redistributions
+    (DS_BCAST_INNER, DS_DIST_BOTH), nested loops, and filtered scans of a sorted table in
+    `tables` that do not restrict its leading sort key column.
+    """
+    issues = []
+    for node in nodes:
+        if node.distribution in FULL_REDISTRIBUTION:
+            issues.append((node.distribution, f"{node.operation} moves {node.rows} rows (cost {node.cost:.0f})"))
+        if "Nested Loop" in node.operation:
+            issues.append(("NESTED_LOOP", f"{node.operation} (cost {node.cost:.0f})"))
+        table = tables.get(node.table)
+        filters = [detail for detail in node.details if detail.startswith("Filter:")]
+        if table is not None and table.sortkey and filters and not any(table.sortkey[0] in f for f in filters):
+            issues.append(("NO_SORT_KEY", f"{node.operation} filters without the {table.name} sort key {table.sortkey[0]}"))
+    return issues
+
+
+# `CREATE TEMP TABLE name AS SELECT ...`, which later statements of the same query read
+TEMP_TABLE_AS = re.compile(r"^CREATE\s+TEMP\s+TABLE\s+(\w+)\s+AS\s+(.*)$", re.IGNORECASE | re.DOTALL)
+EXPLAINABLE = re.compile(r"^(?:SELECT|INSERT|DELETE|UPDATE|WITH)\b", re.IGNORECASE)
+
+
+def split_statements(query):
+    return [statement.strip() for statement in query.split(";") if statement.strip()]
+
+
+def explain_targets(time_dimension='events'):
+    """
+    (name, statements) for every query the load and the incremental merge run, and the
+    validation queries.
+    """
+    queries = [(name, query) for name, query, _, _ in insert_steps_for(time_dimension)]
+    queries += [(f"merge{i}", query) for i, query in enumerate(incremental_merge_queries_for(time_dimension), 1)]
+    queries += [("validate_tables", table_stats_query_for(time_dimension)),
+                ("validate_songplays", songplay_integrity_query_for(time_dimension))]
+    return [(name, split_statements(query)) for name, query in queries]
+
+
+def explain(cur, statement):
+    cur.execute("EXPLAIN " + statement)
+    return "\n".join(row[0] for row in cur.fetchall())
+
+
+def explain_query(cur, name, statements):
+    """
+    EXPLAINs each statement of one query and returns (label, plan text) pairs, labelled
+    `name#1`, `name#2`, ... when there are several. The SELECT of a `CREATE TEMP TABLE ... AS`
+    is explained and the table created empty, so the statements reading it can be planned.
+    Other DDL is skipped. Nothing else is executed.
+    """
+    plans = []
+    for i, statement in enumerate(statements, 1):
+        label = name if len(statements) == 1 else f"{name}#{i}"
+        temp_table = TEMP_TABLE_AS.match(statement)
+        if temp_table:
+            table, select = temp_table.groups()
+            plans.append((label, explain(cur, select)))
+            cur.execute(f"CREATE TEMP TABLE {table} AS SELECT * FROM ({select}) t LIMIT 0")
+        elif EXPLAINABLE.match(statement):
+            plans.append((label, explain(cur, statement)))
+    return plans
+
+
+def redistribution_counts(issues):
+    counts = {}
+    for kind, _ in issues:
+        if kind in FULL_REDISTRIBUTION:
+            counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def read_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_baseline(path, report):
+    with open(path, "w") as f:
+        json.dump({label: redistribution_counts(issues) for label, _, issues in report}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def regressions(report, baseline):
+    """
+    Labels of statements with more full redistributions of a kind than `baseline` allows,
+    as (label, kind, count, allowed) tuples.
+    """
+    found = []
+    for label, _, issues in report:
+        allowed = baseline.get(label, {})
+        for kind, count in redistribution_counts(issues).items():
+            if count > allowed.get(kind, 0):
+                found.append((label, kind, count, allowed.get(kind, 0)))
+    return found
+
+
+def format_report(report):
+    lines = [f"{'statement':<28} {'cost':>14} {'rows':>12}  issues"]
+    for label, nodes, issues in report:
+        top = nodes[0] if nodes else None
+        lines.append(f"{label:<28} {top.cost if top else 0:>14.0f} {top.rows if top else 0:>12}  "
+                     f"{', '.join(sorted({kind for kind, _ in issues})) or '-'}")
+        for _, message in issues:
+            lines.append(f"    {message}")
+    return "\n".join(lines)
+
+
+def explain_all(cur, conn, time_dimension='events'):
+    """
+    EXPLAINs every target statement and returns (label, plan nodes, issues) per statement.
+    Each query's transaction is rolled back afterwards, dropping its empty temp tables.
+    """
+    report = []
+    for name, statements in explain_targets(time_dimension):
+        try:
+            plans = explain_query(cur, name, statements)
+        finally:
+            conn.rollback()
+        for label, text in plans:
+            nodes = parse_plan(text)
+            report.append((label, nodes, plan_issues(nodes)))
+    return report
+
+
+def check_plans(cur, conn, time_dimension, baseline_path, update=False):
+    """
+    Logs the per-statement cost report and compares the full redistributions with the
+    baseline at `baseline_path`, or writes the baseline when `update` is set. Returns
+    True when the plans are no worse than the baseline; a missing baseline fails.
+    """
+    report = explain_all(cur, conn, time_dimension)
+    logger.info("Plan report:\n" + format_report(report))
+    if update:
+        write_baseline(baseline_path, report)
+        logger.info(f"Wrote the plan baseline to {baseline_path}")
+        return True
+    baseline = read_baseline(baseline_path)
+    if baseline is None:
+        logger.error(f"No plan baseline at {baseline_path}; review the report and record one with --update-plan-baseline")
+        return False
+    found = regressions(report, baseline)
+    for label, kind, count, allowed in found:
+        logger.error(f"{label}: {count} {kind} step(s), baseline allows {allowed}")
+    return not found
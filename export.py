@@ -0,0 +1,230 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aggregates import AGGREGATES_BY_NAME # type: ignore
+from copy_loader import parse_s3_url # type: ignore
+from instrumentation import MetricsRecorder, execute, report # type: ignore
+from preprocess import EXTENSIONS, WRITERS # type: ignore
+from schema import TABLES_BY_NAME # type: ignore
+
+logger = logging.getLogger(__name__)
+
+UNLOAD_FORMATS = {"parquet": "FORMAT AS PARQUET", "csv": "FORMAT AS CSV\nHEADER\nGZIP"}
+
+# cursor.description type codes (Postgres OIDs, shared by Redshift) in schema.py spelling
+TYPE_OIDS = {16: "BOOLEAN", 20: "BIGINT", 21: "SMALLINT", 23: "INTEGER", 700: "REAL", 701: "DOUBLE PRECISION",
+             1082: "DATE", 1114: "TIMESTAMP", 1184: "TIMESTAMPTZ"}
+NUMERIC_OID = 1700
+
+
+def table_query(table_name):
+    """
+    `SELECT *` for a warehouse table or aggregate; other names are rejected.
+    """
+    if table_name not in TABLES_BY_NAME and table_name not in AGGREGATES_BY_NAME:
+        raise ValueError(f"Unknown table {table_name}")
+    return f"SELECT * FROM {table_name}"
+
+
+def description_types(description):
+    """
+    The SQL type of each result column in a DB-API `description`, so files get the
+    column types up front rather than guessing them from the first rows. NUMERIC
+    keeps its precision when the server reports it; other types are TEXT.
+    """
+    types = []
+    for column in description:
+        type_code, precision, scale = column[1], column[4], column[5]
+        if type_code == NUMERIC_OID and precision and precision > 0 and scale is not None and scale >= 0:
+            types.append(f"NUMERIC({precision},{scale})")
+        else:
+            types.append(TYPE_OIDS.get(type_code, "TEXT"))
+    return types
+
+
+def export_query(conn, sql, params, output_dir, name, file_format="csv", itersize=10_000, rows_per_file=1_000_000):
+    """
+    Streams the result of `sql` through a server-side (named) cursor into
+    `output_dir/name/part-NNNN` files of at most `rows_per_file` rows.
+
+    Rows are fetched `itersize` at a time and written straight out, so memory stays
+    constant whatever the size of the result. Returns (paths, rows written).
+    """
+    target = os.path.join(output_dir, name)
+    os.makedirs(target, exist_ok=True)
+    cur = conn.cursor(name=f"export_{name}")
+    cur.itersize = itersize
+    cur.execute(sql, params)
+
+    paths = []
+    writer = None
+    in_file = 0
+    total = 0
+    try:
+        while True:
+            rows = cur.fetchmany(itersize)
+            if not rows:
+                break
+            total += len(rows)
+            while rows:
+                if writer is None:
+                    path = os.path.join(target, f"part-{len(paths):04d}{EXTENSIONS[file_format]}")
+                    writer = WRITERS[file_format](path, columns=[c[0] for c in cur.description],
+                                                  types=description_types(cur.description))
+                    paths.append(path)
+                    in_file = 0
+                chunk, rows = rows[:rows_per_file - in_file], rows[rows_per_file - in_file:]
+                writer.write(chunk)
+                in_file += len(chunk)
+                if in_file == rows_per_file:
+                    writer.close()
+                    writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+        cur.close()
+        conn.rollback()
+    return paths, total
+
+
+def unload_prefix(unload_url):
+    return unload_url.strip("'\"").rstrip("/")
+
+
+def unload_sql(query, unload_url, name, iam_role, file_format="parquet", max_file_mb=256):
+    """
+    Renders the UNLOAD that writes `query`'s result to `unload_url/name/` in parallel from
+    every slice, with a manifest (`part_manifest`) listing the files this UNLOAD wrote.
+    """
+    target = f"{unload_prefix(unload_url)}/{name}/part_"
+    quoted = query.replace("'", "''")
+    return (f"UNLOAD ('{quoted}')\nTO '{target}'\nIAM_ROLE '{iam_role}'\n{UNLOAD_FORMATS[file_format]}\n"
+            f"MANIFEST\nALLOWOVERWRITE\nMAXFILESIZE {int(max_file_mb)} MB")
+
+
+def manifest_urls(s3, manifest_url):
+    """
+    The file URLs listed in the UNLOAD manifest at `manifest_url`.
+    """
+    bucket, key = parse_s3_url(manifest_url)
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    return [entry["url"] for entry in manifest["entries"]]
+
+
+def unload_and_download(conn, s3, sql, params, unload_url, name, iam_role, output_dir, file_format="parquet", metrics=None):
+    """
+    UNLOADs the result to S3, then downloads the files its manifest lists into
+    `output_dir/name/`, ignoring parts left under the prefix by earlier UNLOADs.
+    `s3` may point at a local S3 stand-in through its endpoint URL. Returns the local paths.
+    """
+    cur = conn.cursor()
+    query = cur.mogrify(sql, params).decode("utf-8") if params else sql
+    execute(cur, conn, unload_sql(query, unload_url, name, iam_role, file_format), metrics, label=f"UNLOAD {name}")
+
+    target = os.path.join(output_dir, name)
+    os.makedirs(target, exist_ok=True)
+    paths = []
+    for url in manifest_urls(s3, f"{unload_prefix(unload_url)}/{name}/part_manifest"):
+        bucket, key = parse_s3_url(url)
+        path = os.path.join(target, os.path.basename(key))
+        s3.download_file(bucket, key, path)
+        paths.append(path)
+    return paths
+
+
+def export_all(pool, jobs, output_dir, file_format, itersize, rows_per_file, max_workers, unload=None, metrics=None):
+    """
+    Exports several (name, sql, params) jobs at once, each on its own pooled connection.
+    With `unload` = (s3 client, unload URL, IAM role), the cluster writes the files to S3
+    and they are downloaded; otherwise they are streamed through named cursors.
+    Returns {name: (files, rows or None)}.
+    """
+    def run(job):
+        name, sql, params = job
+        start = time.perf_counter()
+        with pool.connection() as conn:
+            if unload:
+                s3, unload_url, iam_role = unload
+                paths, rows = unload_and_download(conn, s3, sql, params, unload_url, name, iam_role,
+                                                  output_dir, file_format, metrics), None
+            else:
+                paths, rows = export_query(conn, sql, params, output_dir, name, file_format, itersize, rows_per_file)
+        logger.info(f"Exported {name}: {rows if rows is not None else '?'} rows in {len(paths)} files "
+                    f"({time.perf_counter() - start:.1f}s)")
+        return name, (paths, rows)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(run, jobs))
+
+
+def s3_client(config):
+    """
+    The S3 client for downloads: the real one, or the stand-in at `[EXPORT] S3_ENDPOINT_URL`.
+    """
+    import boto3 # type: ignore
+    endpoint = config.get('EXPORT', 'S3_ENDPOINT_URL', fallback='') or None
+    return boto3.client('s3', region_name=config.region, endpoint_url=endpoint,
+                        aws_access_key_id=config.key or None, aws_secret_access_key=config.secret or None)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export warehouse tables or a query result to local files.")
+    parser.add_argument("tables", nargs="*", help="tables or aggregates to export")
+    parser.add_argument("--query", help="export this SQL instead (with --name)")
+    parser.add_argument("--param", action="append", default=[], help="a placeholder value for --query, in order")
+    parser.add_argument("--name", default="query", help="output folder name for --query")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="output format (default: [EXPORT] FORMAT)")
+    parser.add_argument("--output", help="output directory (default: [EXPORT] OUTPUT_DIR)")
+    parser.add_argument("--itersize", type=int, help="rows fetched per round trip")
+    parser.add_argument("--rows-per-file", type=int)
+    parser.add_argument("--workers", type=int, help="tables exported at once")
+    parser.add_argument("--unload", action="store_true", help="UNLOAD to [EXPORT] UNLOAD_PREFIX and download")
+    parser.add_argument("--dsn", help="connect here instead of the cluster in dwh.cfg")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Exports each table (or the --query result) in parallel, through named cursors or UNLOAD.
+    - Writes chunked Parquet or gzip CSV under the output directory, one folder per table.
+    """
+    from db import ConnectionPool, pool_from_config # type: ignore
+    from dwh_config import load_config # type: ignore
+
+    args = parse_args(argv)
+    config = load_config()
+    jobs = [(table, table_query(table), ()) for table in args.tables]
+    if args.query:
+        jobs.append((args.name, args.query, tuple(args.param)))
+    if not jobs:
+        raise SystemExit("Name at least one table or give --query.")
+
+    workers = args.workers or config.getint('EXPORT', 'WORKERS', fallback=4)
+    file_format = args.format or config.get('EXPORT', 'FORMAT', fallback='csv')
+    unload = None
+    if args.unload:
+        unload_url = config.get('EXPORT', 'UNLOAD_PREFIX', fallback='')
+        if not unload_url:
+            raise SystemExit("Set UNLOAD_PREFIX in the [EXPORT] section to use --unload.")
+        unload = (s3_client(config), unload_url, config.role_arn)
+
+    pool = ConnectionPool(args.dsn, maxconn=workers) if args.dsn else pool_from_config(config, maxconn=workers)
+    metrics = MetricsRecorder.from_config(config)
+    try:
+        export_all(pool, jobs,
+                   args.output or config.get('EXPORT', 'OUTPUT_DIR', fallback='exports'),
+                   file_format,
+                   args.itersize or config.getint('EXPORT', 'ITERSIZE', fallback=10_000),
+                   args.rows_per_file or config.getint('EXPORT', 'ROWS_PER_FILE', fallback=1_000_000),
+                   workers, unload, metrics)
+    finally:
+        pool.closeall()
+        report(metrics, config, "export")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
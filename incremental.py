@@ -0,0 +1,132 @@
+import logging
+from datetime import datetime, timezone
+from instrumentation import execute # type: ignore
+from copy_loader import parse_s3_url, list_objects, write_manifests # type: ignore
+from sql_queries import (control_table_queries, copy_table_sources_for, staging_events_truncate, incremental_merge_queries_for, # type: ignore
+                         watermark_select, ingested_keys_select, staging_events_max_ts, watermark_delete,
+                         watermark_insert, ingested_keys_insert, ingested_keys_delete, month_prefixes)
+
+logger = logging.getLogger(__name__)
+
+SOURCE = "log_data"
+
+
+def get_watermark(cur):
+    """
+    Returns the highest event `ts` (epoch milliseconds) loaded so far, or None before the first run.
+    """
+    cur.execute(watermark_select, (SOURCE,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def get_ingested_keys(cur):
+    """
+    Returns the set of S3 keys already loaded by earlier incremental runs.
+    """
+    cur.execute(ingested_keys_select, (SOURCE,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def find_new_objects(s3, source_url, watermark, ingested, now=None, lookback_months=1):
+    """
+    Lists the log partitions from `lookback_months` before the watermark's month onward
+    and returns the (key, size) pairs not ingested yet, so files that land late in a
+    recent month are still picked up. Without a watermark the whole prefix is listed.
+    """
+    bucket, prefix = parse_s3_url(source_url)
+    if watermark is None:
+        prefixes = [prefix]
+    else:
+        watermark_at = datetime.fromtimestamp(watermark / 1000, tz=timezone.utc)
+        month = watermark_at.year * 12 + watermark_at.month - 1 - lookback_months
+        since = datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        prefixes = month_prefixes(prefix, since, now or datetime.now(timezone.utc))
+
+    new_objects = []
+    for partition in prefixes:
+        new_objects.extend(obj for obj in list_objects(s3, bucket, partition) if obj[0] not in ingested)
+    return bucket, new_objects
+
+
+def list_log_objects(s3, config):
+    """
+    Lists the (key, size) pairs under the log_data prefix.
+    """
+    bucket, prefix = parse_s3_url(copy_table_sources_for(config)[0][1])
+    return list_objects(s3, bucket, prefix)
+
+
+def _record_state(cur, keys, max_ts):
+    from psycopg2.extras import execute_values # type: ignore
+    cur.execute(watermark_delete, (SOURCE,))
+    cur.execute(watermark_insert, (SOURCE, max_ts))
+    execute_values(cur, ingested_keys_insert, [(SOURCE, key) for key in keys], template="(%s, %s, GETDATE())")
+
+
+def seed_incremental_state(cur, conn, objects):
+    """
+    Called at the end of a full load, while `staging_events` still holds it: records the
+    log files it copied, `objects` as (key, size) pairs, as ingested and sets the
+    watermark to the latest event loaded, replacing whatever earlier runs recorded.
+    The next --incremental run then lists from there instead of reloading all history.
+    """
+    for query in control_table_queries:
+        cur.execute(query)
+    cur.execute(staging_events_max_ts)
+    max_ts = cur.fetchone()[0]
+    cur.execute(ingested_keys_delete, (SOURCE,))
+    _record_state(cur, [key for key, _ in objects], max_ts)
+    conn.commit()
+    logger.info(f"Recorded {len(objects)} loaded log files, watermark ts={max_ts}")
+
+
+def load_incremental(cur, conn, s3, config, metrics=None):
+    """
+    Loads only the log files that arrived since the last run and merges them into
+    `songplays`, `users` and the time dimension.
+
+    - Lists the new `YYYY/MM/` partitions and skips keys already recorded.
+    - Replaces the contents of `staging_events` with the new files (one manifest COPY).
+    - Deletes the matching fact/dimension rows and re-inserts them from staging.
+    - Records the new keys and high-water mark in the same transaction as the merge.
+
+    Events are matched against `staging_songs_keyed`, which keeps the song keys of the
+    last full or reconcile run; `staging_songs` itself is truncated after every run. The
+    sources, manifest prefix, time dimension and INCREMENTAL_LOOKBACK_MONTHS (in `[ETL]`,
+    default 1) come from `config`. Returns the number of new files loaded.
+    """
+    for query in control_table_queries:
+        cur.execute(query)
+    conn.commit()
+
+    watermark = get_watermark(cur)
+    ingested = get_ingested_keys(cur)
+    table, source_url, copy_template = copy_table_sources_for(config)[0]
+    lookback_months = config.getint('ETL', 'INCREMENTAL_LOOKBACK_MONTHS', fallback=1)
+    bucket, new_objects = find_new_objects(s3, source_url, watermark, ingested, lookback_months=lookback_months)
+    if not new_objects:
+        logger.info("No new log files since the last run")
+        return 0
+    logger.info(f"Loading {len(new_objects)} new log files (watermark ts={watermark})")
+
+    manifest = write_manifests(s3, bucket, [new_objects], config.manifest_prefix, f"{table}/incremental")[0]
+    try:
+        execute(cur, conn, staging_events_truncate, metrics)
+        execute(cur, conn, copy_template.format(manifest=manifest), metrics)
+
+        for query in incremental_merge_queries_for(config.time_dimension):
+            execute(cur, conn, query, metrics, commit=False)
+
+        cur.execute(staging_events_max_ts)
+        new_max = cur.fetchone()[0]
+        if watermark is not None and (new_max is None or new_max < watermark):
+            new_max = watermark
+        _record_state(cur, [key for key, _ in new_objects], new_max)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info(f"Incremental load complete, watermark ts={new_max}")
+    return len(new_objects)
@@ -0,0 +1,165 @@
+import json
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_TARGET = re.compile(
+    r"^\s*(?:CREATE\s+(?:TEMP\s+)?TABLE(?:\s+IF\s+NOT\s+EXISTS)?|DROP\s+TABLE(?:\s+IF\s+EXISTS)?|"
+    r"INSERT\s+INTO|DELETE\s+FROM|COPY|TRUNCATE|UPDATE|ANALYZE|VACUUM(?:\s+\w+\s+ONLY)?)\s+(\w+)",
+    re.IGNORECASE,
+)
+
+LOAD_COMMITS_QUERY = """
+    SELECT COUNT(DISTINCT filename), SUM(lines_scanned)
+    FROM stl_load_commits
+    WHERE query = pg_last_copy_id()
+"""
+
+QUERY_SUMMARY_QUERY = """
+    SELECT SUM(rows), SUM(bytes), MAX(CASE WHEN is_diskbased = 't' THEN 1 ELSE 0 END)
+    FROM svl_query_summary
+    WHERE query = %s
+"""
+
+
+def describe(query):
+    """
+    Returns a short label such as "INSERT songplays" or "COPY staging_events" for a statement.
+    """
+    verb = query.strip().split(None, 1)[0].upper() if query.strip() else "QUERY"
+    match = STATEMENT_TARGET.match(query)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+class MetricsRecorder:
+    """
+    Collects one record per executed statement and writes them out at the end of a run.
+
+    Records hold the label, wall time and `cur.rowcount`. With `redshift_stats`, they
+    also get the Redshift query id plus `stl_load_commits`/`svl_query_summary` figures,
+    at the cost of up to three catalog queries after each statement, so it is off by
+    default. Safe to share between threads.
+    """
+    def __init__(self, redshift_stats=False):
+        self.records = []
+        self.redshift_stats = redshift_stats
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        A recorder with the Redshift statistics switched on by METRICS_REDSHIFT_STATS in `[ETL]`.
+        """
+        return cls(redshift_stats=config.getboolean('ETL', 'METRICS_REDSHIFT_STATS', fallback=False))
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+
+    def write_prometheus(self, path):
+        """
+        Writes the records in the node_exporter textfile format.
+        """
+        lines = [
+            "# HELP etl_statement_seconds Wall time of each ETL statement.",
+            "# TYPE etl_statement_seconds gauge",
+        ]
+        for record in self.records:
+            lines.append(f'etl_statement_seconds{{statement="{record["label"]}",status="{record["status"]}"}} {record["seconds"]}')
+        lines += [
+            "# HELP etl_statement_rows Rows affected by each ETL statement.",
+            "# TYPE etl_statement_rows gauge",
+        ]
+        for record in self.records:
+            if record["rows"] is not None and record["rows"] >= 0:
+                lines.append(f'etl_statement_rows{{statement="{record["label"]}"}} {record["rows"]}')
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def write(self, path, format="json"):
+        if format == "prometheus":
+            self.write_prometheus(path)
+        else:
+            self.write_json(path)
+        logger.info(f"Wrote {len(self.records)} statement metrics to {path}")
+
+    def summary(self):
+        """
+        Returns the end-of-run summary table as a string.
+        """
+        lines = [f"{'statement':<36} {'status':<8} {'seconds':>10} {'rows':>12} {'query id':>10}"]
+        for r in self.records:
+            rows = "" if r["rows"] is None or r["rows"] < 0 else r["rows"]
+            lines.append(f"{r['label']:<36} {r['status']:<8} {r['seconds']:>10.3f} {rows:>12} {r.get('query_id') or '':>10}")
+        total = sum(r["seconds"] for r in self.records)
+        lines.append(f"{'total':<36} {'':<8} {total:>10.3f}")
+        return "\n".join(lines)
+
+
+def report(metrics, config, script):
+    """
+    Logs the summary table and, when METRICS_FILE is set in the `[ETL]` section of `config`,
+    writes the records there. `{script}` in the path is replaced with `script`, and
+    METRICS_FORMAT chooses between `json` (one record per line) and `prometheus`.
+    """
+    logger.info("Statement summary:\n" + metrics.summary())
+    path = config.get('ETL', 'METRICS_FILE', fallback='')
+    if path:
+        metrics.write(path.format(script=script), config.get('ETL', 'METRICS_FORMAT', fallback='json'))
+
+
+def _redshift_stats(cur, recorder, record):
+    """
+    Adds the Redshift query id and system-table stats to `record`. On anything that is
+    not Redshift the lookups fail once and are switched off for the rest of the run.
+    """
+    try:
+        cur.execute("SELECT pg_last_query_id()")
+        record["query_id"] = cur.fetchone()[0]
+        if record["label"].startswith("COPY"):
+            cur.execute(LOAD_COMMITS_QUERY)
+            record["files"], record["lines_scanned"] = cur.fetchone()
+        cur.execute(QUERY_SUMMARY_QUERY, (record["query_id"],))
+        record["rows_processed"], record["bytes_processed"], record["disk_based"] = cur.fetchone()
+    except Exception as e:
+        logger.debug(f"Redshift statistics unavailable: {e}")
+        recorder.redshift_stats = False
+
+
+def execute(cur, conn, query, metrics=None, label=None, commit=True):
+    """
+    Executes `query`, commits (unless `commit` is False) and records its timing and row count in `metrics`.
+
+    Errors are recorded and re-raised so callers keep their own error handling.
+    """
+    label = label or describe(query)
+    record = {"label": label, "status": "success", "rows": None, "started_at": time.time()}
+    logger.info(f"Executing query: {query}")
+    start = time.perf_counter()
+    try:
+        cur.execute(query)
+        record["rows"] = cur.rowcount
+        if commit:
+            conn.commit()
+    except Exception:
+        record["status"] = "error"
+        raise
+    finally:
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        if metrics is not None:
+            metrics.add(record)
+
+    logger.info(f"{label} executed successfully in {record['seconds']:.2f}s ({record['rows']} rows)")
+    if metrics is not None and metrics.redshift_stats and commit:
+        _redshift_stats(cur, metrics, record)
+        # The lookups are read-only; end their transaction whether or not they worked
+        conn.rollback()
+    return record
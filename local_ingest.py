@@ -0,0 +1,239 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from preprocess import column_casts, iter_input_files # type: ignore
+from schema import TABLES_BY_NAME # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# One step of a JSONPath expression: .key, ['key'], ["key"] or [0]
+JSONPATH_STEP = re.compile(r"\.(\w+)|\[\s*'([^']*)'\s*\]|\[\s*\"([^\"]*)\"\s*\]|\[\s*(\d+)\s*\]")
+
+
+def parse_jsonpath(expression):
+    """
+    Splits a JSONPath such as `$['song']` or `$.location.city[0]` into its keys and array indexes.
+    """
+    expression = expression.strip()
+    if not expression.startswith("$"):
+        raise ValueError(f"JSONPath must start with $: {expression}")
+    steps = []
+    position = 1
+    for match in JSONPATH_STEP.finditer(expression, 1):
+        if match.start() != position:
+            break
+        name, single, double, index = match.groups()
+        if index is not None:
+            steps.append(int(index))
+        else:
+            steps.append(next(key for key in (name, single, double) if key is not None))
+        position = match.end()
+    if position != len(expression):
+        raise ValueError(f"Unsupported JSONPath: {expression}")
+    return tuple(steps)
+
+
+def read_jsonpaths(path):
+    """
+    Reads a local jsonpaths file (`{"jsonpaths": [...]}`, as used by COPY) into parsed paths.
+    """
+    with open(path, encoding="utf-8") as f:
+        return tuple(parse_jsonpath(expression) for expression in json.load(f)["jsonpaths"])
+
+
+def _extract(record, steps):
+    for step in steps:
+        try:
+            record = record[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return record
+
+
+def _numeric_casts(table_name):
+    """
+    (column index, cast) for the numeric columns of `table_name`. Text columns need no
+    cast: the CSV writer renders None and "" alike, which COPY loads as NULL.
+    """
+    return [(i, cast) for i, (_, cast) in enumerate(column_casts(table_name)) if cast is not str]
+
+
+def encode_batch(args):
+    """
+    Worker: parses a batch of JSON-lines files into CSV text in `table_name` column order.
+
+    With `jsonpaths`, the n-th path fills the n-th column, as COPY does with a jsonpaths file;
+    without, top-level keys are matched to column names case-insensitively, like JSON 'auto ignorecase'.
+    Returns (csv text, row count).
+    """
+    paths, table_name, jsonpaths = args
+    columns = [key for key, _ in column_casts(table_name)]
+    numeric = _numeric_casts(table_name)
+    if jsonpaths is not None and len(jsonpaths) != len(columns):
+        raise ValueError(f"{table_name} has {len(columns)} columns but the jsonpaths file lists {len(jsonpaths)}")
+    # Records of one source share a few key layouts; map each layout to the keys once
+    key_layouts = {}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = 0
+    for path in paths:
+        batch = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if jsonpaths is None:
+                    layout = tuple(record)
+                    keys = key_layouts.get(layout)
+                    if keys is None:
+                        by_lower = {key.lower(): key for key in layout}
+                        keys = key_layouts[layout] = [by_lower.get(column) for column in columns]
+                    row = [record.get(key) for key in keys]
+                else:
+                    row = [_extract(record, steps) for steps in jsonpaths]
+                for i, cast in numeric:
+                    value = row[i]
+                    if value is not None:
+                        row[i] = None if value == "" else cast(value)
+                batch.append(row)
+        writer.writerows(batch)
+        rows += len(batch)
+    return buffer.getvalue(), rows
+
+
+def file_batches(source, batch_bytes):
+    """
+    Groups the JSON files under `source` into batches of about `batch_bytes`, so each
+    worker task is big enough to outweigh its scheduling cost.
+    """
+    batch, size = [], 0
+    for path in iter_input_files(source):
+        batch.append(path)
+        size += os.path.getsize(path)
+        if size >= batch_bytes:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+class ChunkReader:
+    """
+    A read-only file over an iterator of text chunks, which `copy_expert` streams to the server.
+    Each read returns at most the rest of the current chunk, so nothing is copied twice.
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = ""
+        self.position = 0
+
+    def read(self, size=-1):
+        while self.position >= len(self.chunk):
+            self.chunk = next(self.chunks, None)
+            self.position = 0
+            if self.chunk is None:
+                self.chunk = ""
+                return ""
+        end = len(self.chunk) if size is None or size < 0 else self.position + size
+        data = self.chunk[self.position:end]
+        self.position += len(data)
+        return data
+
+    readline = read
+
+
+def encoded_chunks(source, table_name, jsonpaths=None, workers=None, batch_bytes=8 * 2 ** 20, counter=None):
+    """
+    Yields CSV chunks for every JSON file under `source`, in file order, parsed by a process
+    pool with at most two batches per worker in flight so memory stays bounded. Row counts
+    are added to `counter["rows"]`.
+    """
+    counter = counter if counter is not None else {}
+    counter.setdefault("rows", 0)
+    workers = workers or os.cpu_count() or 1
+    window = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for batch in file_batches(source, batch_bytes):
+            in_flight.append(pool.submit(encode_batch, (batch, table_name, jsonpaths)))
+            if len(in_flight) >= window:
+                text, rows = in_flight.popleft().result()
+                counter["rows"] += rows
+                yield text
+        while in_flight:
+            text, rows = in_flight.popleft().result()
+            counter["rows"] += rows
+            yield text
+
+
+def ingest_table(cur, table_name, source, jsonpaths=None, workers=None, batch_bytes=8 * 2 ** 20):
+    """
+    Loads every JSON file under the local directory `source` into `table_name` with one
+    streaming `COPY ... FROM STDIN`, the local stand-in for the S3 COPY. Returns the rows loaded.
+    """
+    columns = [column.name for column in TABLES_BY_NAME[table_name].columns]
+    counter = {"rows": 0}
+    chunks = encoded_chunks(source, table_name, jsonpaths, workers, batch_bytes, counter)
+    cur.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                    ChunkReader(chunks), size=2 ** 20)
+    return counter["rows"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load local log_data/song_data JSON into the staging tables of a Postgres database.")
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN", "postgresql://localhost/sparkify_bench"))
+    parser.add_argument("--log-data", required=True, help="local log_data directory")
+    parser.add_argument("--song-data", required=True, help="local song_data directory")
+    parser.add_argument("--log-jsonpath", help="local copy of the LOG_JSONPATH file (default: case-insensitive key matching)")
+    parser.add_argument("--workers", type=int, help="parser processes (default: CPU count)")
+    parser.add_argument("--create", action="store_true", help="drop and recreate the tables first")
+    parser.add_argument("--insert", action="store_true", help="then run the analytics inserts")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    - Optionally recreates the tables (adapted to Postgres by pg_compat.py).
+    - Streams log_data and song_data into staging_events and staging_songs.
+    - Optionally runs the insert steps, so the whole pipeline runs on one machine.
+    """
+    from db import connect # type: ignore
+    from pg_compat import to_postgres # type: ignore
+    from sql_queries import create_table_queries, drop_table_queries, insert_table_steps # type: ignore
+
+    args = parse_args(argv)
+    jsonpaths = read_jsonpaths(args.log_jsonpath) if args.log_jsonpath else None
+    conn = connect(args.dsn)
+    try:
+        cur = conn.cursor()
+        if args.create:
+            for query in drop_table_queries + create_table_queries:
+                cur.execute(to_postgres(query))
+            conn.commit()
+        for table_name, source, paths in [("staging_events", args.log_data, jsonpaths), ("staging_songs", args.song_data, None)]:
+            start = time.perf_counter()
+            rows = ingest_table(cur, table_name, source, paths, args.workers)
+            conn.commit()
+            seconds = time.perf_counter() - start
+            logger.info(f"{table_name}: {rows} rows in {seconds:.2f}s ({rows / seconds if seconds else 0:.0f} rows/sec)")
+        if args.insert:
+            for name, query, _, _ in insert_table_steps:
+                start = time.perf_counter()
+                cur.execute(to_postgres(query))
+                conn.commit()
+                logger.info(f"{name}: {time.perf_counter() - start:.2f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
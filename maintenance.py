@@ -0,0 +1,79 @@
+import logging
+from instrumentation import execute # type: ignore
+from sql_queries import STAGING_TRUNCATE_TABLES, analyze_query, table_unsorted_select, truncate_query, vacuum_sort_query # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Insert steps an incremental run does not repeat: it merges only events into songplays, users and the time dimension
+INCREMENTAL_SKIPPED_STEPS = {"staging_songs_keyed", "songs", "artists"}
+
+
+def touched_tables(steps, incremental=False):
+    """
+    The tables written by the insert `steps` of a run, in order, leaving out the staging
+    tables that are truncated afterwards.
+    """
+    tables = []
+    for name, _, _, writes in steps:
+        if incremental and name in INCREMENTAL_SKIPPED_STEPS:
+            continue
+        for table in (write.partition(":")[0] for write in writes):
+            if table not in tables and table not in STAGING_TRUNCATE_TABLES:
+                tables.append(table)
+    return tables
+
+
+def _autocommit(conn, func):
+    # ANALYZE and VACUUM refuse to run inside a transaction block
+    conn.commit()
+    conn.autocommit = True
+    try:
+        return func()
+    finally:
+        conn.autocommit = False
+
+
+def analyze_tables(cur, conn, tables, metrics=None):
+    """
+    Refreshes planner statistics on the columns `tables` are filtered, joined or grouped on.
+    Redshift skips tables whose rows changed less than its analyze threshold.
+    """
+    def run():
+        for table in tables:
+            execute(cur, conn, analyze_query(table), metrics, commit=False)
+    _autocommit(conn, run)
+
+
+def unsorted_tables(cur, tables, threshold_pct):
+    """
+    Returns (table, unsorted %) for each of `tables` whose unsorted share is above `threshold_pct`.
+    """
+    if not tables:
+        return []
+    cur.execute(table_unsorted_select, (tuple(tables),))
+    return [(table.strip(), unsorted) for table, unsorted in cur.fetchall()
+            if unsorted is not None and unsorted > threshold_pct]
+
+
+def vacuum_tables(cur, conn, tables, threshold_pct, metrics=None):
+    """
+    Re-sorts the tables in `tables` that are more than `threshold_pct` unsorted. Deleted
+    rows are left to Redshift's automatic vacuum. Returns the tables that were vacuumed.
+    """
+    candidates = unsorted_tables(cur, tables, threshold_pct)
+    conn.rollback()
+
+    def run():
+        for table, unsorted in candidates:
+            logger.info(f"{table} is {unsorted:.1f}% unsorted, vacuuming")
+            execute(cur, conn, vacuum_sort_query(table), metrics, commit=False)
+    _autocommit(conn, run)
+    return [table for table, _ in candidates]
+
+
+def truncate_staging(cur, conn, metrics=None):
+    """
+    Empties the raw staging tables so their storage is not paid for between runs.
+    """
+    for table in STAGING_TRUNCATE_TABLES:
+        execute(cur, conn, truncate_query(table), metrics)
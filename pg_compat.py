@@ -0,0 +1,24 @@
+import re
+
+# Redshift-only syntax and the Postgres equivalent (empty string drops it). PRIMARY KEY is
+# dropped too, because Redshift does not enforce it and the loads rely on that.
+REDSHIFT_TO_POSTGRES = [
+    (re.compile(r"\s*\bDISTSTYLE\s+(EVEN|ALL|KEY|AUTO)\b", re.IGNORECASE), ""),
+    (re.compile(r"\s*\bDISTKEY\s*\(\s*\w+\s*\)", re.IGNORECASE), ""),
+    (re.compile(r"\s*\b(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)", re.IGNORECASE), ""),
+    (re.compile(r"\s+ENCODE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"\bIDENTITY\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)", re.IGNORECASE),
+     r"GENERATED BY DEFAULT AS IDENTITY (START WITH \1 INCREMENT BY \2 MINVALUE \1)"),
+    (re.compile(r"\s+PRIMARY KEY\b", re.IGNORECASE), ""),
+    (re.compile(r"\bGETDATE\(\)", re.IGNORECASE), "NOW()"),
+]
+
+
+def to_postgres(query):
+    """
+    Rewrites a Redshift statement from sql_queries so it runs on a local Postgres.
+    Statements with nothing Redshift-specific are returned unchanged.
+    """
+    for pattern, replacement in REDSHIFT_TO_POSTGRES:
+        query = pattern.sub(replacement, query)
+    return query
@@ -0,0 +1,301 @@
+import argparse
+import csv
+import gzip
+import heapq
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from schema import TABLES_BY_NAME # type: ignore
+from sql_queries import STAGING_SOURCES, preprocessed_source # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Slices per node for the node types the project can run on
+SLICES_PER_NODE = {
+    "dc2.large": 2,
+    "dc2.8xlarge": 16,
+    "ra3.xlplus": 2,
+    "ra3.4xlarge": 4,
+    "ra3.16xlarge": 16,
+}
+
+EXTENSIONS = {"parquet": ".parquet", "csv": ".csv.gz"}
+
+INTEGER_TYPES = ("SMALLINT", "INT", "INTEGER", "BIGINT")
+FLOAT_TYPES = ("FLOAT", "FLOAT8", "REAL", "DOUBLE PRECISION")
+
+
+def slice_count(config):
+    """
+    Total slices of the configured cluster, which is the number of files COPY loads in parallel.
+    """
+    return config.num_nodes * SLICES_PER_NODE.get(config.node_type, 2)
+
+
+def column_casts(table_name):
+    """
+    Returns (lower-cased JSON key, cast) per column of `table_name`, in table order.
+    Callers match keys case-insensitively, like JSON 'auto ignorecase'.
+    """
+    casts = []
+    for column in TABLES_BY_NAME[table_name].columns:
+        type = column.type.upper()
+        if type in INTEGER_TYPES:
+            cast = to_int
+        elif type in FLOAT_TYPES:
+            cast = float
+        else:
+            cast = str
+        casts.append((column.name.lower(), cast))
+    return casts
+
+
+def to_int(value):
+    """
+    Casts a JSON number or numeric string to int. Integers are parsed exactly, so
+    BIGINTs above 2**53 keep their precision; only values like "1.0" go through float.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+def iter_input_files(source):
+    """
+    Yields the .json files under a local directory or an s3:// prefix.
+    """
+    if source.strip("'\"").startswith("s3://"):
+        from copy_loader import list_objects, parse_s3_url # type: ignore
+        bucket, prefix = parse_s3_url(source)
+        for key, _ in list_objects(_s3_client(), bucket, prefix):
+            yield f"s3://{bucket}/{key}"
+        return
+    for root, _, names in sorted(os.walk(source)):
+        for name in sorted(names):
+            if name.endswith(".json"):
+                yield os.path.join(root, name)
+
+
+_client = None
+
+
+def _s3_client():
+    """
+    The S3 client of this process, created on first use so each pool worker builds one.
+    """
+    global _client
+    if _client is not None:
+        return _client
+    from dhwFunctions import AWSClients # type: ignore
+    from dwh_config import load_config # type: ignore
+    config = load_config()
+    _client = AWSClients(key=config.key, secret=config.secret, region=config.region).s3.meta.client
+    return _client
+
+
+def _read_lines(path):
+    if path.startswith("s3://"):
+        bucket, _, key = path[len("s3://"):].partition("/")
+        body = _s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+        return body.decode("utf-8").splitlines()
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def parse_file(args):
+    """
+    Worker: parses one JSON-lines file into rows in `table_name` column order.
+    """
+    path, table_name = args
+    casts = column_casts(table_name)
+    rows = []
+    for line in _read_lines(path):
+        if not line.strip():
+            continue
+        record = {key.lower(): value for key, value in json.loads(line).items()}
+        row = []
+        for key, cast in casts:
+            value = record.get(key)
+            row.append(None if value is None or value == "" else cast(value))
+        rows.append(row)
+    return rows
+
+
+class CsvGzipWriter:
+    """
+    Writes one gzip CSV file, with a header row when `columns` is given. `types` is
+    accepted for symmetry with ParquetFileWriter; CSV needs none.
+    """
+    def __init__(self, path, table_name=None, columns=None, types=None):
+        self.path = path
+        self.file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        if columns:
+            self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def arrow_type(pa, sql_type):
+    """
+    The pyarrow type for a schema.py column type. NUMERIC(p,s) keeps its precision;
+    types without a better match are stored as text.
+    """
+    type = sql_type.upper()
+    if type == "BIGINT":
+        return pa.int64()
+    if type in INTEGER_TYPES:
+        return pa.int32()
+    if type in FLOAT_TYPES:
+        return pa.float64()
+    if type == "BOOLEAN":
+        return pa.bool_()
+    if type == "DATE":
+        return pa.date32()
+    if type == "TIMESTAMP":
+        return pa.timestamp("us")
+    if type == "TIMESTAMPTZ":
+        return pa.timestamp("us", tz="UTC")
+    if type.startswith(("NUMERIC(", "DECIMAL(")):
+        precision, _, scale = type[type.index("(") + 1:-1].partition(",")
+        return pa.decimal128(int(precision), int(scale or 0))
+    return pa.string()
+
+
+class ParquetFileWriter:
+    """
+    Writes one Parquet file, buffering up to `batch_rows` rows per row group.
+
+    Column types come from schema.py for a staging `table_name`; otherwise pass the
+    `columns` names and their SQL `types` (schema.py spelling). Without `types`, every
+    column is stored as text.
+    """
+    def __init__(self, path, table_name=None, columns=None, types=None, batch_rows=100_000):
+        import pyarrow as pa # type: ignore
+        import pyarrow.parquet as pq # type: ignore
+        self.pa = pa
+        if table_name in TABLES_BY_NAME:
+            columns = [column.name for column in TABLES_BY_NAME[table_name].columns]
+            types = [column.type for column in TABLES_BY_NAME[table_name].columns]
+        types = types or ["TEXT"] * len(columns)
+        self.schema = pa.schema([(name, arrow_type(pa, type)) for name, type in zip(columns, types)])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="snappy")
+        self.path = path
+        self.batch_rows = batch_rows
+        self.buffer = []
+
+    def write(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_rows:
+            self._flush()
+
+    def _array(self, values, field):
+        try:
+            return self.pa.array(values, type=field.type)
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError):
+            if not self.pa.types.is_string(field.type):
+                raise
+            # Values of types stored as text (intervals, arrays, ...) are written as their text form
+            return self.pa.array([None if value is None else str(value) for value in values], type=field.type)
+
+    def _flush(self):
+        if self.buffer:
+            columns = list(zip(*self.buffer))
+            self.writer.write_table(self.pa.Table.from_arrays(
+                [self._array(values, field) for values, field in zip(columns, self.schema)], schema=self.schema))
+            self.buffer = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+WRITERS = {"parquet": ParquetFileWriter, "csv": CsvGzipWriter}
+
+
+def convert_table(table_name, source, output_dir, num_files, file_format="parquet", workers=None, window=64):
+    """
+    Streams every JSON file under `source` into `num_files` files of `file_format` in
+    `output_dir/<table_name>/`. Input files are parsed by a process pool `window` at a
+    time, so memory stays bounded, and each file's rows go to the output with the fewest
+    rows so far. Returns (output paths, rows written).
+    """
+    table_dir = os.path.join(output_dir, table_name)
+    os.makedirs(table_dir, exist_ok=True)
+    extension = EXTENSIONS[file_format]
+    writers = [WRITERS[file_format](os.path.join(table_dir, f"part-{i:04d}{extension}"), table_name)
+               for i in range(num_files)]
+    sizes = [(0, i) for i in range(num_files)]
+    total = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            files = iter_input_files(source)
+            while True:
+                batch = [(path, table_name) for _, path in zip(range(window), files)]
+                if not batch:
+                    break
+                for rows in pool.map(parse_file, batch):
+                    if not rows:
+                        continue
+                    count, i = heapq.heappop(sizes)
+                    writers[i].write(rows)
+                    heapq.heappush(sizes, (count + len(rows), i))
+                    total += len(rows)
+    finally:
+        for writer in writers:
+            writer.close()
+    return [writer.path for writer in writers], total
+
+
+def upload_files(s3, paths, prefix_url, table_name):
+    """
+    Uploads converted files to the table's folder under `prefix_url` and returns the COPY source.
+    """
+    source = preprocessed_source(prefix_url, table_name)
+    bucket, _, prefix = source[len("s3://"):].partition("/")
+    for path in paths:
+        s3.upload_file(path, bucket, prefix + os.path.basename(path))
+    return source
+
+
+def main():
+    """
+    - Streams log_data and song_data JSON (local directories or s3:// prefixes) through a process pool.
+    - Writes a few large Parquet or gzip CSV files per staging table, a multiple of the slice count.
+    - With --upload, puts them under PREPROCESSED_PREFIX, where etl.py's COPYs then read them.
+    """
+    from dwh_config import load_config # type: ignore
+
+    config = load_config()
+    parser = argparse.ArgumentParser(description="Convert raw JSON logs to columnar files before COPY.")
+    parser.add_argument("--log-data", default=config.log_data.strip("'\""))
+    parser.add_argument("--song-data", default=config.song_data.strip("'\""))
+    parser.add_argument("--output", default="preprocessed", help="local directory for the converted files")
+    parser.add_argument("--format", choices=sorted(WRITERS), default=config.preprocess_format)
+    parser.add_argument("--slices", type=int, help="cluster slice count (default: from the node type and count)")
+    parser.add_argument("--files-per-slice", type=int, default=1)
+    parser.add_argument("--workers", type=int, help="parser processes (default: CPU count)")
+    parser.add_argument("--upload", action="store_true", help="upload to PREPROCESSED_PREFIX in the [S3] section")
+    args = parser.parse_args()
+
+    num_files = (args.slices or slice_count(config)) * args.files_per_slice
+    sources = {"staging_events": args.log_data, "staging_songs": args.song_data}
+    for table_name in STAGING_SOURCES:
+        paths, rows = convert_table(table_name, sources[table_name], args.output, num_files, args.format, args.workers)
+        logger.info(f"{table_name}: {rows} rows in {len(paths)} {args.format} files")
+        if args.upload:
+            if not config.preprocessed_prefix:
+                raise SystemExit("Set PREPROCESSED_PREFIX in the [S3] section to upload.")
+            source = upload_files(_s3_client(), paths, config.preprocessed_prefix, table_name)
+            logger.info(f"Uploaded to {source}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
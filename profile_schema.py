@@ -0,0 +1,301 @@
+import argparse
+import json
+import logging
+import os
+import random
+import zlib
+from schema import Column, Table, TABLES_BY_NAME, create_table_sql # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SMALLINT_MAX = 2 ** 15 - 1
+INTEGER_MAX = 2 ** 31 - 1
+
+# Where each star-schema column gets its values from
+LINEAGE = {
+    "staging_events_keyed": {
+        "ts": ("staging_events", "ts"), "user_id": ("staging_events", "userId"),
+        "level": ("staging_events", "level"), "session_id": ("staging_events", "sessionId"),
+        "location": ("staging_events", "location"), "user_agent": ("staging_events", "userAgent"),
+        "song": ("staging_events", "song"), "artist": ("staging_events", "artist"),
+    },
+    "staging_songs_keyed": {
+        "song_id": ("staging_songs", "song_id"), "artist_id": ("staging_songs", "artist_id"),
+    },
+    "songplays": {
+        "user_id": ("staging_events", "userId"), "level": ("staging_events", "level"),
+        "song_id": ("staging_songs", "song_id"), "artist_id": ("staging_songs", "artist_id"),
+        "session_id": ("staging_events", "sessionId"), "location": ("staging_events", "location"),
+        "user_agent": ("staging_events", "userAgent"),
+    },
+    "users": {
+        "user_id": ("staging_events", "userId"), "first_name": ("staging_events", "firstName"),
+        "last_name": ("staging_events", "lastName"), "gender": ("staging_events", "gender"),
+        "level": ("staging_events", "level"),
+    },
+    "songs": {
+        "song_id": ("staging_songs", "song_id"), "title": ("staging_songs", "title"),
+        "artist_id": ("staging_songs", "artist_id"), "year": ("staging_songs", "year"),
+        "duration": ("staging_songs", "duration"),
+    },
+    "artists": {
+        "artist_id": ("staging_songs", "artist_id"), "name": ("staging_songs", "artist_name"),
+        "location": ("staging_songs", "artist_location"), "latitude": ("staging_songs", "artist_latitude"),
+        "longitude": ("staging_songs", "artist_longitude"),
+    },
+}
+
+
+class ColumnProfile:
+    """
+    Running statistics for one source field: nulls, integer range, string byte lengths
+    and a bounded sample of the serialized values used to estimate compression.
+    """
+    SAMPLE_BYTES = 1 << 20
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.int_min = None
+        self.int_max = None
+        self.non_integer = False
+        self.max_bytes = 0
+        self.total_bytes = 0
+        self.sample = bytearray()
+
+    def add(self, value):
+        self.count += 1
+        if value is None or value == "":
+            self.nulls += 1
+            return
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            value = json.dumps(value)
+        # COPY accepts integers as JSON numbers or numeric strings (the logs quote userId)
+        number = None
+        if isinstance(value, int):
+            number = value
+        elif isinstance(value, float) and value.is_integer():
+            number = int(value)
+        elif isinstance(value, str):
+            try:
+                number = int(value)
+            except ValueError:
+                pass
+        if number is None:
+            self.non_integer = True
+        else:
+            self.int_min = number if self.int_min is None else min(self.int_min, number)
+            self.int_max = number if self.int_max is None else max(self.int_max, number)
+        encoded = str(value).encode("utf-8")
+        self.max_bytes = max(self.max_bytes, len(encoded))
+        self.total_bytes += len(encoded)
+        if len(self.sample) < self.SAMPLE_BYTES:
+            self.sample += encoded + b"\n"
+
+    @property
+    def avg_bytes(self):
+        values = self.count - self.nulls
+        return self.total_bytes / values if values else 0
+
+    def compression_ratio(self):
+        if not self.sample:
+            return 1.0
+        return len(self.sample) / max(1, len(zlib.compress(bytes(self.sample), 6)))
+
+
+def iter_local_records(path, sample_files, seed=0):
+    """
+    Yields JSON records from up to `sample_files` randomly chosen .json files under `path`
+    (every file when `sample_files` is 0 or None).
+    """
+    files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".json")]
+    random.Random(seed).shuffle(files)
+    for file_path in files[:sample_files or None]:
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_s3_records(s3, url, sample_files, seed=0):
+    """
+    Same as `iter_local_records` for an `s3://bucket/prefix` URL, read through a boto3 S3 client.
+    """
+    from copy_loader import parse_s3_url, list_objects # type: ignore
+
+    bucket, prefix = parse_s3_url(url)
+    keys = [key for key, _ in list_objects(s3, bucket, prefix)]
+    random.Random(seed).shuffle(keys)
+    for key in keys[:sample_files or None]:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+        for line in body.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def profile_records(records, table):
+    """
+    Profiles `records` against the columns of `table`, matching JSON keys to column names
+    case-insensitively (as COPY's JSON 'auto ignorecase' does; plain 'auto' only matches
+    lower-case keys). Returns {column name: ColumnProfile}.
+    """
+    profiles = {column.name: ColumnProfile() for column in table.columns}
+    lookup = {column.name.lower(): column.name for column in table.columns}
+    for record in records:
+        values = {lookup[key.lower()]: value for key, value in record.items() if key.lower() in lookup}
+        for name, profile in profiles.items():
+            profile.add(values.get(name))
+    return profiles
+
+
+def varchar_length(max_bytes, headroom):
+    """
+    Rounds the observed maximum up by `headroom` to a multiple of 16 bytes.
+    """
+    length = int(max_bytes * headroom) + 1
+    return min(65535, max(16, (length + 15) // 16 * 16))
+
+
+def infer_column(column, profile, headroom, first_sort_key=False, resize=True):
+    """
+    Returns a copy of `column` with the tightest type that holds the observed values and
+    an AZ64/ZSTD encoding (RAW for the leading sort key column). Types other than
+    TEXT and the integer types (floats, timestamps, fixed-width keys) are kept, as is
+    every type when `resize` is False.
+    """
+    declared = column.type.upper()
+    new_type = column.type
+    if resize and profile is not None and profile.count > profile.nulls:
+        if declared in ("INT", "INTEGER", "BIGINT", "SMALLINT") and not profile.non_integer:
+            bound = max(abs(profile.int_min), abs(profile.int_max))
+            new_type = "SMALLINT" if bound <= SMALLINT_MAX else "INTEGER" if bound <= INTEGER_MAX else "BIGINT"
+        elif declared == "TEXT":
+            new_type = f"VARCHAR({varchar_length(profile.max_bytes, headroom)})"
+
+    family = new_type.upper().split("(")[0]
+    if first_sort_key:
+        encode = "RAW"
+    elif family in ("SMALLINT", "INT", "INTEGER", "BIGINT", "TIMESTAMP", "DATE"):
+        encode = "AZ64"
+    else:
+        encode = "ZSTD"
+    return Column(column.name, new_type, column.constraints, encode=encode)
+
+
+def declared_width(type_name):
+    """
+    Bytes a value of `type_name` takes in memory during query processing.
+    """
+    type_name = type_name.upper()
+    if type_name == "TEXT":
+        return 256
+    if type_name.startswith(("VARCHAR", "CHAR")):
+        return int(type_name.split("(")[1].rstrip(")"))
+    return {"SMALLINT": 2, "INT": 4, "INTEGER": 4, "BIGINT": 8, "FLOAT": 8, "TIMESTAMP": 8}.get(type_name, 8)
+
+
+def compact_table(table, profiles, headroom, resize=True):
+    """
+    Returns a new Table with right-sized types and encodings, keeping its distribution and sort keys.
+    `profiles` maps column names to ColumnProfile (missing columns keep their type). With
+    `resize` False only the encodings change.
+    """
+    first_sort_key = table.sortkey[0] if table.sortkey else None
+    columns = [
+        infer_column(column, profiles.get(column.name), headroom,
+                     first_sort_key=column.name == first_sort_key, resize=resize)
+        for column in table.columns
+    ]
+    return Table(table.name, columns, diststyle=table.diststyle, distkey=table.distkey, sortkey=table.sortkey)
+
+
+def storage_report(table, compacted, profiles):
+    """
+    Returns report rows of (column, old type, new type, declared bytes before/after,
+    estimated stored bytes per row before/after). Stored size before assumes the
+    current encoding; after uses the zlib ratio of the sampled values as a ZSTD stand-in.
+    """
+    rows = []
+    for old, new in zip(table.columns, compacted.columns):
+        profile = profiles.get(old.name)
+        raw = profile.avg_bytes if profile else declared_width(old.type)
+        ratio = profile.compression_ratio() if profile else 1.0
+        before = raw if not old.encode or old.encode.upper() == "RAW" else raw / ratio
+        after = raw if new.encode == "RAW" else raw / ratio
+        rows.append((old.name, old.type, new.type, declared_width(old.type), declared_width(new.type), before, after))
+    return rows
+
+
+def print_report(table_name, rows):
+    print(f"\n-- {table_name}")
+    print(f"-- {'column':<16} {'old type':<14} {'new type':<14} {'width':>11} {'stored/row':>15}")
+    for name, old_type, new_type, old_width, new_width, before, after in rows:
+        print(f"-- {name:<16} {old_type:<14} {new_type:<14} {old_width:>5}->{new_width:<5} {before:>7.1f}->{after:<7.1f}")
+    old_width = sum(row[3] for row in rows)
+    new_width = sum(row[4] for row in rows)
+    before = sum(row[5] for row in rows)
+    after = sum(row[6] for row in rows)
+    print(f"-- row width {old_width} -> {new_width} bytes ({1 - new_width / max(1, old_width):.0%} less memory per row in joins)")
+    print(f"-- stored size {before:.1f} -> {after:.1f} bytes/row ({1 - after / max(1, before):.0%} less disk)")
+
+
+def profile_sources(events, songs):
+    """
+    Profiles both staging sources and derives the profiles of every star-schema column via LINEAGE.
+    Returns {table name: {column name: ColumnProfile}}.
+    """
+    profiles = {
+        "staging_events": profile_records(events, TABLES_BY_NAME["staging_events"]),
+        "staging_songs": profile_records(songs, TABLES_BY_NAME["staging_songs"]),
+    }
+    for table_name, columns in LINEAGE.items():
+        profiles[table_name] = {name: profiles[source][field] for name, (source, field) in columns.items()}
+    return profiles
+
+
+def main():
+    """
+    Samples the log_data and song_data JSON (local directories or S3 prefixes), prints
+    CREATE TABLE statements with right-sized types and encodings, and a savings report.
+
+    Types are only right-sized when every file was scanned (--sample-files 0). From a
+    sample, every table keeps its declared types and gets encodings only: a longer value
+    or larger id in an unsampled file would fail the staging COPY or, for the tables
+    filled by INSERT ... SELECT from staging, the insert.
+    """
+    parser = argparse.ArgumentParser(description="Infer compact column types and encodings from sample data.")
+    parser.add_argument("--log-data", required=True, help="local directory or s3:// prefix of the event logs")
+    parser.add_argument("--song-data", required=True, help="local directory or s3:// prefix of the song files")
+    parser.add_argument("--sample-files", type=int, default=500,
+                        help="files sampled per source; 0 scans every file and right-sizes the types")
+    parser.add_argument("--headroom", type=float, default=1.25, help="VARCHAR length multiplier over the longest value seen")
+    parser.add_argument("--output", help="also write the CREATE TABLE statements to this file")
+    args = parser.parse_args()
+
+    def records(source):
+        if source.startswith("s3://"):
+            from dhwFunctions import AWSClients # type: ignore
+            from dwh_config import load_config # type: ignore
+            config = load_config()
+            s3 = AWSClients(key=config.key, secret=config.secret, region=config.region).s3.meta.client
+            return iter_s3_records(s3, source, args.sample_files)
+        return iter_local_records(source, args.sample_files)
+
+    profiles = profile_sources(records(args.log_data), records(args.song_data))
+    statements = []
+    for table_name, table_profiles in profiles.items():
+        table = TABLES_BY_NAME[table_name]
+        compacted = compact_table(table, table_profiles, args.headroom, resize=args.sample_files == 0)
+        statements.append(create_table_sql(compacted))
+        print(statements[-1])
+        print_report(table_name, storage_report(table, compacted, table_profiles))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write("\n".join(statements))
+        logger.info(f"Wrote {len(statements)} CREATE TABLE statements to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
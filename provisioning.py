@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from backoff import backoff_delays # type: ignore
+
+logger = logging.getLogger(__name__)
+
+S3_READ_POLICY = "arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess"
+
+STEPS = ["create_role", "create_cluster", "wait_available", "authorize_ingress", "test_connection"]
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+class ClusterSpec:
+    """
+    What to provision: the cluster settings of a DwhConfig, plus an
+    optional snapshot to restore from instead of creating an empty cluster.
+    """
+    def __init__(self, identifier, node_type, cluster_type, num_nodes, db_name, master_user,
+                 master_password, port, iam_role_name, snapshot_identifier=None):
+        self.identifier = identifier
+        self.node_type = node_type
+        self.cluster_type = cluster_type
+        self.num_nodes = int(num_nodes)
+        self.db_name = db_name
+        self.master_user = master_user
+        self.master_password = master_password
+        self.port = int(port)
+        self.iam_role_name = iam_role_name
+        self.snapshot_identifier = snapshot_identifier
+
+    @classmethod
+    def from_config(cls, config, snapshot_identifier=None):
+        return cls(config.cluster_identifier, config.node_type, config.cluster_type, config.num_nodes,
+                   config.db, config.db_user, config.db_password, config.port, config.iam_role_name,
+                   snapshot_identifier)
+
+
+def log_progress(identifier, step, status, detail=""):
+    logger.info(f"[{identifier}] {step}: {status}{f' ({detail})' if detail else ''}")
+
+
+class ClusterProvisioner:
+    """
+    Creates (or restores) one Redshift cluster as a resumable sequence of STEPS.
+
+    Completed steps and their outputs (role ARN, endpoint) are saved to `state_path`
+    after each step, so a run that dies halfway picks up where it stopped. Each step is
+    also safe to repeat against AWS. Polling uses jittered exponential backoff instead
+    of a tight loop. `progress(identifier, step, status, detail)` is called on every
+    transition. `clients` is an `AWSClients` (or anything with iam/redshift/ec2
+    attributes, such as moto-backed boto3 clients); `connect` opens a DB connection
+    from a connection string; `sleep` is the coroutine waited on between polls.
+    """
+    def __init__(self, clients, spec, state_path=None, progress=log_progress, connect=None,
+                 poll_base=5.0, poll_cap=60.0, timeout=3600.0, sleep=asyncio.sleep):
+        self.clients = clients
+        self.spec = spec
+        self.state_path = state_path
+        self.progress = progress
+        self.connect = connect
+        self.poll_base = poll_base
+        self.poll_cap = poll_cap
+        self.timeout = timeout
+        self.sleep = sleep
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {"completed": []}
+
+    def _save_state(self):
+        if self.state_path:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            with open(self.state_path, "w") as f:
+                json.dump(self.state, f, indent=2)
+
+    async def _call(self, func, *args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def _poll(self, check, description):
+        """
+        Calls `check()` (in a thread) until it returns something truthy, sleeping a
+        jittered exponential backoff between calls. Raises ProvisioningError on timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        for delay in backoff_delays(self.poll_base, self.poll_cap):
+            result = await self._call(check)
+            if result:
+                return result
+            if time.monotonic() + delay > deadline:
+                raise ProvisioningError(f"Timed out waiting for {description} of {self.spec.identifier}")
+            self.progress(self.spec.identifier, description, "waiting", f"next check in {delay:.0f}s")
+            await self.sleep(max(1.0, delay))
+
+    def _describe(self):
+        redshift = self.clients.redshift
+        try:
+            return redshift.describe_clusters(ClusterIdentifier=self.spec.identifier)['Clusters'][0]
+        except redshift.exceptions.ClusterNotFoundFault:
+            return None
+
+    # STEPS
+
+    async def create_role(self):
+        from dhwFunctions import create_iam_role # type: ignore
+        self.state["role_arn"] = await self._call(create_iam_role, self.clients.iam, self.spec.iam_role_name)
+
+    async def create_cluster(self):
+        if await self._call(self._describe):
+            return
+        spec = self.spec
+        redshift = self.clients.redshift
+        if spec.snapshot_identifier:
+            await self._call(redshift.restore_from_cluster_snapshot,
+                             ClusterIdentifier=spec.identifier, SnapshotIdentifier=spec.snapshot_identifier,
+                             NodeType=spec.node_type, NumberOfNodes=spec.num_nodes,
+                             IamRoles=[self.state["role_arn"]])
+        else:
+            await self._call(redshift.create_cluster,
+                             ClusterType=spec.cluster_type, NodeType=spec.node_type,
+                             NumberOfNodes=spec.num_nodes, DBName=spec.db_name,
+                             ClusterIdentifier=spec.identifier, MasterUsername=spec.master_user,
+                             MasterUserPassword=spec.master_password, IamRoles=[self.state["role_arn"]])
+
+    async def wait_available(self):
+        def available():
+            props = self._describe()
+            return props if props and props['ClusterStatus'] == 'available' else None
+
+        props = await self._poll(available, "wait_available")
+        self.state["endpoint"] = props['Endpoint']['Address']
+        self.state["vpc_id"] = props['VpcId']
+
+    async def authorize_ingress(self):
+        def authorize():
+            vpc = self.clients.ec2.Vpc(id=self.state["vpc_id"])
+            default_sg = list(vpc.security_groups.all())[0]
+            try:
+                default_sg.authorize_ingress(GroupName=default_sg.group_name, CidrIp='0.0.0.0/0',
+                                             IpProtocol='TCP', FromPort=self.spec.port, ToPort=self.spec.port)
+            except Exception as e:
+                if "InvalidPermission.Duplicate" not in str(e):
+                    raise
+
+        await self._call(authorize)
+
+    async def test_connection(self):
+        if self.connect is None:
+            from db import connect # type: ignore
+            self.connect = connect
+        spec = self.spec
+        conn_string = f"postgresql://{spec.master_user}:{spec.master_password}@{self.state['endpoint']}:{spec.port}/{spec.db_name}"
+
+        def check():
+            conn = self.connect(conn_string)
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT version();")
+                return cur.fetchone()[0]
+            finally:
+                conn.close()
+
+        self.state["version"] = await self._call(check)
+
+    async def run(self):
+        """
+        Runs every step not completed yet and returns the saved state
+        (role_arn, endpoint, vpc_id, version).
+        """
+        for step in STEPS:
+            if step in self.state["completed"]:
+                self.progress(self.spec.identifier, step, "skipped", "already done")
+                continue
+            self.progress(self.spec.identifier, step, "started")
+            try:
+                await getattr(self, step)()
+            except Exception as e:
+                self.progress(self.spec.identifier, step, "failed", str(e))
+                raise
+            self.state["completed"].append(step)
+            self._save_state()
+            self.progress(self.spec.identifier, step, "done")
+        return self.state
+
+    async def teardown(self):
+        """
+        Deletes the cluster, waits for it to disappear, then removes the IAM role and the saved state.
+        """
+        redshift = self.clients.redshift
+        iam = self.clients.iam
+        self.progress(self.spec.identifier, "delete_cluster", "started")
+        try:
+            await self._call(redshift.delete_cluster, ClusterIdentifier=self.spec.identifier,
+                             SkipFinalClusterSnapshot=True)
+        except redshift.exceptions.ClusterNotFoundFault:
+            pass
+        await self._poll(lambda: self._describe() is None, "delete_cluster")
+        self.progress(self.spec.identifier, "delete_cluster", "done")
+
+        self.progress(self.spec.identifier, "delete_role", "started")
+        try:
+            await self._call(iam.detach_role_policy, RoleName=self.spec.iam_role_name, PolicyArn=S3_READ_POLICY)
+            await self._call(iam.delete_role, RoleName=self.spec.iam_role_name)
+        except iam.exceptions.NoSuchEntityException:
+            pass
+        self.progress(self.spec.identifier, "delete_role", "done")
+
+        self.state = {"completed": []}
+        if self.state_path and os.path.exists(self.state_path):
+            os.remove(self.state_path)
+
+
+async def provision_all(provisioners):
+    """
+    Provisions several clusters (or snapshot restores) at once. Returns their states in
+    order; a failure in one does not stop the others, its exception is returned instead.
+    """
+    return await asyncio.gather(*(p.run() for p in provisioners), return_exceptions=True)
+
+
+async def teardown_all(provisioners):
+    return await asyncio.gather(*(p.teardown() for p in provisioners), return_exceptions=True)
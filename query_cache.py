@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+from sql_queries import load_commit_delete, load_commit_insert, load_commit_select, load_commits_table_create # type: ignore
+
+logger = logging.getLogger(__name__)
+
+TABLE_REFERENCE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+
+def normalize_sql(sql):
+    """
+    Collapses whitespace and drops a trailing semicolon, so formatting does not split the cache.
+    """
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+def referenced_tables(sql):
+    return sorted({name.lower() for name in TABLE_REFERENCE.findall(sql)})
+
+
+def cache_key(sql, params):
+    payload = json.dumps([normalize_sql(sql), list(params or ())], default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def mark_loaded(cur, conn, tables):
+    """
+    Records that `tables` were just reloaded. Cached results reading them become stale.
+    """
+    from psycopg2.extras import execute_values # type: ignore
+    cur.execute(load_commits_table_create)
+    cur.execute(load_commit_delete, (tuple(tables),))
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    execute_values(cur, load_commit_insert, [(table, now) for table in tables])
+    conn.commit()
+
+
+def load_marker(cur, tables):
+    """
+    The load-commit marker of `tables`: when each was last reloaded, as one string.
+    """
+    if not tables:
+        return ""
+    cur.execute(load_commit_select, (tuple(tables),))
+    committed = {name: str(at) for name, at in cur.fetchall()}
+    return ";".join(f"{table}={committed.get(table)}" for table in tables)
+
+
+class ResultCache:
+    """
+    An on-disk (SQLite) cache of query results.
+
+    Entries expire after `ttl` seconds. The least recently used ones are evicted once
+    the stored results exceed `max_bytes`. Each entry also stores the load-commit marker
+    of the tables its query reads, and is dropped on lookup when the marker has changed.
+    Hit, miss, invalidation and eviction counts persist across runs.
+    """
+    def __init__(self, path, max_bytes=256 * 2 ** 20, ttl=3600.0, clock=time.time):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, marker TEXT, created REAL, accessed REAL, size INTEGER, payload BLOB
+            );
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER);
+        """)
+
+    def _count(self, name):
+        self.db.execute("INSERT INTO stats (name, value) VALUES (?, 1) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key, marker):
+        """
+        Returns the cached value for `key`, or None when missing, expired or stale.
+        """
+        row = self.db.execute("SELECT marker, created, payload FROM entries WHERE key = ?", (key,)).fetchone()
+        now = self.clock()
+        if row is None:
+            self._count("misses")
+        elif row[0] != marker or now - row[1] > self.ttl:
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count("invalidations" if row[0] != marker else "expirations")
+            self._count("misses")
+            row = None
+        else:
+            self.db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._count("hits")
+        self.db.commit()
+        return pickle.loads(row[2]) if row else None
+
+    def put(self, key, marker, value):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        now = self.clock()
+        self.db.execute("INSERT OR REPLACE INTO entries (key, marker, created, accessed, size, payload) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (key, marker, now, now, len(payload), payload))
+        self._evict()
+        self.db.commit()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count("evictions")
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        stats = {name: 0 for name in ("hits", "misses", "invalidations", "expirations", "evictions")}
+        stats.update(self.db.execute("SELECT name, value FROM stats").fetchall())
+        entries, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = stats["hits"] + stats["misses"]
+        stats.update(entries=entries, bytes=size, hit_rate=round(stats["hits"] / lookups, 3) if lookups else 0.0)
+        return stats
+
+    def clear(self):
+        self.db.execute("DELETE FROM entries")
+        self.db.execute("DELETE FROM stats")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def cached_query(cur, cache, sql, params=()):
+    """
+    Runs `sql` with `params` through `cache`. Returns (columns, rows, hit).
+    """
+    marker = load_marker(cur, referenced_tables(sql))
+    key = cache_key(sql, params)
+    cached = cache.get(key, marker)
+    if cached is not None:
+        return cached[0], cached[1], True
+    cur.execute(sql, params)
+    columns = [c[0] for c in cur.description]
+    rows = cur.fetchall()
+    cache.put(key, marker, (columns, rows))
+    return columns, rows, False
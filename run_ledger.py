@@ -0,0 +1,192 @@
+import logging
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from backoff import backoff_delays, retry # type: ignore
+from scheduler import run_dag # type: ignore
+from schema import TABLES_BY_NAME # type: ignore
+from sql_queries import (run_finish, run_insert, run_latest_select, run_step_delete, # type: ignore
+                         run_step_insert, run_steps_select, runs_table_create, run_steps_table_create)
+
+logger = logging.getLogger(__name__)
+
+LEDGER_TABLES = ("etl_runs", "etl_run_steps")
+
+
+class StepFailed(Exception):
+    """
+    A step that still failed after all its attempts. The run stops here.
+    """
+    def __init__(self, step, attempts, error):
+        super().__init__(f"Step {step} failed after {attempts} attempt(s): {error}")
+        self.step = step
+        self.attempts = attempts
+        self.error = error
+
+
+class RunInProgress(Exception):
+    """
+    The run --resume would continue is still marked running, possibly by another process.
+    """
+    def __init__(self, run_id):
+        super().__init__(f"Run {run_id} is still running; rerun with --force-resume if its process is gone")
+        self.run_id = run_id
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _sqlite_table_sql(table):
+    columns = ", ".join(" ".join(filter(None, [c.name, c.type, c.constraints])) for c in table.columns)
+    return f"CREATE TABLE IF NOT EXISTS {table.name} ({columns})"
+
+
+class RunLedger:
+    """
+    Records each run of etl.py and the status, attempts, duration and row count of its steps.
+
+    The ledger lives in the etl_runs / etl_run_steps control tables on the cluster, written
+    through `conn` and committed after every record, or in a local SQLite file (`sqlite`).
+    """
+    def __init__(self, conn, placeholder="%s"):
+        self.conn = conn
+        self.placeholder = placeholder
+        self.run_id = None
+        self.steps = {}
+
+    @classmethod
+    def sqlite(cls, path):
+        ledger = cls(sqlite3.connect(path), placeholder="?")
+        for name in LEDGER_TABLES:
+            ledger.conn.execute(_sqlite_table_sql(TABLES_BY_NAME[name]))
+        ledger.conn.commit()
+        return ledger
+
+    def _execute(self, query, params=()):
+        cur = self.conn.cursor()
+        cur.execute(query.replace("%s", self.placeholder), params)
+        return cur
+
+    def ensure_tables(self):
+        for query in (runs_table_create, run_steps_table_create):
+            self._execute(query)
+        self.conn.commit()
+
+    def start(self, mode, resume=False, force=False):
+        """
+        Opens a run of `mode` and returns its id. With `resume`, picks up the latest run of
+        that mode, along with the steps it already finished, unless that run succeeded.
+        Raises RunInProgress if the latest run is still running, unless `force` is set.
+        """
+        if resume:
+            row = self._execute(run_latest_select, (mode,)).fetchone()
+            if row and row[1] == "running" and not force:
+                raise RunInProgress(row[0])
+            if row and row[1] != "success":
+                self.run_id = row[0]
+                self.steps = {step: status for step, status, *_ in self._execute(run_steps_select, (self.run_id,)).fetchall()}
+                self._execute(run_finish, ("running", None, self.run_id))
+                self.conn.commit()
+                logger.info(f"Resuming run {self.run_id}: {len(self.completed())} step(s) already done")
+                return self.run_id
+            logger.info(f"The last {mode} run finished, starting a new one")
+        self.run_id = f"{_now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.steps = {}
+        self._execute(run_insert, (self.run_id, mode, _now()))
+        self.conn.commit()
+        logger.info(f"Started run {self.run_id}")
+        return self.run_id
+
+    def completed(self):
+        return {step for step, status in self.steps.items() if status == "success"}
+
+    def record(self, step, status, attempts, seconds, rows=None, error=None):
+        self._execute(run_step_delete, (self.run_id, step))
+        self._execute(run_step_insert, (self.run_id, step, status, attempts, round(seconds, 4), rows,
+                                        None if error is None else str(error)[:4096], _now()))
+        self.conn.commit()
+        self.steps[step] = status
+
+    def finish(self, status):
+        self._execute(run_finish, (status, _now(), self.run_id))
+        self.conn.commit()
+
+    def step_rows(self):
+        """
+        The recorded (step, status, attempts, seconds, rows, error) rows of the current run.
+        """
+        return self._execute(run_steps_select, (self.run_id,)).fetchall()
+
+
+def run_step(ledger, name, func, attempts=3, base=5.0, cap=60.0, sleep=time.sleep):
+    """
+    Runs `func()` as step `name` unless the ledger already has it done, retrying failures
+    with jittered backoff. `func` returns the rows it affected (or None) and must leave
+    its connection usable when it raises. Raises StepFailed once the attempts run out.
+    """
+    if name in ledger.completed():
+        logger.info(f"[{name}] Already done in this run, skipping")
+        return None
+    tries = 0
+    start = time.perf_counter()
+
+    def attempt():
+        nonlocal tries
+        tries += 1
+        return func()
+
+    def on_retry(attempt_number, error, delay):
+        logger.warning(f"[{name}] Attempt {attempt_number} failed ({error}), retrying in {delay:.1f}s")
+
+    try:
+        rows = retry(attempt, attempts=attempts, base=base, cap=cap, on_retry=on_retry, sleep=sleep)
+    except Exception as e:
+        ledger.record(name, "failed", tries, time.perf_counter() - start, error=e)
+        raise StepFailed(name, tries, e) from e
+    ledger.record(name, "success", tries, time.perf_counter() - start, rows)
+    return rows
+
+
+def _task_rows(metrics, name):
+    if metrics is None:
+        return None
+    for record in reversed(metrics.records):
+        if record["label"] == name:
+            return record["rows"]
+    return None
+
+
+def run_dag_steps(ledger, tasks, pool, max_workers, metrics=None, attempts=3, base=5.0, cap=60.0, sleep=time.sleep):
+    """
+    Runs the QueryTasks not yet done in this run through `run_dag`, one ledger step per task.
+    Failed and skipped tasks are run again, with backoff, up to `attempts` rounds in all;
+    raises StepFailed for the first task still failing after that.
+    """
+    done = ledger.completed()
+    remaining = [task for task in tasks if task.name not in done]
+    if len(remaining) < len(tasks):
+        logger.info(f"Skipping {len(tasks) - len(remaining)} task(s) already done in this run")
+    tries = {task.name: 0 for task in remaining}
+    delays = backoff_delays(base, cap, attempts - 1)
+    while remaining:
+        start = time.perf_counter()
+        status = run_dag(remaining, pool, max_workers=max_workers, metrics=metrics)
+        seconds = time.perf_counter() - start
+        for task in remaining:
+            if status[task.name] != "skipped":
+                tries[task.name] += 1
+            if status[task.name] == "success":
+                ledger.record(task.name, "success", tries[task.name], seconds, _task_rows(metrics, task.name))
+        remaining = [task for task in remaining if status[task.name] != "success"]
+        if not remaining:
+            break
+        delay = next(delays, None)
+        if delay is None:
+            for task in remaining:
+                ledger.record(task.name, status[task.name], tries[task.name], seconds)
+            failed = next(task.name for task in remaining if status[task.name] == "failed")
+            raise StepFailed(failed, tries[failed], "see the errors logged above")
+        logger.warning(f"{len(remaining)} task(s) did not finish, retrying in {delay:.1f}s")
+        sleep(delay)
@@ -0,0 +1,125 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from instrumentation import execute # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class QueryTask:
+    """
+    A single SQL statement together with the tables it reads and writes.
+    """
+    def __init__(self, name, query, reads=(), writes=()):
+        self.name = name
+        self.query = query
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+
+    def __repr__(self):
+        return f"QueryTask({self.name!r})"
+
+
+def _table(name):
+    return name.partition(":")[0]
+
+
+def _overlap(names, others):
+    """
+    True when the tables in `names` and `others` share data. `table:part` stands for
+    one slice of `table`: it overlaps `table` and itself, but not `table:other`.
+    """
+    for a in names:
+        for b in others:
+            if a == b or (_table(a) == _table(b) and (":" not in a or ":" not in b)):
+                return True
+    return False
+
+
+def build_dag(tasks):
+    """
+    Returns a dict mapping each task name to the set of task names it must wait for.
+
+    The order of `tasks` is the serial order the queries were written in. A task
+    depends on an earlier one when it reads a table the earlier task writes, or
+    writes a table the earlier task reads or writes, so running the DAG gives the
+    same result as running the list one query at a time. Tasks writing different
+    `table:part` slices of one table do not depend on each other.
+    """
+    names = [task.name for task in tasks]
+    if len(set(names)) != len(names):
+        raise ValueError("Task names must be unique.")
+
+    dependencies = {}
+    for i, task in enumerate(tasks):
+        dependencies[task.name] = set()
+        for earlier in tasks[:i]:
+            if (_overlap(task.reads, earlier.writes)
+                    or _overlap(task.writes, earlier.reads)
+                    or _overlap(task.writes, earlier.writes)):
+                dependencies[task.name].add(earlier.name)
+    return dependencies
+
+
+def _run_task(task, pool, metrics):
+    """
+    Executes one task on a connection borrowed from `pool`.
+    """
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        try:
+            execute(cur, conn, task.query, metrics, label=task.name)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def run_dag(tasks, pool, max_workers=4, metrics=None):
+    """
+    Runs `tasks` with up to `max_workers` queries in flight at once.
+
+    Each running task borrows a connection from `pool` (a `db.ConnectionPool`), so
+    the pool size also caps how many queries run together. A task only starts once
+    all the tasks it depends on have succeeded. When a task fails, everything
+    downstream of it is skipped and the remaining independent tasks still run.
+    Statement timings go to `metrics` when given.
+
+    Returns a dict mapping each task name to "success", "failed" or "skipped".
+    """
+    dependencies = build_dag(tasks)
+    by_name = {task.name: task for task in tasks}
+    status = {}
+
+    max_workers = max(1, min(max_workers, len(tasks)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        pending = [task.name for task in tasks]
+
+        while pending or running:
+            for name in list(pending):
+                deps = dependencies[name]
+                if any(status.get(dep) in ("failed", "skipped") for dep in deps):
+                    logger.warning(f"[{name}] Skipped because an upstream query failed")
+                    status[name] = "skipped"
+                    pending.remove(name)
+                elif all(status.get(dep) == "success" for dep in deps):
+                    future = executor.submit(_run_task, by_name[name], pool, metrics)
+                    running[future] = name
+                    pending.remove(name)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    status[name] = "success"
+                except Exception as e:
+                    logger.error(f"[{name}] Error executing query: {by_name[name].query}")
+                    logger.error(e)
+                    status[name] = "failed"
+
+    return status
@@ -0,0 +1,334 @@
+import argparse
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+class Column:
+    """
+    A column definition: name, SQL type, trailing constraints and optional compression encoding.
+    """
+    def __init__(self, name, type, constraints="", encode=None):
+        self.name = name
+        self.type = type
+        self.constraints = constraints
+        self.encode = encode
+
+    def sql(self):
+        parts = [self.name, self.type]
+        if self.constraints:
+            parts.append(self.constraints)
+        if self.encode:
+            parts.append(f"ENCODE {self.encode}")
+        return " ".join(parts)
+
+
+class Table:
+    """
+    A table definition with its Redshift physical layout.
+
+    `diststyle` is one of EVEN, ALL, KEY or AUTO (None leaves it to Redshift);
+    KEY requires `distkey`. `sortkey` is a list of columns for a compound sort key.
+    """
+    def __init__(self, name, columns, diststyle=None, distkey=None, sortkey=()):
+        if diststyle == "KEY" and not distkey:
+            raise ValueError(f"Table {name} uses DISTSTYLE KEY but has no distkey.")
+        if distkey and diststyle not in (None, "KEY"):
+            raise ValueError(f"Table {name} has a distkey but DISTSTYLE {diststyle}.")
+        names = [column.name for column in columns]
+        for key in [distkey, *sortkey]:
+            if key and key not in names:
+                raise ValueError(f"Table {name} has no column {key}.")
+        self.name = name
+        self.columns = list(columns)
+        self.diststyle = "KEY" if distkey else diststyle
+        self.distkey = distkey
+        self.sortkey = list(sortkey)
+
+
+def create_table_sql(table):
+    """
+    Renders the CREATE TABLE statement for `table`, including its distribution and sort keys.
+    """
+    columns = ",\n".join(f"    {column.sql()}" for column in table.columns)
+    layout = ""
+    if table.diststyle:
+        layout += f"\nDISTSTYLE {table.diststyle}"
+    if table.distkey:
+        layout += f"\nDISTKEY ({table.distkey})"
+    if table.sortkey:
+        layout += f"\nSORTKEY ({', '.join(table.sortkey)})"
+    return f"\nCREATE TABLE IF NOT EXISTS {table.name} (\n{columns}\n){layout};\n"
+
+
+def alter_table_sql(current, target):
+    """
+    Returns the ALTER TABLE statements that move `current` to the layout of `target` in place.
+
+    Covers distribution style/key, compound sort key and column encodings; column
+    types and constraints are not changed and need a rebuild.
+    """
+    # The catalog reports identifiers in lower case
+    lower = lambda names: [n.lower() for n in names]
+    statements = []
+    name = target.name
+    if (current.diststyle, lower([current.distkey or ""])) != (target.diststyle, lower([target.distkey or ""])):
+        if target.diststyle == "KEY":
+            statements.append(f"ALTER TABLE {name} ALTER DISTSTYLE KEY DISTKEY {target.distkey}")
+        else:
+            statements.append(f"ALTER TABLE {name} ALTER DISTSTYLE {target.diststyle or 'AUTO'}")
+    if lower(current.sortkey) != lower(target.sortkey):
+        if target.sortkey:
+            statements.append(f"ALTER TABLE {name} ALTER SORTKEY ({', '.join(target.sortkey)})")
+        else:
+            statements.append(f"ALTER TABLE {name} ALTER SORTKEY NONE")
+    current_columns = {column.name.lower(): column for column in current.columns}
+    for column in target.columns:
+        existing = current_columns.get(column.name.lower())
+        if existing is None:
+            continue
+        current_encode = (existing.encode or "").upper()
+        target_encode = (column.encode or "").upper()
+        if target_encode and target_encode != current_encode:
+            statements.append(f"ALTER TABLE {name} ALTER COLUMN {column.name} ENCODE {column.encode}")
+    return statements
+
+
+# EVEN, ALL, KEY(col), and the same wrapped in AUTO(...) when Redshift chose the style
+DISTSTYLE_VALUE = re.compile(r"^(?:AUTO\()?(EVEN|ALL|KEY\((\w+)\))\)?$", re.IGNORECASE)
+
+
+def parse_diststyle(value):
+    """
+    Splits a `svv_table_info.diststyle` value into (diststyle, distkey). Styles Redshift
+    picked itself report the style in effect: AUTO(KEY(col)) is KEY on col, AUTO(EVEN) is
+    EVEN and AUTO(ALL) is ALL.
+    """
+    if not value:
+        return None, None
+    match = DISTSTYLE_VALUE.match(value.strip())
+    if not match:
+        return value.strip().upper(), None
+    style, distkey = match.groups()
+    return ("KEY", distkey) if distkey else (style.upper(), None)
+
+
+def read_table_layout(cur, table_name):
+    """
+    Reads the current layout of `table_name` from the cluster catalog (`pg_table_def`, `svv_table_info`).
+    Returns None if the table does not exist.
+    """
+    cur.execute("""
+        SELECT "column", type, encoding, distkey, sortkey
+        FROM pg_table_def
+        WHERE schemaname = 'public' AND tablename = %s
+    """, (table_name,))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    cur.execute("SELECT diststyle FROM svv_table_info WHERE \"schema\" = 'public' AND \"table\" = %s", (table_name,))
+    row = cur.fetchone()
+    diststyle, distkey = parse_diststyle(row[0] if row else None)
+
+    encode = lambda value: None if value in (None, "none") else value
+    columns = [Column(name, type, encode=encode(encoding)) for name, type, encoding, _, _ in rows]
+    if diststyle == "KEY":
+        distkey = next((name for name, _, _, is_distkey, _ in rows if is_distkey), distkey)
+    sortkey = [name for name, _, _, _, position in sorted(rows, key=lambda r: r[4]) if position > 0]
+    return Table(table_name, columns, diststyle=diststyle, distkey=distkey, sortkey=sortkey)
+
+
+# STAR SCHEMA
+
+TABLES = [
+    Table("staging_events", [
+        Column("artist", "TEXT"),
+        Column("auth", "TEXT"),
+        Column("firstName", "TEXT"),
+        Column("gender", "TEXT"),
+        Column("itemInSession", "INT"),
+        Column("lastName", "TEXT"),
+        Column("length", "FLOAT"),
+        Column("level", "TEXT"),
+        Column("location", "TEXT"),
+        Column("method", "TEXT"),
+        Column("page", "TEXT"),
+        Column("registration", "BIGINT"),
+        Column("sessionId", "INT"),
+        Column("song", "TEXT"),
+        Column("status", "INT"),
+        Column("ts", "BIGINT"),
+        Column("userAgent", "TEXT"),
+        Column("userId", "INT"),
+    ], diststyle="EVEN"),
+    Table("staging_songs", [
+        Column("num_songs", "INT"),
+        Column("artist_id", "TEXT"),
+        Column("artist_latitude", "FLOAT"),
+        Column("artist_longitude", "FLOAT"),
+        Column("artist_location", "TEXT"),
+        Column("artist_name", "TEXT"),
+        Column("song_id", "TEXT"),
+        Column("title", "TEXT"),
+        Column("duration", "FLOAT"),
+        Column("year", "INT"),
+    ], diststyle="EVEN"),
+    # NextSong events and song keys with a normalized title+artist hash, distributed and
+    # sorted on it so the songplays build is a co-located merge join on a fixed-width column
+    Table("staging_events_keyed", [
+        Column("match_key", "CHAR(32)", "NOT NULL"),
+        Column("ts", "BIGINT"),
+        Column("user_id", "INT"),
+        Column("level", "TEXT"),
+        Column("session_id", "INT"),
+        Column("location", "TEXT"),
+        Column("user_agent", "TEXT"),
+        Column("song", "TEXT"),
+        Column("artist", "TEXT"),
+    ], distkey="match_key", sortkey=["match_key"]),
+    Table("staging_songs_keyed", [
+        Column("match_key", "CHAR(32)", "NOT NULL"),
+        Column("song_id", "TEXT"),
+        Column("artist_id", "TEXT"),
+    ], distkey="match_key", sortkey=["match_key"]),
+    # NextSong events whose song is not known yet, kept until song metadata arrives to match them
+    Table("songplays_pending", [
+        Column("match_key", "CHAR(32)", "NOT NULL"),
+        Column("ts", "BIGINT"),
+        Column("user_id", "INT"),
+        Column("level", "TEXT"),
+        Column("session_id", "INT"),
+        Column("location", "TEXT"),
+        Column("user_agent", "TEXT"),
+        Column("song", "TEXT"),
+        Column("artist", "TEXT"),
+        Column("first_seen", "TIMESTAMP"),
+    ], distkey="match_key", sortkey=["match_key"]),
+    # Fact table: co-located with songs on song_id, range-restricted scans on start_time
+    Table("songplays", [
+        Column("songplay_id", "INT", "IDENTITY(0,1) PRIMARY KEY"),
+        Column("start_time", "TIMESTAMP", "NOT NULL", encode="RAW"),
+        Column("user_id", "INT", "NOT NULL", encode="AZ64"),
+        Column("level", "TEXT", encode="ZSTD"),
+        Column("song_id", "TEXT", "NOT NULL", encode="ZSTD"),
+        Column("artist_id", "TEXT", "NOT NULL", encode="ZSTD"),
+        Column("session_id", "INT", encode="AZ64"),
+        Column("location", "TEXT", encode="ZSTD"),
+        Column("user_agent", "TEXT", encode="ZSTD"),
+    ], distkey="song_id", sortkey=["start_time"]),
+    # Small dimensions are copied to every node so joins to them never redistribute
+    Table("users", [
+        Column("user_id", "INT", "PRIMARY KEY"),
+        Column("first_name", "TEXT"),
+        Column("last_name", "TEXT"),
+        Column("gender", "TEXT"),
+        Column("level", "TEXT"),
+    ], diststyle="ALL", sortkey=["user_id"]),
+    Table("songs", [
+        Column("song_id", "TEXT", "PRIMARY KEY"),
+        Column("title", "TEXT"),
+        Column("artist_id", "TEXT"),
+        Column("year", "INT"),
+        Column("duration", "FLOAT"),
+    ], distkey="song_id", sortkey=["song_id"]),
+    Table("artists", [
+        Column("artist_id", "TEXT", "PRIMARY KEY"),
+        Column("name", "TEXT"),
+        Column("location", "TEXT"),
+        Column("latitude", "FLOAT"),
+        Column("longitude", "FLOAT"),
+    ], diststyle="ALL", sortkey=["artist_id"]),
+    Table("time", [
+        Column("start_time", "TIMESTAMP", "PRIMARY KEY", encode="RAW"),
+        Column("hour", "INT", encode="AZ64"),
+        Column("day", "INT", encode="AZ64"),
+        Column("week", "INT", encode="AZ64"),
+        Column("month", "INT", encode="AZ64"),
+        Column("year", "INT", encode="AZ64"),
+        Column("weekday", "TEXT", encode="ZSTD"),
+    ], distkey="start_time", sortkey=["start_time"]),
+    # Pre-generated hourly calendar, used instead of `time` when TIME_DIMENSION = calendar;
+    # about 8,800 rows a year, so it is copied to every node like the other small dimensions
+    Table("calendar", [
+        Column("hour_start", "TIMESTAMP", "PRIMARY KEY", encode="RAW"),
+        Column("hour", "INT", encode="AZ64"),
+        Column("day", "INT", encode="AZ64"),
+        Column("week", "INT", encode="AZ64"),
+        Column("month", "INT", encode="AZ64"),
+        Column("year", "INT", encode="AZ64"),
+        Column("weekday", "TEXT", encode="ZSTD"),
+    ], diststyle="ALL", sortkey=["hour_start"]),
+    # Control tables for incremental runs
+    Table("etl_watermark", [
+        Column("source", "TEXT", "PRIMARY KEY"),
+        Column("max_ts", "BIGINT"),
+        Column("updated_at", "TIMESTAMP"),
+    ], diststyle="ALL"),
+    Table("etl_ingested_keys", [
+        Column("s3_key", "TEXT", "PRIMARY KEY"),
+        Column("source", "TEXT"),
+        Column("loaded_at", "TIMESTAMP"),
+    ], diststyle="ALL"),
+    # When each table was last reloaded; cached analytics results compare against it
+    Table("etl_load_commits", [
+        Column("table_name", "TEXT", "PRIMARY KEY"),
+        Column("committed_at", "TIMESTAMP"),
+    ], diststyle="ALL"),
+    # The run ledger: one row per etl.py run and per step of it, so --resume can skip finished steps
+    Table("etl_runs", [
+        Column("run_id", "TEXT", "PRIMARY KEY"),
+        Column("mode", "TEXT"),
+        Column("status", "TEXT"),
+        Column("started_at", "TIMESTAMP"),
+        Column("finished_at", "TIMESTAMP"),
+    ], diststyle="ALL"),
+    Table("etl_run_steps", [
+        Column("run_id", "TEXT"),
+        Column("step", "TEXT"),
+        Column("status", "TEXT"),
+        Column("attempts", "INT"),
+        Column("seconds", "FLOAT"),
+        Column("rows_affected", "BIGINT"),
+        Column("error", "VARCHAR(4096)"),
+        Column("finished_at", "TIMESTAMP"),
+    ], diststyle="ALL", sortkey=["run_id"]),
+]
+
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+
+def main():
+    """
+    Prints (or with --apply, runs) the ALTER statements that move the tables on the
+    cluster to the layouts declared in TABLES, without dropping them.
+    """
+    from db import connect # type: ignore
+    from dwh_config import load_config # type: ignore
+
+    parser = argparse.ArgumentParser(description="Align table layouts on the cluster with schema.py.")
+    parser.add_argument("--apply", action="store_true", help="execute the ALTER statements")
+    args = parser.parse_args()
+
+    conn = connect(load_config().conn_string)
+    # ALTER DISTSTYLE / SORTKEY cannot run inside a transaction block
+    conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        for table in TABLES:
+            current = read_table_layout(cur, table.name)
+            if current is None:
+                logger.info(f"{table.name}: not on the cluster, run create_table.py")
+                continue
+            for statement in alter_table_sql(current, table):
+                print(statement + ";")
+                if args.apply:
+                    cur.execute(statement)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,8 +1,9 @@
-import configparser
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from schema import TABLES_BY_NAME, create_table_sql # type: ignore
 
-# CONFIG
-config = configparser.ConfigParser()
-config.read('dwh.cfg')
+# Importing this module reads no configuration. The statements that depend on dwh.cfg
+# (the COPYs) are rendered on first access through the builders below, and cached.
 
 # DROP TABLES
 
@@ -13,128 +14,215 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+calendar_table_drop = "DROP TABLE IF EXISTS calendar"
+staging_events_keyed_table_drop = "DROP TABLE IF EXISTS staging_events_keyed"
+staging_songs_keyed_table_drop = "DROP TABLE IF EXISTS staging_songs_keyed"
+songplays_pending_table_drop = "DROP TABLE IF EXISTS songplays_pending"
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermark"
+ingested_keys_table_drop = "DROP TABLE IF EXISTS etl_ingested_keys"
+load_commits_table_drop = "DROP TABLE IF EXISTS etl_load_commits"
+runs_table_drop = "DROP TABLE IF EXISTS etl_runs"
+run_steps_table_drop = "DROP TABLE IF EXISTS etl_run_steps"
 
 # CREATE TABLES
+# Rendered from the declarative model in schema.py, which carries each table's layout
 
-staging_events_table_create= ("""
-CREATE TABLE IF NOT EXISTS staging_events (
-    artist TEXT,
-    auth TEXT,
-    firstName TEXT,
-    gender TEXT,
-    itemInSession INT,
-    lastName TEXT,
-    length FLOAT,
-    level TEXT,
-    location TEXT,
-    method TEXT,
-    page TEXT,
-    registration BIGINT,
-    sessionId INT,
-    song TEXT,
-    status INT,
-    ts BIGINT,
-    userAgent TEXT,
-    userId INT
-) 
-diststyle EVEN;
-""")
+staging_events_table_create = create_table_sql(TABLES_BY_NAME['staging_events'])
+staging_songs_table_create = create_table_sql(TABLES_BY_NAME['staging_songs'])
+staging_events_keyed_table_create = create_table_sql(TABLES_BY_NAME['staging_events_keyed'])
+staging_songs_keyed_table_create = create_table_sql(TABLES_BY_NAME['staging_songs_keyed'])
+songplays_pending_table_create = create_table_sql(TABLES_BY_NAME['songplays_pending'])
+songplay_table_create = create_table_sql(TABLES_BY_NAME['songplays'])
+user_table_create = create_table_sql(TABLES_BY_NAME['users'])
+song_table_create = create_table_sql(TABLES_BY_NAME['songs'])
+artist_table_create = create_table_sql(TABLES_BY_NAME['artists'])
+time_table_create = create_table_sql(TABLES_BY_NAME['time'])
+calendar_table_create = create_table_sql(TABLES_BY_NAME['calendar'])
 
-staging_songs_table_create = ("""
-CREATE TABLE IF NOT EXISTS staging_songs (
-    num_songs INT,
-    artist_id TEXT,
-    artist_latitude FLOAT,
-    artist_longitude FLOAT,
-    artist_location TEXT,
-    artist_name TEXT,
-    song_id TEXT,
-    title TEXT,
-    duration FLOAT,
-    year INT
-) diststyle EVEN;
-""")
+# CONTROL TABLES
+# Track what incremental runs have already loaded; a full rebuild drops and resets them
 
-songplay_table_create = ("""
-CREATE TABLE IF NOT EXISTS songplays (
-    songplay_id INT IDENTITY(0,1) PRIMARY KEY,
-    start_time TIMESTAMP NOT NULL,
-    user_id INT NOT NULL,
-    level TEXT,
-    song_id TEXT NOT NULL,
-    artist_id TEXT NOT NULL,
-    session_id INT,
-    location TEXT,
-    user_agent TEXT
-);
-""")
+watermark_table_create = create_table_sql(TABLES_BY_NAME['etl_watermark'])
+ingested_keys_table_create = create_table_sql(TABLES_BY_NAME['etl_ingested_keys'])
+load_commits_table_create = create_table_sql(TABLES_BY_NAME['etl_load_commits'])
+runs_table_create = create_table_sql(TABLES_BY_NAME['etl_runs'])
+run_steps_table_create = create_table_sql(TABLES_BY_NAME['etl_run_steps'])
 
-user_table_create = ("""
-CREATE TABLE IF NOT EXISTS users (
-    user_id INT PRIMARY KEY,
-    first_name TEXT,
-    last_name TEXT,
-    gender TEXT,
-    level TEXT
-) diststyle all;
-""")
+# STAGING TABLES
+# COPY statements are built from parameters rather than frozen at import, so sharded,
+# incremental and partial loads can ask for the exact statement they need.
 
-song_table_create = ("""
-CREATE TABLE IF NOT EXISTS songs (
-    song_id TEXT PRIMARY KEY,
-    title TEXT,
-    artist_id TEXT,
-    year INT,
-    duration FLOAT
-);
-""")
+# Which dwh.cfg source and JSON paths feed each staging table
+STAGING_SOURCES = {
+    'staging_events': ('log_data', 'log_jsonpath'),
+    'staging_songs': ('song_data', None),
+}
 
-artist_table_create = ("""
-CREATE TABLE IF NOT EXISTS artists (
-    artist_id TEXT PRIMARY KEY,
-    name TEXT,
-    location TEXT,
-    latitude FLOAT,
-    longitude FLOAT
-);
-""")
 
-time_table_create = ("""
-CREATE TABLE IF NOT EXISTS time (
-    start_time TIMESTAMP PRIMARY KEY,
-    hour INT,
-    day INT,
-    week INT,
-    month INT,
-    year INT,
-    weekday TEXT
-);
+def _quoted(value):
+    return "'{}'".format(value.strip("'\""))
+
+
+@lru_cache(maxsize=None)
+def copy_query(table, source, iam_role, region, json_paths='auto', manifest=False, options=(), data_format='json'):
+    """
+    Renders `COPY table FROM source`. `data_format` is 'json' (with `json_paths`, 'auto'
+    or the S3 URL of a jsonpaths file), 'parquet' or 'csv' (gzip-compressed, as written
+    by preprocess.py); `options` are extra COPY clauses such as ("GZIP",).
+    """
+    clauses = [f"COPY {table} FROM {_quoted(source)}", f"IAM_ROLE {_quoted(iam_role)}"]
+    if data_format == 'parquet':
+        # Columnar COPY takes no REGION: the bucket must be in the cluster's region
+        clauses.append("FORMAT AS PARQUET")
+    elif data_format == 'csv':
+        clauses.append(f"CSV GZIP EMPTYASNULL region {_quoted(region)}")
+    else:
+        clauses.append(f"JSON {_quoted(json_paths)} region {_quoted(region)}")
+    clauses.extend(options)
+    if manifest:
+        clauses.append("MANIFEST")
+    return "\n    " + "\n    ".join(clauses) + ";\n"
+
+
+def staging_copy_query(config, table, source=None, manifest=None, options=(), data_format='json'):
+    """
+    The COPY for one staging table with the role, region and JSON paths in `config`.
+    `source` overrides the S3 prefix from dwh.cfg; `manifest` loads the files listed in
+    that manifest URL instead (pass "{manifest}" to get a template).
+    """
+    source_option, paths_option = STAGING_SOURCES[table]
+    json_paths = getattr(config, paths_option) if paths_option else 'auto'
+    if manifest:
+        source = manifest
+    return copy_query(table, source or getattr(config, source_option), config.role_arn, config.region,
+                      json_paths, bool(manifest), tuple(options), data_format)
+
+
+def preprocessed_source(prefix_url, table):
+    """
+    Where preprocess.py uploads the converted files for `table` under PREPROCESSED_PREFIX.
+    """
+    prefix_url = prefix_url.strip("'\"").rstrip("/")
+    return f"{prefix_url}/{table}/"
+
+
+def full_load_copy_query(config, table):
+    """
+    The full-load COPY for `table`: from the Parquet or gzip CSV files written by
+    preprocess.py when PREPROCESSED_PREFIX is set, otherwise from the raw JSON.
+    """
+    if config.preprocessed_prefix:
+        return staging_copy_query(config, table, preprocessed_source(config.preprocessed_prefix, table),
+                                  data_format=config.preprocess_format)
+    return staging_copy_query(config, table)
+
+
+def copy_table_sources_for(config):
+    """
+    (table, source S3 URL, manifest COPY template) per staging table, for the sharded
+    and incremental loads. The template takes the manifest URL as `{manifest}`.
+    """
+    return [(table, getattr(config, STAGING_SOURCES[table][0]), staging_copy_query(config, table, manifest='{manifest}'))
+            for table in STAGING_SOURCES]
+
+
+def month_prefixes(base_prefix, since, until):
+    """
+    Returns the `YYYY/MM/` partition prefixes under `base_prefix` from `since` to `until`, inclusive.
+    """
+    base_prefix = base_prefix.strip("'\"").rstrip("/")
+    year, month = since.year, since.month
+    prefixes = []
+    while (year, month) <= (until.year, until.month):
+        prefixes.append(f"{base_prefix}/{year:04d}/{month:02d}/")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return prefixes
+
+
+def staging_events_copy_queries(config, since, until, options=()):
+    """
+    One COPY per monthly log partition between the dates `since` and `until`.
+    """
+    return [staging_copy_query(config, 'staging_events', prefix, options=options)
+            for prefix in month_prefixes(config.log_data, since, until)]
+
+
+@lru_cache(maxsize=None)
+def create_table_queries_for(tables):
+    """
+    CREATE statements for a subset of tables, e.g. ("songplays", "time").
+    """
+    return tuple(create_table_sql(TABLES_BY_NAME[name]) for name in tables)
+
+
+@lru_cache(maxsize=None)
+def drop_table_queries_for(tables):
+    return tuple(f"DROP TABLE IF EXISTS {name}" for name in tables)
+
+
+# MATCH KEYS
+# Events and songs are matched on an MD5 of the lower-cased, trimmed title and artist.
+# DELETE rather than TRUNCATE keeps the rebuild inside the caller's transaction.
+
+staging_events_keyed_insert = ("""
+DELETE FROM staging_events_keyed;
+
+INSERT INTO staging_events_keyed (match_key, ts, user_id, level, session_id, location, user_agent, song, artist)
+SELECT
+    MD5(LOWER(TRIM(song)) || '|' || LOWER(TRIM(artist))) as match_key,
+    ts,
+    userId as user_id,
+    level,
+    sessionId as session_id,
+    location,
+    userAgent as user_agent,
+    song,
+    artist
+FROM staging_events
+WHERE page = 'NextSong'
+AND song IS NOT NULL
+AND artist IS NOT NULL;
 """)
 
-# STAGING TABLES
+staging_songs_keyed_insert = ("""
+DELETE FROM staging_songs_keyed;
 
-staging_events_copy = ("""
-    COPY {} FROM {}
-    IAM_ROLE '{}'
-    JSON {} region '{}';
-""").format(
-    'staging_events',
-    config['S3']['LOG_DATA'],
-    config['IAM_ROLE']['ARN'],
-    config['S3']['LOG_JSONPATH'],
-    config['DWH']['REGION']
-)
+INSERT INTO staging_songs_keyed (match_key, song_id, artist_id)
+SELECT match_key, song_id, artist_id
+FROM (
+    SELECT
+        MD5(LOWER(TRIM(title)) || '|' || LOWER(TRIM(artist_name))) as match_key,
+        song_id,
+        artist_id,
+        ROW_NUMBER() OVER (
+            PARTITION BY LOWER(TRIM(title)), LOWER(TRIM(artist_name))
+            ORDER BY song_id
+        ) as row_num
+    FROM staging_songs
+    WHERE title IS NOT NULL
+    AND artist_name IS NOT NULL
+) keyed
+WHERE row_num = 1;
+""")
 
-staging_songs_copy = ("""
-    COPY {} FROM {}
-    IAM_ROLE '{}'
-    JSON 'auto' region '{}';
-""").format(
-    'staging_songs',
-    config['S3']['SONG_DATA'],
-    config['IAM_ROLE']['ARN'],
-    config['DWH']['REGION']
-)
+unmatched_events_count = ("""
+SELECT COUNT(*)
+FROM staging_events_keyed se
+LEFT JOIN staging_songs_keyed ss
+ON se.match_key = ss.match_key
+WHERE ss.match_key IS NULL
+""")
+
+unmatched_events_sample = ("""
+SELECT se.song, se.artist, COUNT(*) as plays
+FROM staging_events_keyed se
+LEFT JOIN staging_songs_keyed ss
+ON se.match_key = ss.match_key
+WHERE ss.match_key IS NULL
+GROUP BY se.song, se.artist
+ORDER BY plays DESC
+LIMIT %s
+""")
 
 # FINAL TABLES
 
@@ -142,55 +230,514 @@ songplay_table_insert = ("""
 INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
 SELECT
     TIMESTAMP 'epoch' + se.ts/1000 * INTERVAL '1 second' as start_time,
-    se.userId as user_id,
+    se.user_id,
     se.level,
     ss.song_id,
     ss.artist_id,
-    se.sessionId as session_id,
+    se.session_id,
     se.location,
-    se.userAgent as user_agent
-FROM staging_events se
-JOIN staging_songs ss
-ON se.song = ss.title
-AND se.artist = ss.artist_name
-WHERE se.page = 'NextSong'
+    se.user_agent
+FROM staging_events_keyed se
+JOIN staging_songs_keyed ss
+ON se.match_key = ss.match_key
 """)
 
+
+@lru_cache(maxsize=None)
+def songplay_insert_query(start_ts=None, end_ts=None):
+    """
+    `songplay_table_insert` limited to events with start_ts <= ts < end_ts (epoch
+    milliseconds). Either bound may be None.
+    """
+    conditions = []
+    if start_ts is not None:
+        conditions.append(f"se.ts >= {int(start_ts)}")
+    if end_ts is not None:
+        conditions.append(f"se.ts < {int(end_ts)}")
+    if not conditions:
+        return songplay_table_insert
+    return songplay_table_insert.rstrip("\n") + "\nWHERE " + "\nAND ".join(conditions) + "\n"
+
+
+# Time slices for loading songplays in pieces, each committed on its own
+
+songplay_ts_range = "SELECT MIN(ts), MAX(ts) FROM staging_events WHERE page = 'NextSong'"
+
+
+def time_slices(min_ts, max_ts, unit):
+    """
+    Returns (label, start_ts, end_ts) per UTC day or month from `min_ts` to `max_ts` (epoch
+    milliseconds). The first slice has no lower bound and the last no upper bound, so
+    together they cover every event exactly once.
+    """
+    start = datetime.fromtimestamp(min_ts / 1000, tz=timezone.utc)
+    end = datetime.fromtimestamp(max_ts / 1000, tz=timezone.utc)
+    if unit == "day":
+        boundary = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        step = lambda d: d + timedelta(days=1)
+        label = lambda d: f"{d:%Y-%m-%d}"
+    elif unit == "month":
+        boundary = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        step = lambda d: d.replace(year=d.year + 1, month=1) if d.month == 12 else d.replace(month=d.month + 1)
+        label = lambda d: f"{d:%Y-%m}"
+    else:
+        raise ValueError(f"Unknown slice unit {unit}; choose from day, month")
+
+    slices = []
+    while boundary <= end:
+        upper = step(boundary)
+        slices.append((label(boundary), int(boundary.timestamp() * 1000), int(upper.timestamp() * 1000)))
+        boundary = upper
+    if slices:
+        slices[0] = (slices[0][0], None, slices[0][2])
+        slices[-1] = (slices[-1][0], slices[-1][1], None)
+    return slices
+
+
+def songplay_slice_steps(slices, concurrent=False):
+    """
+    One insert step per time slice, in place of the single `songplays` step. With
+    `concurrent`, each slice writes its own `songplays:<label>` part, so the scheduler
+    may run slices side by side.
+    """
+    return [(f"songplays {label}", songplay_insert_query(start_ts, end_ts),
+             ["staging_events_keyed", "staging_songs_keyed"], [f"songplays:{label}" if concurrent else "songplays"])
+            for label, start_ts, end_ts in slices]
+
+
+# PENDING SONGPLAYS
+# NextSong events that matched no song wait in songplays_pending instead of being dropped.
+# Pending rows for events of this batch that now match have just been loaded by the
+# songplays insert, so only those are removed; older matched rows wait for --reconcile.
+# The rest are added once, so re-running the step changes nothing.
+
+songplay_pending_insert = ("""
+DELETE FROM songplays_pending
+USING staging_events_keyed se, staging_songs_keyed ss
+WHERE songplays_pending.match_key = se.match_key
+AND songplays_pending.ts = se.ts
+AND songplays_pending.user_id = se.user_id
+AND songplays_pending.session_id = se.session_id
+AND se.match_key = ss.match_key;
+
+INSERT INTO songplays_pending (match_key, ts, user_id, level, session_id, location, user_agent, song, artist, first_seen)
+SELECT se.match_key, se.ts, se.user_id, se.level, se.session_id, se.location, se.user_agent, se.song, se.artist, GETDATE()
+FROM staging_events_keyed se
+LEFT JOIN staging_songs_keyed ss
+ON se.match_key = ss.match_key
+LEFT JOIN songplays_pending p
+ON se.match_key = p.match_key
+AND se.ts = p.ts
+AND se.user_id = p.user_id
+AND se.session_id = p.session_id
+WHERE ss.match_key IS NULL
+AND p.match_key IS NULL;
+""")
+
+# Reconciliation: promote the pending events that newly loaded song metadata now matches.
+# Only songplays_pending is scanned, never the loaded facts. The matched rows are staged
+# before they leave songplays_pending, so the step ends on its INSERT and reports the
+# rows promoted, like the dimension merges below.
+songplay_pending_promote = ("""
+DROP TABLE IF EXISTS songplays_promote_stage;
+
+CREATE TEMP TABLE songplays_promote_stage AS
+SELECT
+    TIMESTAMP 'epoch' + p.ts/1000 * INTERVAL '1 second' as start_time,
+    p.user_id,
+    p.level,
+    ss.song_id,
+    ss.artist_id,
+    p.session_id,
+    p.location,
+    p.user_agent
+FROM songplays_pending p
+JOIN staging_songs_keyed ss
+ON p.match_key = ss.match_key;
+
+DELETE FROM songplays_pending
+USING staging_songs_keyed ss
+WHERE songplays_pending.match_key = ss.match_key;
+
+INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent
+FROM songplays_promote_stage;
+""")
+
+songplays_pending_count = "SELECT COUNT(*) FROM songplays_pending"
+
+# Dimension loads are staged merges: one pass over staging picks a single row per key
+# into a temp table, which then replaces any existing rows for those keys. Re-running
+# them leaves the tables unchanged, since Redshift does not enforce the PRIMARY KEYs.
+# Each ends on its INSERT, so the cursor's rowcount is the rows loaded; the temp table
+# is dropped up front instead, in case the session already ran the step.
+
 user_table_insert = ("""
+DROP TABLE IF EXISTS users_stage;
+
+CREATE TEMP TABLE users_stage AS
+SELECT user_id, first_name, last_name, gender, level
+FROM (
+    SELECT
+        userId as user_id,
+        firstName as first_name,
+        lastName as last_name,
+        gender,
+        level,
+        ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as row_num
+    FROM staging_events
+    WHERE userId IS NOT NULL
+) latest
+WHERE row_num = 1;
+
+DELETE FROM users
+USING users_stage
+WHERE users.user_id = users_stage.user_id;
+
 INSERT INTO users (user_id, first_name, last_name, gender, level)
-SELECT DISTINCT userId, firstName, lastName, gender, level
-FROM staging_events
-WHERE userId IS NOT NULL
+SELECT user_id, first_name, last_name, gender, level
+FROM users_stage;
 """)
 
 song_table_insert = ("""
+DROP TABLE IF EXISTS songs_stage;
+
+CREATE TEMP TABLE songs_stage AS
+SELECT song_id, title, artist_id, year, duration
+FROM (
+    SELECT
+        song_id,
+        title,
+        artist_id,
+        year,
+        duration,
+        ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY year DESC, duration DESC) as row_num
+    FROM staging_songs
+    WHERE song_id IS NOT NULL
+) latest
+WHERE row_num = 1;
+
+DELETE FROM songs
+USING songs_stage
+WHERE songs.song_id = songs_stage.song_id;
+
 INSERT INTO songs (song_id, title, artist_id, year, duration)
-SELECT DISTINCT song_id, title, artist_id, year, duration
-FROM staging_songs
+SELECT song_id, title, artist_id, year, duration
+FROM songs_stage;
 """)
 
 artist_table_insert = ("""
+DROP TABLE IF EXISTS artists_stage;
+
+CREATE TEMP TABLE artists_stage AS
+SELECT artist_id, name, location, latitude, longitude
+FROM (
+    SELECT
+        artist_id,
+        artist_name as name,
+        artist_location as location,
+        artist_latitude as latitude,
+        artist_longitude as longitude,
+        ROW_NUMBER() OVER (
+            PARTITION BY artist_id
+            ORDER BY CASE WHEN artist_latitude IS NULL THEN 1 ELSE 0 END,
+                     CASE WHEN artist_location IS NULL OR artist_location = '' THEN 1 ELSE 0 END,
+                     artist_name
+        ) as row_num
+    FROM staging_songs
+    WHERE artist_id IS NOT NULL
+) latest
+WHERE row_num = 1;
+
+DELETE FROM artists
+USING artists_stage
+WHERE artists.artist_id = artists_stage.artist_id;
+
 INSERT INTO artists (artist_id, name, location, latitude, longitude)
-SELECT DISTINCT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
-FROM staging_songs
+SELECT artist_id, name, location, latitude, longitude
+FROM artists_stage;
 """)
 
+# One row per distinct event timestamp, built from staging_events so it runs alongside
+# the songplays load. Timestamps already in `time` are skipped, so the same statement
+# serves full and incremental runs.
+
 time_table_insert = ("""
 INSERT INTO time (start_time, hour, day, week, month, year, weekday)
 SELECT
-    start_time,
-    EXTRACT(hour FROM start_time),
-    EXTRACT(day FROM start_time),
-    EXTRACT(week FROM start_time),
-    EXTRACT(month FROM start_time),
-    EXTRACT(year FROM start_time),
-    EXTRACT(dow FROM start_time)
+    e.start_time,
+    EXTRACT(hour FROM e.start_time),
+    EXTRACT(day FROM e.start_time),
+    EXTRACT(week FROM e.start_time),
+    EXTRACT(month FROM e.start_time),
+    EXTRACT(year FROM e.start_time),
+    EXTRACT(dow FROM e.start_time)
+FROM (
+    SELECT DISTINCT TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 second' as start_time
+    FROM staging_events
+    WHERE page = 'NextSong'
+    AND ts IS NOT NULL
+) e
+LEFT JOIN time t
+ON e.start_time = t.start_time
+WHERE t.start_time IS NULL
+""")
+
+# CALENDAR
+# Hour rows from `start` to `end` (SQL timestamp expressions) that are not there yet.
+# Five cross-joined digit tables number up to 100,000 hours, a little over 11 years.
+
+DIGITS = "(SELECT 0 as n UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8 UNION ALL SELECT 9)"
+
+
+@lru_cache(maxsize=None)
+def calendar_insert_query(start, end):
+    return f"""
+INSERT INTO calendar (hour_start, hour, day, week, month, year, weekday)
+SELECT
+    h.hour_start,
+    EXTRACT(hour FROM h.hour_start),
+    EXTRACT(day FROM h.hour_start),
+    EXTRACT(week FROM h.hour_start),
+    EXTRACT(month FROM h.hour_start),
+    EXTRACT(year FROM h.hour_start),
+    EXTRACT(dow FROM h.hour_start)
+FROM (
+    SELECT DATE_TRUNC('hour', {start}) + (d0.n + 10 * d1.n + 100 * d2.n + 1000 * d3.n + 10000 * d4.n) * INTERVAL '1 hour' as hour_start
+    FROM {DIGITS} d0
+    CROSS JOIN {DIGITS} d1
+    CROSS JOIN {DIGITS} d2
+    CROSS JOIN {DIGITS} d3
+    CROSS JOIN {DIGITS} d4
+) h
+LEFT JOIN calendar c
+ON h.hour_start = c.hour_start
+WHERE c.hour_start IS NULL
+AND h.hour_start <= {end}
+"""
+
+
+def calendar_pregenerate_query(start_date, end_date):
+    """
+    Fills `calendar` for a fixed range of ISO dates; run once when the tables are created.
+    """
+    return calendar_insert_query(f"TIMESTAMP '{start_date}'", f"TIMESTAMP '{end_date} 23:00:00'")
+
+
+# Run on every load in calendar mode: a no-op unless events fall outside the pre-generated range
+calendar_table_extend = calendar_insert_query(
+    "(SELECT TIMESTAMP 'epoch' + MIN(ts)/1000 * INTERVAL '1 second' FROM staging_events WHERE page = 'NextSong')",
+    "(SELECT TIMESTAMP 'epoch' + MAX(ts)/1000 * INTERVAL '1 second' FROM staging_events WHERE page = 'NextSong')",
+)
+
+# INCREMENTAL MERGE
+# staging_events only holds the new partitions here, so each merge touches just those rows
+
+staging_events_truncate = "TRUNCATE staging_events"
+
+songplay_table_merge_delete = ("""
+DELETE FROM songplays
+USING staging_events se
+WHERE se.page = 'NextSong'
+AND songplays.start_time = TIMESTAMP 'epoch' + se.ts/1000 * INTERVAL '1 second'
+AND songplays.user_id = se.userId
+AND songplays.session_id = se.sessionId
+""")
+
+watermark_select = "SELECT max_ts FROM etl_watermark WHERE source = %s"
+ingested_keys_select = "SELECT s3_key FROM etl_ingested_keys WHERE source = %s"
+staging_events_max_ts = "SELECT MAX(ts) FROM staging_events"
+watermark_delete = "DELETE FROM etl_watermark WHERE source = %s"
+watermark_insert = "INSERT INTO etl_watermark (source, max_ts, updated_at) VALUES (%s, %s, GETDATE())"
+ingested_keys_insert = "INSERT INTO etl_ingested_keys (source, s3_key, loaded_at) VALUES %s"
+ingested_keys_delete = "DELETE FROM etl_ingested_keys WHERE source = %s"
+
+# LOAD COMMITS
+# One timestamp per table, bumped after every load so cached query results can tell they are stale
+
+load_commit_select = "SELECT table_name, committed_at FROM etl_load_commits WHERE table_name IN %s"
+load_commit_delete = "DELETE FROM etl_load_commits WHERE table_name IN %s"
+load_commit_insert = "INSERT INTO etl_load_commits (table_name, committed_at) VALUES %s"
+
+# RUN LEDGER
+# Written through run_ledger.RunLedger, which also runs them against a local SQLite file
+
+run_insert = "INSERT INTO etl_runs (run_id, mode, status, started_at) VALUES (%s, %s, 'running', %s)"
+run_finish = "UPDATE etl_runs SET status = %s, finished_at = %s WHERE run_id = %s"
+run_latest_select = ("SELECT run_id, status FROM etl_runs WHERE mode = %s "
+                     "ORDER BY started_at DESC, run_id DESC LIMIT 1")
+run_steps_select = "SELECT step, status, attempts, seconds, rows_affected, error FROM etl_run_steps WHERE run_id = %s"
+run_step_delete = "DELETE FROM etl_run_steps WHERE run_id = %s AND step = %s"
+run_step_insert = ("INSERT INTO etl_run_steps (run_id, step, status, attempts, seconds, rows_affected, error, finished_at) "
+                   "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+
+# MAINTENANCE
+# Run after a successful load, outside a transaction block (ANALYZE and VACUUM need autocommit)
+
+# Raw staging tables emptied once the run has succeeded. staging_songs_keyed is kept:
+# incremental runs match new events against it without reloading song_data.
+STAGING_TRUNCATE_TABLES = ("staging_events", "staging_events_keyed", "staging_songs")
+
+table_unsorted_select = 'SELECT "table", unsorted FROM svv_table_info WHERE "table" IN %s'
+
+
+@lru_cache(maxsize=None)
+def analyze_query(table):
+    return f"ANALYZE {table} PREDICATE COLUMNS"
+
+
+@lru_cache(maxsize=None)
+def vacuum_sort_query(table):
+    return f"VACUUM SORT ONLY {table}"
+
+
+@lru_cache(maxsize=None)
+def truncate_query(table):
+    return f"TRUNCATE {table}"
+
+
+# VALIDATION
+# Two scans cover every check: per-table counts, null and duplicate keys, then the
+# songplays foreign keys and the staging events that matched no song. The time dimension
+# checks are reported as `time` whichever TIME_DIMENSION mode is in use.
+
+TIME_DIMENSION_CHECKS = {
+    'events': (
+        "SELECT 'time', COUNT(*), SUM(CASE WHEN start_time IS NULL THEN 1 ELSE 0 END), COUNT(start_time) - COUNT(DISTINCT start_time)\nFROM time",
+        "LEFT JOIN (SELECT DISTINCT start_time FROM time) t ON sp.start_time = t.start_time",
+    ),
+    'calendar': (
+        "SELECT 'time', COUNT(*), SUM(CASE WHEN hour_start IS NULL THEN 1 ELSE 0 END), COUNT(hour_start) - COUNT(DISTINCT hour_start)\nFROM calendar",
+        "LEFT JOIN (SELECT DISTINCT hour_start as start_time FROM calendar) t ON DATE_TRUNC('hour', sp.start_time) = t.start_time",
+    ),
+}
+
+_table_stats_query = ("""
+SELECT 'staging_events', COUNT(*), SUM(CASE WHEN page = 'NextSong' AND userId IS NULL THEN 1 ELSE 0 END), NULL
+FROM staging_events
+UNION ALL
+SELECT 'staging_songs', COUNT(*), SUM(CASE WHEN song_id IS NULL THEN 1 ELSE 0 END), COUNT(song_id) - COUNT(DISTINCT song_id)
+FROM staging_songs
+UNION ALL
+SELECT 'songplays', COUNT(*),
+    SUM(CASE WHEN start_time IS NULL OR user_id IS NULL OR song_id IS NULL OR artist_id IS NULL THEN 1 ELSE 0 END),
+    COUNT(songplay_id) - COUNT(DISTINCT songplay_id)
 FROM songplays
+UNION ALL
+SELECT 'users', COUNT(*), SUM(CASE WHEN user_id IS NULL THEN 1 ELSE 0 END), COUNT(user_id) - COUNT(DISTINCT user_id)
+FROM users
+UNION ALL
+SELECT 'songs', COUNT(*), SUM(CASE WHEN song_id IS NULL THEN 1 ELSE 0 END), COUNT(song_id) - COUNT(DISTINCT song_id)
+FROM songs
+UNION ALL
+SELECT 'artists', COUNT(*), SUM(CASE WHEN artist_id IS NULL THEN 1 ELSE 0 END), COUNT(artist_id) - COUNT(DISTINCT artist_id)
+FROM artists
+UNION ALL
+{time_stats}
 """)
 
+_songplay_integrity_query = ("""
+SELECT
+    SUM(CASE WHEN u.user_id IS NULL THEN 1 ELSE 0 END),
+    SUM(CASE WHEN s.song_id IS NULL THEN 1 ELSE 0 END),
+    SUM(CASE WHEN a.artist_id IS NULL THEN 1 ELSE 0 END),
+    SUM(CASE WHEN t.start_time IS NULL THEN 1 ELSE 0 END),
+    (SELECT COUNT(*) FROM staging_events_keyed),
+    (SELECT COUNT(*)
+     FROM staging_events_keyed se
+     LEFT JOIN staging_songs_keyed ss
+     ON se.match_key = ss.match_key
+     WHERE ss.match_key IS NULL)
+FROM songplays sp
+LEFT JOIN (SELECT DISTINCT user_id FROM users) u ON sp.user_id = u.user_id
+LEFT JOIN (SELECT DISTINCT song_id FROM songs) s ON sp.song_id = s.song_id
+LEFT JOIN (SELECT DISTINCT artist_id FROM artists) a ON sp.artist_id = a.artist_id
+{time_join}
+""")
+
+
+def table_stats_query_for(time_dimension='events'):
+    return _table_stats_query.format(time_stats=TIME_DIMENSION_CHECKS[time_dimension][0])
+
+
+def songplay_integrity_query_for(time_dimension='events'):
+    return _songplay_integrity_query.format(time_join=TIME_DIMENSION_CHECKS[time_dimension][1])
+
+
+table_stats_query = table_stats_query_for('events')
+songplay_integrity_query = songplay_integrity_query_for('events')
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
\ No newline at end of file
+create_table_queries = [staging_events_table_create, staging_songs_table_create, staging_events_keyed_table_create, staging_songs_keyed_table_create, songplays_pending_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, calendar_table_create, watermark_table_create, ingested_keys_table_create, load_commits_table_create, runs_table_create, run_steps_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, staging_events_keyed_table_drop, staging_songs_keyed_table_drop, songplays_pending_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, calendar_table_drop, watermark_table_drop, ingested_keys_table_drop, load_commits_table_drop, runs_table_drop, run_steps_table_drop]
+control_table_queries = [watermark_table_create, ingested_keys_table_create, load_commits_table_create, runs_table_create, run_steps_table_create]
+insert_table_queries = [staging_events_keyed_insert, staging_songs_keyed_insert, songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+
+# The step that maintains the time dimension in each TIME_DIMENSION mode:
+# (name, query, tables read, tables written)
+TIME_DIMENSION_STEPS = {
+    'events': ("time", time_table_insert, ["staging_events"], ["time"]),
+    'calendar': ("calendar", calendar_table_extend, ["staging_events"], ["calendar"]),
+}
+
+
+def incremental_merge_queries_for(time_dimension='events'):
+    return [staging_events_keyed_insert, songplay_table_merge_delete, songplay_table_insert, songplay_pending_insert,
+            user_table_insert, TIME_DIMENSION_STEPS[time_dimension][1]]
+
+
+incremental_merge_queries = incremental_merge_queries_for('events')
+
+# QUERY DEPENDENCIES
+# (name, query, tables read, tables written) for each insert, in serial order
+
+
+def insert_steps_for(time_dimension='events', songplay_steps=None):
+    """
+    The insert steps of a full load. `songplay_steps` (see `songplay_slice_steps`)
+    replaces the single songplays insert.
+    """
+    songplays = [("songplays", songplay_table_insert, ["staging_events_keyed", "staging_songs_keyed"], ["songplays"])]
+    return [
+        ("staging_events_keyed", staging_events_keyed_insert, ["staging_events"], ["staging_events_keyed"]),
+        ("staging_songs_keyed", staging_songs_keyed_insert, ["staging_songs"], ["staging_songs_keyed"]),
+        *(songplay_steps or songplays),
+        ("songplays_pending", songplay_pending_insert, ["staging_events_keyed", "staging_songs_keyed", "songplays_pending"], ["songplays_pending"]),
+        ("users", user_table_insert, ["staging_events"], ["users"]),
+        ("songs", song_table_insert, ["staging_songs"], ["songs"]),
+        ("artists", artist_table_insert, ["staging_songs"], ["artists"]),
+        TIME_DIMENSION_STEPS[time_dimension],
+    ]
+
+
+insert_table_steps = insert_steps_for('events')
+
+
+def reconcile_steps():
+    """
+    The steps of a reconciliation run, after song_data is copied into staging_songs:
+    refresh the match keys and the song/artist dimensions, then promote the pending events.
+    """
+    refresh = [step for step in insert_steps_for() if step[0] in ("staging_songs_keyed", "songs", "artists")]
+    return refresh + [("songplays_reconcile", songplay_pending_promote, ["songplays_pending", "staging_songs_keyed"],
+                       ["songplays", "songplays_pending"])]
+
+
+# Config-dependent names, rendered from dwh.cfg on first use
+
+_CONFIG_QUERIES = {
+    'staging_events_copy': lambda config: full_load_copy_query(config, 'staging_events'),
+    'staging_songs_copy': lambda config: full_load_copy_query(config, 'staging_songs'),
+    'staging_events_manifest_copy': lambda config: staging_copy_query(config, 'staging_events', manifest='{manifest}'),
+    'staging_songs_manifest_copy': lambda config: staging_copy_query(config, 'staging_songs', manifest='{manifest}'),
+    'copy_table_queries': lambda config: [full_load_copy_query(config, table) for table in STAGING_SOURCES],
+    'copy_table_sources': copy_table_sources_for,
+}
+
+
+def __getattr__(name):
+    if name in _CONFIG_QUERIES:
+        from dwh_config import load_config # type: ignore
+        return _CONFIG_QUERIES[name](load_config())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
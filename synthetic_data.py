@@ -0,0 +1,147 @@
+import argparse
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from schema import TABLES_BY_NAME # type: ignore
+
+logger = logging.getLogger(__name__)
+
+WORDS = ["love", "night", "blue", "fire", "dream", "heart", "road", "rain", "gold", "city",
+         "light", "river", "ghost", "summer", "storm", "echo", "wild", "stone", "sky", "home"]
+CITIES = ["San Francisco, CA", "New York, NY", "Austin, TX", "Chicago, IL", "Portland, OR",
+          "Atlanta, GA", "Seattle, WA", "Boston, MA", "Denver, CO", "Miami, FL"]
+FIRST_NAMES = ["Ava", "Liam", "Mia", "Noah", "Zoe", "Ethan", "Lily", "Lucas", "Chloe", "Jacob"]
+LAST_NAMES = ["Smith", "Lee", "Garcia", "Brown", "Kim", "Lopez", "Clark", "Young", "Hall", "Allen"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.78.2 (KHTML, like Gecko) Version/7.0.6 Safari/537.78.2",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:31.0) Gecko/20100101 Firefox/31.0",
+]
+OTHER_PAGES = ["Home", "Logout", "Settings", "About", "Help", "Upgrade"]
+START = datetime(2018, 11, 1, tzinfo=timezone.utc)
+# Songs per song_data file: enough that a large catalog is thousands of files, not millions
+SONGS_PER_FILE = 2000
+
+
+def song_record(i):
+    """
+    Returns the Million Song Dataset style record of synthetic song `i`.
+    Attributes are derived from the index, so events can reference songs without a catalog in memory.
+    """
+    artist = i // 3
+    has_location = artist % 4 != 0
+    return {
+        "num_songs": 1,
+        "artist_id": f"AR{artist:016X}",
+        "artist_latitude": round(25 + (artist * 7919 % 2300) / 100, 5) if has_location else None,
+        "artist_longitude": round(-70 - (artist * 104729 % 5200) / 100, 5) if has_location else None,
+        "artist_location": CITIES[artist % len(CITIES)] if has_location else "",
+        "artist_name": f"The {WORDS[artist % 20].title()} {WORDS[artist * 7 % 20].title()} {artist}",
+        "song_id": f"SO{i:016X}",
+        "title": f"{WORDS[i * 3 % 20].title()} {WORDS[i * 11 % 20]} {i}",
+        "duration": round(120 + (i * 7907 % 24000) / 100, 5),
+        "year": 0 if i % 5 == 0 else 1960 + i % 60,
+    }
+
+
+def generate_songs(path, num_songs, songs_per_file=SONGS_PER_FILE):
+    """
+    Writes `num_songs` song records under `path` in the `song_data/A/B/C/TR....json` layout.
+    Returns the number of files written.
+    """
+    files = 0
+    for start in range(0, num_songs, songs_per_file):
+        name = f"TR{start:016X}"
+        directory = os.path.join(path, name[-3], name[-2], name[-1])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{name}.json"), "w") as f:
+            for i in range(start, min(num_songs, start + songs_per_file)):
+                f.write(json.dumps(song_record(i)) + "\n")
+        files += 1
+    return files
+
+
+def write_jsonpaths(path):
+    """
+    Writes the jsonpaths file COPY maps log events with (the LOG_JSONPATH counterpart),
+    one `$['key']` per staging_events column, in column order.
+    """
+    columns = TABLES_BY_NAME["staging_events"].columns
+    with open(path, "w") as f:
+        json.dump({"jsonpaths": [f"$['{column.name}']" for column in columns]}, f, indent=4)
+
+
+def generate_events(path, num_events, num_songs, match_rate=0.9, events_per_file=5000, days=30, num_users=100, seed=42):
+    """
+    Writes `num_events` event-sim style log records under `path` in the `YYYY/MM/YYYY-MM-DD-events.json`
+    layout, spread evenly over `days` days. About 80% are NextSong events, and `match_rate` of those
+    reference a song from the catalog; the rest name songs that do not exist.
+    Returns the number of files written.
+    """
+    rng = random.Random(seed)
+    files = 0
+    per_day = max(1, num_events // days)
+    written = 0
+    day = 0
+    while written < num_events:
+        date = START + timedelta(days=day)
+        day_events = min(per_day if day < days - 1 else num_events - written, num_events - written)
+        directory = os.path.join(path, f"{date.year:04d}", f"{date.month:02d}")
+        os.makedirs(directory, exist_ok=True)
+        base_ts = int(date.timestamp() * 1000)
+        step = max(1, 86_400_000 // max(1, day_events))
+
+        for part, start in enumerate(range(0, day_events, events_per_file)):
+            suffix = "" if part == 0 else f"-{part}"
+            with open(os.path.join(directory, f"{date:%Y-%m-%d}-events{suffix}.json"), "w") as f:
+                for n in range(start, min(day_events, start + events_per_file)):
+                    user = rng.randrange(num_users)
+                    event = {
+                        "artist": None, "auth": "Logged In",
+                        "firstName": FIRST_NAMES[user % 10], "gender": "F" if user % 2 else "M",
+                        "itemInSession": n % 100, "lastName": LAST_NAMES[user * 3 % 10],
+                        "length": None, "level": "paid" if rng.random() < 0.3 else "free",
+                        "location": CITIES[user % len(CITIES)], "method": "PUT", "page": "NextSong",
+                        "registration": 1540000000000.0 + user * 1000, "sessionId": user * 1000 + day,
+                        "song": None, "status": 200, "ts": base_ts + n * step,
+                        "userAgent": USER_AGENTS[user % len(USER_AGENTS)], "userId": str(user + 1),
+                    }
+                    if rng.random() < 0.8:
+                        if num_songs and rng.random() < match_rate:
+                            song = song_record(rng.randrange(num_songs))
+                            event.update(artist=song["artist_name"], song=song["title"], length=song["duration"])
+                        else:
+                            event.update(artist=f"Unknown Artist {n}", song=f"Unreleased {n}", length=200.0)
+                    else:
+                        event.update(page=rng.choice(OTHER_PAGES), method="GET")
+                    f.write(json.dumps(event) + "\n")
+            files += 1
+        written += day_events
+        day += 1
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic log_data and song_data JSON and the log jsonpaths file.")
+    parser.add_argument("--output", default="synthetic_data", help="directory for log_data/ and song_data/")
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--songs", type=int, help="catalog size (default: events / 10)")
+    parser.add_argument("--songs-per-file", type=int, default=SONGS_PER_FILE)
+    parser.add_argument("--events-per-file", type=int, default=5000)
+    parser.add_argument("--match-rate", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    num_songs = args.songs if args.songs is not None else max(1, args.events // 10)
+    song_files = generate_songs(os.path.join(args.output, "song_data"), num_songs, args.songs_per_file)
+    write_jsonpaths(os.path.join(args.output, "log_json_path.json"))
+    log_files = generate_events(os.path.join(args.output, "log_data"), args.events, num_songs,
+                                match_rate=args.match_rate, events_per_file=args.events_per_file, seed=args.seed)
+    logger.info(f"Wrote {num_songs} songs in {song_files} files and {args.events} events in {log_files} files")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
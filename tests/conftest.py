@@ -0,0 +1,48 @@
+import configparser
+import os
+import sys
+import pytest
+
+# The modules are top-level scripts; make them importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dwh_config import parse_config # noqa: E402
+
+CONFIG = """
+[AWS]
+KEY=
+SECRET=
+[DWH]
+REGION=us-west-2
+DWH_CLUSTER_TYPE=multi-node
+DWH_NUM_NODES=2
+DWH_NODE_TYPE=dc2.large
+DWH_IAM_ROLE_NAME=dwhRole
+DWH_CLUSTER_IDENTIFIER=dwhCluster
+DWH_DB=dwh
+DWH_DB_USER=dwhuser
+DWH_DB_PASSWORD=Passw0rd
+DWH_PORT=5439
+DWH_ENDPOINT=dwhcluster.abc.us-west-2.redshift.amazonaws.com
+[S3]
+LOG_DATA='s3://udacity-dend/log-data'
+LOG_JSONPATH='s3://udacity-dend/log_json_path.json'
+SONG_DATA='s3://udacity-dend/song-data'
+[IAM_ROLE]
+ARN=arn:aws:iam::123456789012:role/dwhRole
+"""
+
+
+@pytest.fixture
+def make_config():
+    """
+    Builds a DwhConfig like dwh.cfg's, with the given `[ETL]` options and `s3` overrides.
+    """
+    def build(s3=None, **etl):
+        parser = configparser.ConfigParser()
+        parser.read_string(CONFIG)
+        parser["ETL"] = etl
+        for option, value in (s3 or {}).items():
+            parser.set("S3", option, value)
+        return parse_config(parser)
+    return build
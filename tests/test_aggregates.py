@@ -0,0 +1,60 @@
+from datetime import date
+import pytest
+from aggregates import AGGREGATES, Aggregate, AnalyticsRequest, render, route
+
+START, END = date(2018, 11, 1), date(2018, 12, 1)
+
+
+def request(metric, grain=None, group_by=()):
+    return AnalyticsRequest(metric, START, END, grain, group_by)
+
+
+@pytest.mark.parametrize("metric, grain, group_by, source", [
+    ("plays", None, (), "agg_plays_hourly"),
+    ("plays", "hour", ["level"], "agg_plays_hourly"),
+    ("top_songs", "week", (), "agg_song_plays_daily"),
+    ("top_artists", None, (), "agg_song_plays_daily"),
+    ("active_users", "month", ["level"], "agg_user_plays_daily"),
+    # Hourly breakdowns need the hourly aggregate
+    ("active_users", "hour", (), None),
+    # No aggregate has level next to song_id
+    ("top_songs", None, ["level"], None),
+])
+def test_route(metric, grain, group_by, source):
+    aggregate = route(request(metric, grain, group_by), AGGREGATES)
+    assert (aggregate.name if aggregate else None) == source
+
+
+def test_route_needs_a_grain_that_fits_the_date_range():
+    weekly = Aggregate("agg_plays_weekly", "week", ["level"])
+    # Week buckets do not line up with the request's start and end days
+    assert not weekly.answers(request("plays"))
+    assert not weekly.answers(request("plays", "month"))
+    assert route(request("plays", "month"), [weekly]) is None
+
+
+def test_render_from_an_aggregate():
+    sql, params = render(request("plays", "day", ["level"]), AGGREGATES[0])
+    assert params == (START, END)
+    assert sql == ("SELECT DATE_TRUNC('day', period) as period, level, SUM(plays) as plays\n"
+                   "FROM agg_plays_hourly\nWHERE period >= %s AND period < %s\nGROUP BY 1, 2\nORDER BY 1, 2")
+
+
+def test_render_falls_back_to_songplays():
+    sql, _ = render(request("active_users"))
+    assert sql == "SELECT COUNT(DISTINCT user_id) as active_users\nFROM songplays\nWHERE start_time >= %s AND start_time < %s"
+
+
+def test_render_top_n_ranks_within_each_period():
+    sql, _ = render(AnalyticsRequest("top_artists", START, END, "month", limit=3), AGGREGATES[1])
+    assert "ROW_NUMBER() OVER (PARTITION BY period ORDER BY plays DESC) as play_rank" in sql
+    assert "WHERE r.play_rank <= 3" in sql
+    assert sql.endswith("ORDER BY r.period, r.plays DESC")
+    assert "LEFT JOIN (SELECT artist_id, MAX(name) as name FROM artists GROUP BY artist_id) d" in sql
+
+
+def test_request_validation():
+    with pytest.raises(ValueError):
+        AnalyticsRequest("skips", START, END)
+    with pytest.raises(ValueError):
+        AnalyticsRequest("plays", START, END, grain="minute")
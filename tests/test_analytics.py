@@ -0,0 +1,27 @@
+from datetime import date
+import pytest
+import aggregates
+from analytics import parse_args
+
+
+def test_metric_command_shares_the_aggregates_options():
+    args = parse_args(["metric", "top_songs", "--start", "2018-11-01", "--end", "2018-12-01",
+                       "--grain", "week", "--by", "level", "--limit", "5"])
+    request = aggregates.request_from_args(args)
+    assert (request.metric, request.start, request.end) == ("top_songs", date(2018, 11, 1), date(2018, 12, 1))
+    assert (request.grain, request.group_by, request.limit) == ("week", ["level"], 5)
+
+    direct = aggregates.parse_args(["top_songs", "--start", "2018-11-01", "--end", "2018-12-01", "--show-sql"])
+    assert direct.show_sql and aggregates.request_from_args(direct).limit == 10
+
+
+def test_metric_command_validates_like_aggregates():
+    with pytest.raises(SystemExit):
+        parse_args(["metric", "plays", "--start", "2018-11-01", "--end", "2018-12-01", "--grain", "minute"])
+    with pytest.raises(SystemExit):
+        parse_args(["metric", "plays", "--start", "2018-11-01"])
+
+
+def test_sql_command():
+    args = parse_args(["--no-cache", "sql", "SELECT %s", "--param", "paid"])
+    assert (args.command, args.query, args.param, args.no_cache) == ("sql", "SELECT %s", ["paid"], True)
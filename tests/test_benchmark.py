@@ -0,0 +1,84 @@
+import os
+import shutil
+from benchmark import StageTimer, compare_to_baseline, prepare_data, run_pipeline
+
+
+def stage(rows_per_sec, rows=1000):
+    return {"seconds": 1.0, "rows": rows, "rows_per_sec": rows_per_sec, "peak_mem_mb": 1.0}
+
+
+def test_compare_to_baseline():
+    baseline = {"load_staging_events": stage(1000), "insert_songs": stage(500), "insert_users": stage(200),
+                "create_tables": stage(0, rows=0)}
+    results = {"load_staging_events": stage(700), "insert_songs": stage(450), "insert_users": stage(100, rows=0),
+               "create_tables": stage(0, rows=0), "insert_time": stage(10)}
+    regressions = compare_to_baseline(results, baseline, 0.2)
+    # Stages without rows, or without a baseline, are not compared
+    assert [(name, before, after) for name, before, after, _ in regressions] == [("load_staging_events", 1000, 700)]
+    assert round(regressions[0][3], 2) == -0.3
+    assert compare_to_baseline(results, baseline, 0.5) == []
+
+
+def test_stage_timer_records_rows_per_second():
+    results = {}
+    with StageTimer(results, "load") as timer:
+        timer.rows = 10
+    assert results["load"]["rows"] == 10
+    assert results["load"]["rows_per_sec"] > 0
+    assert set(results["load"]) == {"seconds", "rows", "rows_per_sec", "peak_mem_mb"}
+
+
+def test_stage_timer_skips_failed_stages():
+    results = {}
+    try:
+        with StageTimer(results, "load"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert results == {}
+
+
+def test_prepare_data_reuses_the_same_scale(tmp_path):
+    prepare_data(str(tmp_path), 100, 10, 5)
+    song_files = [name for _, _, names in os.walk(tmp_path / "song_data") for name in names]
+    assert len(song_files) == 2
+    shutil.rmtree(tmp_path / "song_data")
+    prepare_data(str(tmp_path), 100, 10, 5)
+    assert not os.path.exists(tmp_path / "song_data")
+    # A different scale is generated again
+    prepare_data(str(tmp_path), 100, 10, 10)
+    assert [name for _, _, names in os.walk(tmp_path / "song_data") for name in names] == ["TR0000000000000000.json"]
+
+
+class PipelineCursor:
+    """
+    Accepts every statement and reads COPY streams to the end, counting their rows.
+    """
+    def __init__(self):
+        self.copied = {}
+
+    def execute(self, query, params=None):
+        pass
+
+    def copy_expert(self, sql, file, size=8192):
+        text = "".join(iter(lambda: file.read(size), ""))
+        self.copied[sql.split()[1]] = text.splitlines()
+
+    def fetchone(self):
+        return (0,)
+
+    def close(self):
+        pass
+
+
+def test_run_pipeline_maps_events_through_the_jsonpaths_file(tmp_path):
+    prepare_data(str(tmp_path), 50, 5, 5)
+    cur = PipelineCursor()
+    conn = type("Conn", (), {"cursor": lambda self: cur, "commit": lambda self: None})()
+
+    results = run_pipeline(conn, str(tmp_path), workers=1, log_jsonpath=str(tmp_path / "log_json_path.json"))
+
+    assert results["load_staging_events"]["rows"] == 50
+    assert results["load_staging_songs"]["rows"] == 5
+    assert len(cur.copied["staging_events"]) == 50
+    assert "insert_songplays" in results
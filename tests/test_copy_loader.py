@@ -0,0 +1,116 @@
+import json
+import random
+from copy_loader import build_manifest, plan_sharded_copies, shard_objects, write_manifests
+
+
+class FakeS3:
+    """
+    An in-memory S3 client with the calls copy_loader makes.
+    """
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        self.listings = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        body = self.objects[(Bucket, Key)]
+        return {"Body": type("Body", (), {"read": lambda self: body})()}
+
+    def get_paginator(self, name):
+        s3 = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                s3.listings += 1
+                contents = [{"Key": key, "Size": len(body)} for (bucket, key), body in sorted(s3.objects.items())
+                            if bucket == Bucket and key.startswith(Prefix)]
+                yield {"Contents": contents}
+        return Paginator()
+
+
+def sizes(shard):
+    return sum(size for _, size in shard)
+
+
+def test_shard_objects_balance():
+    rng = random.Random(7)
+    objects = [(f"log_data/2018/11/{i:04d}.json", rng.randint(1, 5000)) for i in range(500)]
+    shards = shard_objects(objects, 8)
+    assert len(shards) == 8
+    assert sorted(key for shard in shards for key, _ in shard) == sorted(key for key, _ in objects)
+    average = sum(size for _, size in objects) / 8
+    assert max(sizes(shard) for shard in shards) <= average + max(size for _, size in objects)
+    assert max(sizes(shard) for shard in shards) - min(sizes(shard) for shard in shards) <= 5000
+
+
+def test_shard_objects_is_deterministic():
+    objects = [(f"song_data/{i:03d}.json", 100 if i % 3 else 250) for i in range(60)]
+    shuffled = objects[:]
+    random.Random(1).shuffle(shuffled)
+    assert shard_objects(objects, 4) == shard_objects(shuffled, 4)
+
+
+def test_shard_objects_never_makes_empty_shards():
+    assert shard_objects([("a.json", 10), ("b.json", 20)], 8) == [[("b.json", 20)], [("a.json", 10)]]
+    assert shard_objects([], 4) == []
+
+
+def test_write_manifests():
+    s3 = FakeS3()
+    urls = write_manifests(s3, "udacity-dend", [[("log_data/a.json", 10)], [("log_data/b.json", 20)]],
+                           "'s3://my-bucket/manifests/'", "staging_events")
+    assert urls == ["s3://my-bucket/manifests/staging_events/shard-0000.manifest",
+                    "s3://my-bucket/manifests/staging_events/shard-0001.manifest"]
+    manifest = json.loads(s3.objects[("my-bucket", "manifests/staging_events/shard-0001.manifest")])
+    assert manifest == {"entries": [{"url": "s3://udacity-dend/log_data/b.json", "mandatory": True,
+                                     "meta": {"content_length": 20}}]}
+    assert manifest == build_manifest("udacity-dend", [("log_data/b.json", 20)])
+
+
+SOURCES = [
+    ("staging_events", "s3://data/log_data", "COPY staging_events FROM '{manifest}' MANIFEST"),
+    ("staging_songs", "s3://data/song_data", "COPY staging_songs FROM '{manifest}' MANIFEST"),
+]
+
+
+def source_bucket():
+    objects = {("data", f"log_data/{i}.json"): b"x" * (10 * (i + 1)) for i in range(6)}
+    objects.update({("data", f"song_data/{i}.json"): b"y" * 5 for i in range(3)})
+    return objects
+
+
+def test_plan_sharded_copies():
+    s3 = FakeS3(source_bucket())
+    tasks = plan_sharded_copies(s3, SOURCES, "s3://manifests/etl", num_shards=2)
+    assert [task.name for task in tasks] == ["staging_events-shard-0000", "staging_events-shard-0001",
+                                             "staging_songs-shard-0000", "staging_songs-shard-0001"]
+    assert tasks[0].query == "COPY staging_events FROM 's3://manifests/etl/staging_events/shard-0000.manifest' MANIFEST"
+    assert all(not task.reads and not task.writes for task in tasks)
+
+
+def test_plan_is_reused_when_a_run_resumes():
+    s3 = FakeS3(source_bucket())
+    first = plan_sharded_copies(s3, SOURCES, "s3://manifests/etl/", num_shards=2, run_id="run-1")
+    assert first[0].query == "COPY staging_events FROM 's3://manifests/etl/run-1/staging_events/shard-0000.manifest' MANIFEST"
+    manifest = s3.objects[("manifests", "etl/run-1/staging_events/shard-0000.manifest")]
+
+    # New files land before the resume: the run keeps its shards, a new run sees them
+    s3.objects[("data", "log_data/late.json")] = b"z" * 1000
+    listings = s3.listings
+    resumed = plan_sharded_copies(s3, SOURCES, "s3://manifests/etl/", num_shards=2, run_id="run-1")
+    assert [task.query for task in resumed] == [task.query for task in first]
+    assert s3.objects[("manifests", "etl/run-1/staging_events/shard-0000.manifest")] == manifest
+    assert s3.listings == listings
+
+    fresh = plan_sharded_copies(s3, SOURCES, "s3://manifests/etl/", num_shards=2, run_id="run-2")
+    late = [json.loads(s3.objects[("manifests", task.query.split("'")[1][len("s3://manifests/"):])])
+            for task in fresh if task.name.startswith("staging_events")]
+    assert any(entry["url"] == "s3://data/log_data/late.json" for manifest in late for entry in manifest["entries"])
@@ -0,0 +1,98 @@
+import json
+import os
+import pytest
+from explain import check_plans, parse_plan, plan_issues, redistribution_counts, regressions
+
+PLANS = os.path.join(os.path.dirname(__file__), "fixtures", "plans")
+
+
+def stored_plan(name):
+    with open(os.path.join(PLANS, name)) as f:
+        return f.read()
+
+
+def kinds(issues):
+    return [kind for kind, _ in issues]
+
+
+def test_parse_plan_tree():
+    nodes = parse_plan(stored_plan("bcast_inner.txt"))
+    assert [node.operation for node in nodes] == [
+        "XN Hash Join DS_BCAST_INNER",
+        "XN Seq Scan on staging_events_keyed se",
+        "XN Hash",
+        "XN Seq Scan on staging_songs_keyed ss",
+    ]
+    assert [node.depth for node in nodes] == [0, 2, 2, 8]
+    join = nodes[0]
+    assert (join.distribution, join.cost, join.rows, join.width) == ("DS_BCAST_INNER", 2851263.63, 4896, 89)
+    assert join.details == ['Hash Cond: ("outer".match_key = "inner".match_key)']
+    assert nodes[1].table == "staging_events_keyed"
+    assert nodes[2].table is None
+
+
+@pytest.mark.parametrize("plan, expected", [
+    ("bcast_inner.txt", ["DS_BCAST_INNER"]),
+    ("dist_both.txt", ["DS_DIST_BOTH"]),
+    ("nested_loop.txt", ["NESTED_LOOP"]),
+])
+def test_plan_issues(plan, expected):
+    assert kinds(plan_issues(parse_plan(stored_plan(plan)))) == expected
+
+
+def test_sort_key_filter():
+    issues = plan_issues(parse_plan(stored_plan("sort_key_filter.txt")))
+    # Only the scan whose filter leaves out the songplays sort key (start_time) is flagged
+    assert kinds(issues) == ["NO_SORT_KEY"]
+    assert "XN Seq Scan on songplays sp" in issues[0][1]
+
+
+def report_for(*plans):
+    report = []
+    for label, plan in plans:
+        nodes = parse_plan(stored_plan(plan))
+        report.append((label, nodes, plan_issues(nodes)))
+    return report
+
+
+def test_regressions_against_baseline():
+    report = report_for(("songplays", "bcast_inner.txt"), ("validate_songplays", "dist_both.txt"),
+                        ("time", "nested_loop.txt"))
+    assert redistribution_counts(report[0][2]) == {"DS_BCAST_INNER": 1}
+    baseline = {"songplays": {"DS_BCAST_INNER": 1}, "validate_songplays": {}}
+    assert regressions(report, baseline) == [("validate_songplays", "DS_DIST_BOTH", 1, 0)]
+    assert regressions(report, {"songplays": {"DS_BCAST_INNER": 1}, "validate_songplays": {"DS_DIST_BOTH": 1}}) == []
+    # Nested loops are reported but never gate the check
+    assert regressions(report_for(("time", "nested_loop.txt")), {}) == []
+
+
+class PlanCursor:
+    """
+    Answers every EXPLAIN with the same stored plan and accepts the empty temp tables.
+    """
+    def __init__(self, plan):
+        self.lines = [(line,) for line in stored_plan(plan).splitlines()]
+
+    def execute(self, query, params=None):
+        assert query.startswith(("EXPLAIN ", "CREATE TEMP TABLE"))
+
+    def fetchall(self):
+        return self.lines
+
+
+class RollbackConnection:
+    def rollback(self):
+        pass
+
+
+def test_check_plans_needs_a_baseline(tmp_path):
+    path = str(tmp_path / "plan_baseline.json")
+    cur, conn = PlanCursor("bcast_inner.txt"), RollbackConnection()
+    assert check_plans(cur, conn, "events", path) is False
+    assert not os.path.exists(path)
+
+    assert check_plans(cur, conn, "events", path, update=True) is True
+    with open(path) as f:
+        assert all(counts == {"DS_BCAST_INNER": 1} for counts in json.load(f).values())
+    assert check_plans(cur, conn, "events", path) is True
+    assert check_plans(PlanCursor("dist_both.txt"), conn, "events", path) is False
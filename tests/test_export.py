@@ -0,0 +1,90 @@
+import json
+import os
+from decimal import Decimal
+import pytest
+from export import description_types, unload_and_download, unload_sql
+
+
+def column(name, type_code, precision=None, scale=None):
+    return (name, type_code, None, None, precision, scale, None)
+
+
+def test_description_types():
+    description = [column("user_id", 23), column("ts", 20), column("plays", 20), column("share", 1700, 10, 4),
+                   column("avg", 1700), column("start_time", 1114), column("level", 25), column("span", 1186)]
+    assert description_types(description) == ["INTEGER", "BIGINT", "BIGINT", "NUMERIC(10,4)",
+                                              "TEXT", "TIMESTAMP", "TEXT", "TEXT"]
+
+
+def test_parquet_sparse_column_keeps_its_type(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from preprocess import ParquetFileWriter
+    path = str(tmp_path / "part-0000.parquet")
+    writer = ParquetFileWriter(path, columns=["user_id", "length", "share", "note"],
+                               types=["INTEGER", "DOUBLE PRECISION", "NUMERIC(10,4)", "TEXT"], batch_rows=2)
+    # The first row group has no value at all in length and share
+    writer.write([(1, None, None, "a"), (2, None, None, None)])
+    writer.write([(3, 215.5, Decimal("0.1250"), "c"), (4, 180.0, None, None)])
+    writer.close()
+    table = pq.read_table(path)
+    assert [str(field.type) for field in table.schema] == ["int32", "double", "decimal128(10, 4)", "string"]
+    assert table.column("length").to_pylist() == [None, None, 215.5, 180.0]
+
+
+class FakeS3:
+    """
+    An in-memory bucket with the get_object / download_file calls export.py makes.
+    """
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {"Body": type("Body", (), {"read": lambda self: body})()}
+
+    def download_file(self, bucket, key, path):
+        with open(path, "wb") as f:
+            f.write(self.objects[(bucket, key)])
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.queries = []
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            rowcount = 0
+
+            def execute(self, query):
+                connection.queries.append(query)
+        return Cursor()
+
+    def commit(self):
+        pass
+
+
+def test_unload_sql_writes_a_manifest():
+    sql = unload_sql("SELECT * FROM users WHERE level = 'paid'", "'s3://bucket/exports/'", "users", "arn:role")
+    assert "TO 's3://bucket/exports/users/part_'" in sql
+    assert "WHERE level = ''paid''" in sql
+    assert "\nMANIFEST\n" in sql
+
+
+def test_unload_downloads_only_the_manifest_files(tmp_path):
+    manifest = {"entries": [{"url": "s3://bucket/exports/users/part_0000_part_00.parquet"},
+                            {"url": "s3://bucket/exports/users/part_0001_part_00.parquet"}]}
+    s3 = FakeS3({
+        ("bucket", "exports/users/part_manifest"): json.dumps(manifest).encode(),
+        ("bucket", "exports/users/part_0000_part_00.parquet"): b"new 0",
+        ("bucket", "exports/users/part_0001_part_00.parquet"): b"new 1",
+        # Left over from an earlier UNLOAD on more slices
+        ("bucket", "exports/users/part_0002_part_00.parquet"): b"stale",
+    })
+    conn = RecordingConnection()
+    paths = unload_and_download(conn, s3, "SELECT * FROM users", (), "s3://bucket/exports", "users",
+                                "arn:role", str(tmp_path))
+    assert [os.path.basename(path) for path in paths] == ["part_0000_part_00.parquet", "part_0001_part_00.parquet"]
+    assert sorted(os.listdir(tmp_path / "users")) == ["part_0000_part_00.parquet", "part_0001_part_00.parquet"]
+    assert conn.queries[0].startswith("UNLOAD ('SELECT * FROM users')")
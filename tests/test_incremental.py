@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+from copy_loader import plan_sharded_copies, planned_objects, shard_plan_url
+from incremental import find_new_objects
+from sql_queries import month_prefixes
+from test_copy_loader import FakeS3
+
+LOG_DATA = "s3://bucket/log_data"
+
+
+def ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def log_store(*keys):
+    return FakeS3({("bucket", f"log_data/{key}"): b"{}" for key in keys})
+
+
+def test_month_prefixes_roll_over_the_year():
+    assert month_prefixes("'log_data/'", datetime(2018, 11, 30), datetime(2019, 2, 1)) == [
+        "log_data/2018/11/", "log_data/2018/12/", "log_data/2019/01/", "log_data/2019/02/"]
+    assert month_prefixes("log_data", datetime(2018, 11, 1), datetime(2018, 11, 1)) == ["log_data/2018/11/"]
+    assert month_prefixes("log_data", datetime(2018, 12, 1), datetime(2018, 11, 1)) == []
+
+
+def test_find_new_objects_without_watermark_lists_everything():
+    s3 = log_store("2018/10/a.json", "2018/11/b.json")
+    bucket, objects = find_new_objects(s3, LOG_DATA, None, set())
+    assert bucket == "bucket"
+    assert [key for key, _ in objects] == ["log_data/2018/10/a.json", "log_data/2018/11/b.json"]
+    assert s3.listings == 1
+
+
+def test_find_new_objects_skips_ingested_keys_and_old_months():
+    s3 = log_store("2018/09/old.json", "2018/10/late.json", "2018/11/done.json", "2018/11/new.json", "2018/12/next.json")
+    _, objects = find_new_objects(s3, LOG_DATA, ms(2018, 11, 20), {"log_data/2018/11/done.json"},
+                                  now=datetime(2018, 12, 2, tzinfo=timezone.utc))
+    # One month of lookback picks up the file that landed late in October
+    assert [key for key, _ in objects] == ["log_data/2018/10/late.json", "log_data/2018/11/new.json",
+                                           "log_data/2018/12/next.json"]
+
+
+def test_find_new_objects_lookback_crosses_the_year():
+    s3 = log_store("2017/11/a.json", "2017/12/b.json", "2018/01/c.json")
+    now = datetime(2018, 1, 5, tzinfo=timezone.utc)
+    _, objects = find_new_objects(s3, LOG_DATA, ms(2018, 1, 3), set(), now=now, lookback_months=2)
+    assert [key for key, _ in objects] == ["log_data/2017/11/a.json", "log_data/2017/12/b.json", "log_data/2018/01/c.json"]
+    _, objects = find_new_objects(s3, LOG_DATA, ms(2018, 1, 3), set(), now=now, lookback_months=0)
+    assert [key for key, _ in objects] == ["log_data/2018/01/c.json"]
+
+
+def test_planned_objects_are_the_keys_a_full_load_copied():
+    s3 = log_store("2018/11/a.json", "2018/11/b.json", "2018/12/c.json")
+    sources = [("staging_events", LOG_DATA, "COPY staging_events FROM '{manifest}'")]
+    plan_sharded_copies(s3, sources, "s3://manifests/etl", num_shards=2, run_id="run-1")
+    # A file that lands after the plan is not recorded as loaded
+    s3.put_object(Bucket="bucket", Key="log_data/2018/12/d.json", Body=b"{}")
+
+    objects = planned_objects(s3, shard_plan_url("s3://manifests/etl", "staging_events", "run-1"))
+
+    assert sorted(objects) == [("log_data/2018/11/a.json", 2), ("log_data/2018/11/b.json", 2), ("log_data/2018/12/c.json", 2)]
+    assert planned_objects(s3, shard_plan_url("s3://manifests/etl", "staging_events", "run-2")) is None
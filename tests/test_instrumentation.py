@@ -0,0 +1,131 @@
+import json
+import pytest
+from instrumentation import MetricsRecorder, describe, execute
+
+
+class FakeCursor:
+    """
+    Records statements; the Redshift catalog lookups answer with fixed figures, or fail
+    when `redshift` is False.
+    """
+    rowcount = 42
+
+    def __init__(self, redshift=True):
+        self.executed = []
+        self.redshift = redshift
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+        if not self.redshift and ("pg_last_query_id" in query or "stl_" in query or "svl_" in query):
+            raise RuntimeError("relation does not exist")
+        if query.startswith("FAIL"):
+            raise RuntimeError(query)
+
+    def fetchone(self):
+        query = self.executed[-1]
+        if "pg_last_query_id" in query:
+            return (1234,)
+        if "stl_load_commits" in query:
+            return (8, 5000)
+        return (5000, 1 << 20, 0)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.mark.parametrize("query, label", [
+    ("INSERT INTO songplays (start_time) SELECT 1", "INSERT songplays"),
+    ("\n  COPY staging_events FROM 's3://x'", "COPY staging_events"),
+    ("CREATE TEMP TABLE users_stage AS SELECT 1", "CREATE users_stage"),
+    ("DROP TABLE IF EXISTS songs", "DROP songs"),
+    ("VACUUM SORT ONLY songplays", "VACUUM songplays"),
+    ("SELECT 1", "SELECT"),
+    ("", "QUERY"),
+])
+def test_describe(query, label):
+    assert describe(query) == label
+
+
+def test_execute_makes_no_catalog_queries_by_default():
+    cur, conn, metrics = FakeCursor(), FakeConnection(), MetricsRecorder()
+    record = execute(cur, conn, "COPY staging_events FROM 's3://x'", metrics)
+    assert cur.executed == ["COPY staging_events FROM 's3://x'"]
+    assert (record["label"], record["rows"], record["status"]) == ("COPY staging_events", 42, "success")
+    assert conn.commits == 1 and conn.rollbacks == 0
+    assert metrics.records == [record]
+
+
+def test_execute_collects_redshift_stats_when_enabled():
+    cur, conn, metrics = FakeCursor(), FakeConnection(), MetricsRecorder(redshift_stats=True)
+    record = execute(cur, conn, "COPY staging_events FROM 's3://x'", metrics)
+    assert len(cur.executed) == 4
+    assert (record["query_id"], record["files"], record["lines_scanned"]) == (1234, 8, 5000)
+    assert (record["rows_processed"], record["bytes_processed"], record["disk_based"]) == (5000, 1 << 20, 0)
+    # The lookups' transaction is ended
+    assert conn.rollbacks == 1
+    execute(cur, conn, "INSERT INTO users SELECT 1", metrics)
+    assert len(cur.executed) == 4 + 3
+
+
+def test_redshift_stats_switch_off_where_unavailable():
+    cur, conn, metrics = FakeCursor(redshift=False), FakeConnection(), MetricsRecorder(redshift_stats=True)
+    execute(cur, conn, "INSERT INTO users SELECT 1", metrics)
+    assert metrics.redshift_stats is False
+    execute(cur, conn, "INSERT INTO songs SELECT 1", metrics)
+    assert cur.executed[-1] == "INSERT INTO songs SELECT 1"
+    assert len(cur.executed) == 3
+
+
+def test_execute_records_failures():
+    metrics = MetricsRecorder()
+    with pytest.raises(RuntimeError):
+        execute(FakeCursor(), FakeConnection(), "FAIL INSERT", metrics, label="broken")
+    assert metrics.records[0]["status"] == "error"
+    assert metrics.records[0]["label"] == "broken"
+
+
+def test_from_config(make_config):
+    assert MetricsRecorder.from_config(make_config()).redshift_stats is False
+    assert MetricsRecorder.from_config(make_config(METRICS_REDSHIFT_STATS="true")).redshift_stats is True
+
+
+def recorder():
+    metrics = MetricsRecorder()
+    metrics.add({"label": "COPY staging_events", "status": "success", "rows": 320, "seconds": 1.5, "query_id": 77})
+    metrics.add({"label": "DROP users", "status": "error", "rows": -1, "seconds": 0.25})
+    return metrics
+
+
+def test_summary():
+    lines = recorder().summary().splitlines()
+    assert lines[0].split() == ["statement", "status", "seconds", "rows", "query", "id"]
+    assert lines[1].split() == ["COPY", "staging_events", "success", "1.500", "320", "77"]
+    assert lines[2].split() == ["DROP", "users", "error", "0.250"]
+    assert lines[3].split() == ["total", "1.750"]
+
+
+def test_write_json(tmp_path):
+    path = tmp_path / "metrics.json"
+    recorder().write(str(path))
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["label"] for record in records] == ["COPY staging_events", "DROP users"]
+
+
+def test_write_prometheus(tmp_path):
+    path = tmp_path / "metrics.prom"
+    recorder().write(str(path), "prometheus")
+    lines = path.read_text().splitlines()
+    assert 'etl_statement_seconds{statement="COPY staging_events",status="success"} 1.5' in lines
+    assert 'etl_statement_seconds{statement="DROP users",status="error"} 0.25' in lines
+    assert 'etl_statement_rows{statement="COPY staging_events"} 320' in lines
+    # Unknown row counts are left out
+    assert not any(line.startswith('etl_statement_rows{statement="DROP users"}') for line in lines)
@@ -0,0 +1,80 @@
+import csv
+import io
+import os
+import pytest
+from local_ingest import ChunkReader, encode_batch, ingest_table, parse_jsonpath, read_jsonpaths
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class CopyCursor:
+    """
+    Records the COPY statement and reads the streamed file to the end, as the server does.
+    """
+    def copy_expert(self, sql, file, size=8192):
+        self.sql = sql
+        chunks = []
+        while True:
+            data = file.read(size)
+            if not data:
+                break
+            chunks.append(data)
+        self.rows = list(csv.reader(io.StringIO("".join(chunks))))
+
+
+def test_parse_jsonpath():
+    assert parse_jsonpath("$['song']") == ("song",)
+    assert parse_jsonpath('$.location["city"][0]') == ("location", "city", 0)
+    with pytest.raises(ValueError):
+        parse_jsonpath("song")
+    with pytest.raises(ValueError):
+        parse_jsonpath("$..song")
+
+
+def test_chunk_reader_streams_every_chunk_once():
+    reader = ChunkReader(["abc", "", "defg"])
+    assert [reader.read(2), reader.read(2), reader.read(), reader.read()] == ["ab", "c", "defg", ""]
+
+
+@pytest.mark.parametrize("jsonpaths", [None, read_jsonpaths(os.path.join(FIXTURES, "log_json_path.json"))])
+def test_ingest_events(jsonpaths):
+    cur = CopyCursor()
+
+    rows = ingest_table(cur, "staging_events", os.path.join(FIXTURES, "log_data"), jsonpaths, workers=1)
+
+    assert rows == 3
+    assert cur.sql.startswith("COPY staging_events (artist, auth, firstName, ")
+    assert cur.sql.endswith("userAgent, userId) FROM STDIN WITH (FORMAT csv)")
+    assert [row[-1] for row in cur.rows] == ["39", "8", ""]
+    home, next_song, login = cur.rows
+    # Nulls and empty strings both become empty CSV fields, which COPY loads as NULL
+    assert home[0] == "" and home[6] == ""
+    assert next_song[:3] == ["Des'ree", "Logged In", "Kaylee"]
+    assert next_song[6] == "246.30812"
+    assert home[11] == "1540919166796"
+    assert next_song[16] == '"Mozilla/5.0 (Windows NT 6.1; WOW64)"'
+    assert login[2] == "" and login[12] == "52"
+
+
+def test_ingest_songs():
+    cur = CopyCursor()
+
+    assert ingest_table(cur, "staging_songs", os.path.join(FIXTURES, "song_data"), workers=1) == 1
+    assert cur.rows == [["1", "ARBGXIG122988F409D", "37.77916", "-122.42005", "California - SF", "Steel Rain",
+                         "SOOJPRH12A8C141995", "Loaded Like A Gun", "173.19138", "0"]]
+
+
+def test_encode_batch_keeps_bigint_precision(tmp_path):
+    path = tmp_path / "events.json"
+    path.write_text('{"ts": 9007199254740993, "registration": "9007199254740995"}\n')
+
+    text, rows = encode_batch(([str(path)], "staging_events", None))
+
+    row = next(csv.reader(io.StringIO(text)))
+    assert rows == 1
+    assert (row[15], row[11]) == ("9007199254740993", "9007199254740995")
+
+
+def test_encode_batch_rejects_mismatched_jsonpaths():
+    with pytest.raises(ValueError):
+        encode_batch(([], "staging_songs", (("song_id",),)))
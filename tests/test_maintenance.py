@@ -0,0 +1,28 @@
+from maintenance import touched_tables
+from sql_queries import insert_steps_for, reconcile_steps, songplay_slice_steps
+
+
+def test_full_run_touches_every_analytics_table():
+    assert touched_tables(insert_steps_for()) == [
+        "staging_songs_keyed", "songplays", "songplays_pending", "users", "songs", "artists", "time"]
+
+
+def test_full_run_with_calendar_and_slices():
+    slices = [("2018-11", None, 1), ("2018-12", 1, None)]
+    steps = insert_steps_for("calendar", songplay_slice_steps(slices, concurrent=True))
+    tables = touched_tables(steps)
+    # Every songplays:<slice> part counts as songplays, once
+    assert tables.count("songplays") == 1
+    assert tables[-1] == "calendar"
+    assert "time" not in tables
+
+
+def test_incremental_run_skips_the_song_tables():
+    # An incremental run merges events only; songs, artists and the song keys are left alone
+    assert touched_tables(insert_steps_for(), incremental=True) == [
+        "songplays", "songplays_pending", "users", "time"]
+
+
+def test_reconcile_run():
+    assert touched_tables(reconcile_steps()) == [
+        "staging_songs_keyed", "songs", "artists", "songplays", "songplays_pending"]
@@ -0,0 +1,26 @@
+from pg_compat import to_postgres
+from sql_queries import create_table_queries, songplay_pending_insert
+
+
+def test_table_layout_is_dropped():
+    ddl = to_postgres("CREATE TABLE t (id INT IDENTITY(0,1) PRIMARY KEY ENCODE az64, key CHAR(32) ENCODE zstd)\n"
+                      "DISTSTYLE KEY DISTKEY (key) COMPOUND SORTKEY (key, id)")
+    assert ddl == ("CREATE TABLE t (id INT GENERATED BY DEFAULT AS IDENTITY (START WITH 0 INCREMENT BY 1 MINVALUE 0), "
+                   "key CHAR(32))")
+
+
+def test_getdate_becomes_now():
+    assert "GETDATE()" not in to_postgres(songplay_pending_insert)
+    assert "NOW()" in to_postgres(songplay_pending_insert)
+
+
+def test_every_create_table_is_redshift_free():
+    for query in create_table_queries:
+        query = to_postgres(query).upper()
+        for keyword in ("DISTSTYLE", "DISTKEY", "SORTKEY", "ENCODE", "IDENTITY(", "PRIMARY KEY"):
+            assert keyword not in query, query
+
+
+def test_plain_statements_are_unchanged():
+    query = "SELECT user_id, COUNT(*) FROM songplays GROUP BY 1"
+    assert to_postgres(query) == query
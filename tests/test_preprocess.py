@@ -0,0 +1,30 @@
+import json
+import preprocess
+from preprocess import column_casts, parse_file, to_int
+
+
+def test_to_int_keeps_bigint_precision():
+    assert to_int("9007199254740993") == 2 ** 53 + 1
+    assert to_int(2 ** 53 + 1) == 2 ** 53 + 1
+    assert to_int("12.0") == 12
+    assert to_int(3.0) == 3
+
+
+def test_parse_file_casts_columns(tmp_path):
+    path = tmp_path / "events.json"
+    path.write_text(json.dumps({"userId": "9007199254740993", "ITEMINSESSION": 2, "length": "215.5",
+                                "firstName": "", "ts": 1541105830796}) + "\n\n")
+    columns = [key for key, _ in column_casts("staging_events")]
+
+    row = dict(zip(columns, parse_file((str(path), "staging_events"))[0]))
+
+    assert row["iteminsession"] == 2
+    assert row["length"] == 215.5
+    assert row["firstname"] is None
+    assert row["ts"] == 1541105830796
+
+
+def test_s3_client_is_created_once_per_process(monkeypatch):
+    sentinel = object()
+    monkeypatch.setattr(preprocess, "_client", sentinel)
+    assert preprocess._s3_client() is preprocess._s3_client() is sentinel
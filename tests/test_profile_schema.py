@@ -0,0 +1,28 @@
+from profile_schema import compact_table, profile_records
+from schema import TABLES_BY_NAME
+
+
+def test_profile_records_matches_keys_case_insensitively():
+    profiles = profile_records([{"userId": "12", "FIRSTNAME": "Ann"}], TABLES_BY_NAME["staging_events"])
+
+    assert profiles["userId"].int_max == 12
+    assert profiles["firstName"].max_bytes == 3
+
+
+def test_compact_table_without_resize_keeps_declared_types():
+    table = TABLES_BY_NAME["staging_events"]
+    profiles = profile_records([{"firstName": "Ann", "userId": "12"}], table)
+
+    compacted = compact_table(table, profiles, 1.25, resize=False)
+
+    assert [column.type for column in compacted.columns] == [column.type for column in table.columns]
+    assert all(column.encode for column in compacted.columns)
+
+
+def test_compact_table_right_sizes_text_columns():
+    table = TABLES_BY_NAME["staging_events"]
+    profiles = profile_records([{"firstName": "Ann"}], table)
+
+    compacted = compact_table(table, profiles, 1.25)
+
+    assert {column.name: column.type for column in compacted.columns}["firstName"] == "VARCHAR(16)"
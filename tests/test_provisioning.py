@@ -0,0 +1,214 @@
+import asyncio
+import json
+import pytest
+from provisioning import STEPS, ClusterProvisioner, ClusterSpec, ProvisioningError
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/dwhRole"
+
+
+def spec():
+    return ClusterSpec("dwh-cluster", "dc2.large", "multi-node", 2, "dwh", "dwhuser", "Passw0rd", 5439, "dwhRole")
+
+
+class ClusterNotFoundFault(Exception):
+    pass
+
+
+class FakeRedshift:
+    """
+    A cluster that reports `statuses` in turn once created, then stays on the last one.
+    """
+    exceptions = type("exceptions", (), {"ClusterNotFoundFault": ClusterNotFoundFault})
+
+    def __init__(self, statuses=("creating", "creating", "available"), exists=False):
+        self.statuses = list(statuses)
+        self.exists = exists
+        self.created = 0
+        self.restored = []
+
+    def describe_clusters(self, ClusterIdentifier):
+        if not self.exists:
+            raise ClusterNotFoundFault(ClusterIdentifier)
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return {"Clusters": [{"ClusterStatus": status, "VpcId": "vpc-1",
+                              "Endpoint": {"Address": "dwh-cluster.abc.us-west-2.redshift.amazonaws.com"}}]}
+
+    def create_cluster(self, **kwargs):
+        self.created += 1
+        self.exists = True
+
+    def restore_from_cluster_snapshot(self, **kwargs):
+        self.restored.append(kwargs["SnapshotIdentifier"])
+        self.exists = True
+
+
+class FakeEC2:
+    """
+    The default security group of a VPC; `failures` authorize_ingress calls fail first.
+    """
+    def __init__(self, failures=0, error="RequestLimitExceeded"):
+        self.failures = failures
+        self.error = error
+        self.rules = 0
+
+    def Vpc(self, id):
+        ec2 = self
+
+        class Group:
+            group_name = "default"
+
+            def authorize_ingress(self, **kwargs):
+                if ec2.failures:
+                    ec2.failures -= 1
+                    raise RuntimeError(ec2.error)
+                if ec2.rules:
+                    raise RuntimeError("An error occurred (InvalidPermission.Duplicate)")
+                ec2.rules += 1
+
+        return type("Vpc", (), {"security_groups": type("Groups", (), {"all": lambda self: [Group()]})()})()
+
+
+class Clients:
+    def __init__(self, redshift=None, ec2=None):
+        self.redshift = redshift or FakeRedshift()
+        self.ec2 = ec2 or FakeEC2()
+        self.iam = None
+
+
+def fake_connect(conn_string):
+    class Cursor:
+        def execute(self, query):
+            pass
+
+        def fetchone(self):
+            return ("PostgreSQL 8.0.2 on i686-pc-linux-gnu, Redshift 1.0.56754",)
+
+    return type("Connection", (), {"cursor": lambda self: Cursor(), "close": lambda self: None})()
+
+
+async def no_sleep(seconds):
+    pass
+
+
+def provisioner(clients, state_path, sleep=no_sleep, **kwargs):
+    return ClusterProvisioner(clients, spec(), str(state_path), progress=lambda *args: None,
+                              connect=fake_connect, poll_base=0.01, sleep=sleep, **kwargs)
+
+
+def write_state(path, **state):
+    path.write_text(json.dumps({"completed": ["create_role"], "role_arn": ROLE_ARN, **state}))
+
+
+def test_run_saves_state_and_resumes_after_a_failure(tmp_path):
+    state_path = tmp_path / "dwh-cluster.json"
+    write_state(state_path)
+    clients = Clients(ec2=FakeEC2(failures=1))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(provisioner(clients, state_path).run())
+    saved = json.loads(state_path.read_text())
+    assert saved["completed"] == ["create_role", "create_cluster", "wait_available"]
+    assert saved["endpoint"] == "dwh-cluster.abc.us-west-2.redshift.amazonaws.com"
+
+    state = asyncio.run(provisioner(clients, state_path).run())
+    assert state["completed"] == STEPS
+    assert state["version"].startswith("PostgreSQL")
+    assert clients.redshift.created == 1
+    assert clients.ec2.rules == 1
+    assert json.loads(state_path.read_text()) == state
+
+
+def test_steps_are_safe_to_repeat(tmp_path):
+    state_path = tmp_path / "dwh-cluster.json"
+    write_state(state_path, vpc_id="vpc-1")
+    clients = Clients(redshift=FakeRedshift(statuses=["available"]))
+    runner = provisioner(clients, state_path)
+
+    for _ in range(2):
+        asyncio.run(runner.create_cluster())
+        asyncio.run(runner.authorize_ingress())
+    assert clients.redshift.created == 1
+    assert clients.ec2.rules == 1
+
+    # A cluster that already exists is left alone, whatever created it
+    existing = Clients(redshift=FakeRedshift(statuses=["available"], exists=True))
+    asyncio.run(provisioner(existing, state_path).create_cluster())
+    assert existing.redshift.created == 0
+
+
+def test_restores_from_a_snapshot(tmp_path):
+    state_path = tmp_path / "dwh-cluster.json"
+    write_state(state_path)
+    clients = Clients()
+    runner = provisioner(clients, state_path)
+    runner.spec.snapshot_identifier = "dwh-nightly"
+    asyncio.run(runner.create_cluster())
+    assert clients.redshift.restored == ["dwh-nightly"]
+    assert clients.redshift.created == 0
+
+
+def test_polling_backs_off_until_available(tmp_path):
+    state_path = tmp_path / "dwh-cluster.json"
+    write_state(state_path, completed=["create_role", "create_cluster"])
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    clients = Clients(redshift=FakeRedshift(statuses=["creating"] * 4 + ["available"], exists=True))
+    runner = ClusterProvisioner(clients, spec(), str(state_path), progress=lambda *args: None,
+                                connect=fake_connect, poll_base=5.0, poll_cap=60.0, sleep=sleep)
+    asyncio.run(runner.wait_available())
+    assert len(waits) == 4
+    assert all(1.0 <= seconds <= 60.0 for seconds in waits)
+    assert runner.state["vpc_id"] == "vpc-1"
+
+
+def test_polling_times_out(tmp_path):
+    clients = Clients(redshift=FakeRedshift(statuses=["creating"], exists=True))
+    runner = provisioner(clients, tmp_path / "dwh-cluster.json", timeout=0.0)
+    with pytest.raises(ProvisioningError):
+        asyncio.run(runner.wait_available())
+
+
+@pytest.fixture
+def aws():
+    """
+    moto-backed IAM, Redshift and EC2 clients, for when moto is installed.
+    """
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    if not hasattr(moto, "mock_aws"):
+        pytest.skip("needs moto 5")
+    with moto.mock_aws():
+        yield type("AWS", (), {
+            "iam": boto3.client("iam", region_name="us-west-2"),
+            "redshift": boto3.client("redshift", region_name="us-west-2"),
+            "ec2": boto3.resource("ec2", region_name="us-west-2"),
+        })()
+
+
+def test_moto_role_and_cluster_are_created_once(aws, tmp_path):
+    runner = provisioner(aws, tmp_path / "dwh-cluster.json")
+    asyncio.run(runner.create_role())
+    role_arn = runner.state["role_arn"]
+    asyncio.run(runner.create_role())
+    assert runner.state["role_arn"] == role_arn
+    assert len(aws.iam.list_attached_role_policies(RoleName="dwhRole")["AttachedPolicies"]) == 1
+
+    asyncio.run(runner.create_cluster())
+    asyncio.run(runner.create_cluster())
+    assert [c["ClusterIdentifier"] for c in aws.redshift.describe_clusters()["Clusters"]] == ["dwh-cluster"]
+
+
+def test_moto_teardown_removes_cluster_role_and_state(aws, tmp_path):
+    state_path = tmp_path / "dwh-cluster.json"
+    runner = provisioner(aws, state_path)
+    asyncio.run(runner.create_role())
+    asyncio.run(runner.create_cluster())
+    runner._save_state()
+    asyncio.run(runner.teardown())
+    assert aws.redshift.describe_clusters()["Clusters"] == []
+    with pytest.raises(aws.iam.exceptions.NoSuchEntityException):
+        aws.iam.get_role(RoleName="dwhRole")
+    assert not state_path.exists()
@@ -0,0 +1,106 @@
+import sqlite3
+from datetime import datetime
+import pytest
+from query_cache import ResultCache, cache_key, cached_query, normalize_sql, referenced_tables
+from sql_queries import load_commit_select
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / "cache" / "results.db"), max_bytes=10_000, ttl=60.0, clock=clock)
+    yield cache
+    cache.close()
+
+
+def test_key_normalization():
+    assert normalize_sql("SELECT level,\n       COUNT(*)\n  FROM songplays\n GROUP BY level;  ") == \
+        "SELECT level, COUNT(*) FROM songplays GROUP BY level"
+    assert cache_key("SELECT *  FROM users\nWHERE level = %s;", ("paid",)) == \
+        cache_key("SELECT * FROM users WHERE level = %s", ("paid",))
+    assert cache_key("SELECT * FROM users WHERE level = %s", ("paid",)) != \
+        cache_key("SELECT * FROM users WHERE level = %s", ("free",))
+    assert referenced_tables("SELECT * FROM songplays sp JOIN Users u ON u.user_id = sp.user_id") == ["songplays", "users"]
+
+
+def test_ttl_expiry(cache, clock):
+    cache.put("k", "m", [1, 2])
+    clock.now += 59
+    assert cache.get("k", "m") == [1, 2]
+    clock.now += 2
+    assert cache.get("k", "m") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["entries"]) == (1, 1, 1, 0)
+
+
+def test_lru_eviction_at_the_size_cap(cache, clock):
+    value = "x" * 3_000
+    for key in ("a", "b", "c"):
+        cache.put(key, "m", value)
+        clock.now += 1
+    assert cache.get("a", "m") == value  # a is now the most recently used
+    clock.now += 1
+    cache.put("d", "m", value)
+    assert cache.get("b", "m") is None
+    assert all(cache.get(key, "m") == value for key in ("a", "c", "d"))
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 10_000
+
+
+def test_oversized_results_are_not_cached(cache):
+    cache.put("big", "m", "x" * 20_000)
+    assert cache.stats()["entries"] == 0
+
+
+class Warehouse:
+    """
+    A SQLite stand-in for the cluster: analytics queries run on SQLite, and the
+    etl_load_commits lookup is answered from `commits`, as `mark_loaded` would leave it.
+    """
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.execute("CREATE TABLE songplays (level TEXT)")
+        self.db.executemany("INSERT INTO songplays VALUES (?)", [("free",), ("paid",), ("paid",)])
+        self.commits = {"songplays": datetime(2026, 10, 1, 3, 0)}
+        self.queries = 0
+        self.rows = []
+        self.description = None
+
+    def execute(self, sql, params=()):
+        if sql == load_commit_select:
+            self.rows = [(table, self.commits[table]) for table in params[0] if table in self.commits]
+            return
+        self.queries += 1
+        cur = self.db.execute(sql.replace("%s", "?"), params)
+        self.description = cur.description
+        self.rows = cur.fetchall()
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_cached_query_is_invalidated_by_a_new_load(cache):
+    warehouse = Warehouse()
+    sql = "SELECT level, COUNT(*) FROM songplays WHERE level = %s GROUP BY level"
+
+    assert cached_query(warehouse, cache, sql, ("paid",)) == (["level", "COUNT(*)"], [("paid", 2)], False)
+    assert cached_query(warehouse, cache, sql + ";", ("paid",)) == (["level", "COUNT(*)"], [("paid", 2)], True)
+    assert warehouse.queries == 1
+
+    warehouse.db.execute("INSERT INTO songplays VALUES ('paid')")
+    warehouse.commits["songplays"] = datetime(2026, 10, 2, 3, 0)
+    assert cached_query(warehouse, cache, sql, ("paid",)) == (["level", "COUNT(*)"], [("paid", 3)], False)
+    assert warehouse.queries == 2
+    assert cache.stats()["invalidations"] == 1
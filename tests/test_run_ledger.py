@@ -0,0 +1,77 @@
+import pytest
+from run_ledger import RunInProgress, RunLedger, StepFailed, run_step
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "ledger.db")
+
+
+def failed_run(path, mode="full", done=("COPY staging_events",)):
+    ledger = RunLedger.sqlite(path)
+    run_id = ledger.start(mode)
+    for step in done:
+        ledger.record(step, "success", 1, 0.1, 10)
+    ledger.record("COPY staging_songs", "failed", 3, 0.1, error="boom")
+    ledger.finish("failed")
+    return run_id
+
+
+def test_resume_continues_the_failed_run(ledger_path):
+    run_id = failed_run(ledger_path)
+    ledger = RunLedger.sqlite(ledger_path)
+    assert ledger.start("full", resume=True) == run_id
+    assert ledger.completed() == {"COPY staging_events"}
+
+
+def test_resume_starts_fresh_after_a_later_success(ledger_path):
+    old_run = failed_run(ledger_path)
+    ledger = RunLedger.sqlite(ledger_path)
+    ledger.start("full")
+    ledger.finish("success")
+
+    ledger = RunLedger.sqlite(ledger_path)
+    run_id = ledger.start("full", resume=True)
+    assert run_id != old_run
+    assert ledger.completed() == set()
+
+
+def test_resume_only_looks_at_the_same_mode(ledger_path):
+    run_id = failed_run(ledger_path, mode="incremental")
+    ledger = RunLedger.sqlite(ledger_path)
+    ledger.start("full")
+    ledger.finish("success")
+    assert RunLedger.sqlite(ledger_path).start("incremental", resume=True) == run_id
+
+
+def test_resume_refuses_a_running_run_unless_forced(ledger_path):
+    running = RunLedger.sqlite(ledger_path)
+    run_id = running.start("full")
+    running.record("COPY staging_events", "success", 1, 0.1, 10)
+
+    with pytest.raises(RunInProgress):
+        RunLedger.sqlite(ledger_path).start("full", resume=True)
+    ledger = RunLedger.sqlite(ledger_path)
+    assert ledger.start("full", resume=True, force=True) == run_id
+    assert ledger.completed() == {"COPY staging_events"}
+
+
+def test_run_step_skips_completed_and_retries_failures(ledger_path):
+    ledger = RunLedger.sqlite(ledger_path)
+    ledger.start("full")
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 2:
+            raise RuntimeError("transient")
+        return 5
+
+    assert run_step(ledger, "songs", flaky, attempts=3, sleep=lambda seconds: None) == 5
+    assert run_step(ledger, "songs", flaky, attempts=3, sleep=lambda seconds: None) is None
+    assert len(calls) == 2
+    assert [row[:3] + (row[4],) for row in ledger.step_rows()] == [("songs", "success", 2, 5)]
+
+    with pytest.raises(StepFailed):
+        run_step(ledger, "users", lambda: 1 / 0, attempts=2, sleep=lambda seconds: None)
+    assert "users" not in ledger.completed()
@@ -0,0 +1,125 @@
+import threading
+from contextlib import contextmanager
+import pytest
+from scheduler import QueryTask, build_dag, run_dag
+
+
+class FakePool:
+    """
+    A connection pool whose cursors record the statements in execution order and fail
+    those starting with FAIL.
+    """
+    def __init__(self):
+        self.executed = []
+        self.rollbacks = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        pool = self
+
+        class Cursor:
+            rowcount = 1
+
+            def execute(self, query, params=None):
+                if query.startswith("FAIL"):
+                    raise RuntimeError(query)
+                with pool.lock:
+                    pool.executed.append(query)
+
+            def close(self):
+                pass
+
+        class Connection:
+            def cursor(self):
+                return Cursor()
+
+            def commit(self):
+                pass
+
+            def rollback(self):
+                pool.rollbacks += 1
+
+        yield Connection()
+
+
+def test_build_dag_follows_read_and_write_conflicts():
+    tasks = [
+        QueryTask("keyed", "", reads=["staging_events"], writes=["staging_events_keyed"]),
+        QueryTask("songs", "", reads=["staging_songs"], writes=["songs"]),
+        QueryTask("songplays", "", reads=["staging_events_keyed", "songs"], writes=["songplays"]),
+        QueryTask("reload", "", writes=["staging_events"]),
+        QueryTask("dedupe", "", writes=["songs"]),
+    ]
+    assert build_dag(tasks) == {
+        "keyed": set(),
+        "songs": set(),
+        "songplays": {"keyed", "songs"},
+        # Writing a table an earlier task reads waits for that reader
+        "reload": {"keyed"},
+        # Write after write, and after an earlier reader
+        "dedupe": {"songs", "songplays"},
+    }
+
+
+def test_build_dag_keeps_disjoint_slices_independent():
+    tasks = [
+        QueryTask("2018-11", "", writes=["songplays:2018-11"]),
+        QueryTask("2018-12", "", writes=["songplays:2018-12"]),
+        QueryTask("2018-11 again", "", writes=["songplays:2018-11"]),
+        QueryTask("whole", "", reads=["songplays"], writes=["plays_per_day"]),
+    ]
+    assert build_dag(tasks) == {
+        "2018-11": set(),
+        "2018-12": set(),
+        "2018-11 again": {"2018-11"},
+        "whole": {"2018-11", "2018-12", "2018-11 again"},
+    }
+
+
+def test_build_dag_rejects_duplicate_names():
+    with pytest.raises(ValueError):
+        build_dag([QueryTask("a", ""), QueryTask("a", "")])
+
+
+def test_run_dag_runs_dependencies_first():
+    pool = FakePool()
+    tasks = [
+        QueryTask("a", "A", writes=["x"]),
+        QueryTask("b", "B", reads=["x"], writes=["y"]),
+        QueryTask("c", "C", reads=["y"], writes=["z"]),
+        QueryTask("d", "D", writes=["w"]),
+    ]
+    assert run_dag(tasks, pool, max_workers=3) == {name: "success" for name in "abcd"}
+    assert pool.executed.index("A") < pool.executed.index("B") < pool.executed.index("C")
+    assert sorted(pool.executed) == ["A", "B", "C", "D"]
+
+
+def test_run_dag_skips_downstream_of_a_failure_and_runs_the_rest():
+    pool = FakePool()
+    tasks = [
+        QueryTask("a", "FAIL A", writes=["x"]),
+        QueryTask("b", "B", reads=["x"], writes=["y"]),
+        QueryTask("c", "C", reads=["y"]),
+        QueryTask("d", "D", writes=["w"]),
+        QueryTask("e", "E", reads=["w"]),
+    ]
+    status = run_dag(tasks, pool, max_workers=2)
+    assert status == {"a": "failed", "b": "skipped", "c": "skipped", "d": "success", "e": "success"}
+    assert sorted(pool.executed) == ["D", "E"]
+    assert pool.rollbacks == 1
+
+
+def test_run_dag_runs_independent_tasks_together():
+    started = threading.Barrier(2, timeout=5)
+
+    class BarrierPool(FakePool):
+        @contextmanager
+        def connection(self):
+            # Both tasks must hold a connection at once for the barrier to open
+            started.wait()
+            with super().connection() as conn:
+                yield conn
+
+    tasks = [QueryTask("a", "A", writes=["x"]), QueryTask("b", "B", writes=["y"])]
+    assert run_dag(tasks, BarrierPool(), max_workers=2) == {"a": "success", "b": "success"}
@@ -0,0 +1,67 @@
+import pytest
+from schema import TABLES_BY_NAME, alter_table_sql, parse_diststyle, read_table_layout
+
+
+class CatalogCursor:
+    """
+    Answers the two catalog queries of read_table_layout with fixed rows.
+    """
+    def __init__(self, columns, diststyle):
+        self.columns = columns
+        self.diststyle = diststyle
+        self.query = None
+
+    def execute(self, query, params=None):
+        self.query = query
+
+    def fetchall(self):
+        return self.columns
+
+    def fetchone(self):
+        return (self.diststyle,) if self.diststyle is not None else None
+
+
+SONGPLAYS_CATALOG = [
+    ("songplay_id", "integer", "none", False, 0),
+    ("start_time", "timestamp without time zone", "none", False, 1),
+    ("user_id", "integer", "az64", False, 0),
+    ("level", "text", "zstd", False, 0),
+    ("song_id", "text", "zstd", True, 0),
+    ("artist_id", "text", "zstd", False, 0),
+    ("session_id", "integer", "az64", False, 0),
+    ("location", "text", "zstd", False, 0),
+    ("user_agent", "text", "zstd", False, 0),
+]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("EVEN", ("EVEN", None)),
+    ("ALL", ("ALL", None)),
+    ("KEY(song_id)", ("KEY", "song_id")),
+    ("AUTO(KEY(song_id))", ("KEY", "song_id")),
+    ("AUTO(EVEN)", ("EVEN", None)),
+    ("AUTO(ALL)", ("ALL", None)),
+    ("AUTO", ("AUTO", None)),
+    (None, (None, None)),
+])
+def test_parse_diststyle(value, expected):
+    assert parse_diststyle(value) == expected
+
+
+def test_read_table_layout_auto_key():
+    table = read_table_layout(CatalogCursor(SONGPLAYS_CATALOG, "AUTO(KEY(song_id))"), "songplays")
+    assert (table.diststyle, table.distkey, table.sortkey) == ("KEY", "song_id", ["start_time"])
+    assert not any(statement.startswith("ALTER TABLE songplays ALTER DISTSTYLE")
+                   for statement in alter_table_sql(table, TABLES_BY_NAME["songplays"]))
+
+
+@pytest.mark.parametrize("diststyle", ["AUTO(EVEN)", "AUTO(ALL)"])
+def test_read_table_layout_auto_without_key(diststyle):
+    columns = [(name, type, encoding, False, position) for name, type, encoding, _, position in SONGPLAYS_CATALOG]
+    table = read_table_layout(CatalogCursor(columns, diststyle), "songplays")
+    assert table.distkey is None
+    assert alter_table_sql(table, TABLES_BY_NAME["songplays"])[0] == "ALTER TABLE songplays ALTER DISTSTYLE KEY DISTKEY song_id"
+
+
+def test_read_table_layout_missing_table():
+    assert read_table_layout(CatalogCursor([], None), "songplays") is None
@@ -0,0 +1,149 @@
+import ast
+import glob
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+import pytest
+import sql_queries
+from pg_compat import to_postgres
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_no_module_imports_config_dependent_queries():
+    """
+    Names rendered from dwh.cfg must be built inside functions, not imported, or the
+    import itself reads the configuration.
+    """
+    offenders = []
+    for path in glob.glob(os.path.join(ROOT, "*.py")):
+        with open(path) as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.module == "sql_queries":
+                offenders += [f"{os.path.basename(path)}: {alias.name}" for alias in node.names
+                              if alias.name in sql_queries._CONFIG_QUERIES]
+    assert offenders == []
+
+
+def test_importing_sql_queries_reads_no_config(tmp_path):
+    # No dwh.cfg in the working directory
+    subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import sql_queries"],
+                   cwd=tmp_path, check=True)
+
+
+def test_copy_builders(make_config):
+    sources = sql_queries.copy_table_sources_for(make_config())
+    assert [(table, source) for table, source, _ in sources] == [
+        ("staging_events", "'s3://udacity-dend/log-data'"), ("staging_songs", "'s3://udacity-dend/song-data'")]
+    events = sources[0][2].format(manifest="s3://manifests/shard-0000.manifest")
+    assert "COPY staging_events FROM 's3://manifests/shard-0000.manifest'" in events
+    assert "JSON 's3://udacity-dend/log_json_path.json'" in events
+    assert "MANIFEST" in events
+
+    songs = sql_queries.full_load_copy_query(make_config(), "staging_songs")
+    assert "COPY staging_songs FROM 's3://udacity-dend/song-data'" in songs
+    assert "JSON 'auto'" in songs
+    parquet = sql_queries.full_load_copy_query(make_config(s3={"PREPROCESSED_PREFIX": "s3://bucket/pre"}), "staging_songs")
+    assert "FROM 's3://bucket/pre/staging_songs/'" in parquet
+    assert "FORMAT AS PARQUET" in parquet
+
+
+@pytest.mark.parametrize("time_dimension", ["events", "calendar"])
+def test_steps_end_on_the_statement_that_loads_rows(time_dimension):
+    """
+    The cursor's rowcount after a multi-statement query is that of its last statement,
+    which is what instrumentation and the run ledger record for the step.
+    """
+    steps = sql_queries.insert_steps_for(time_dimension) + sql_queries.reconcile_steps()
+    for name, query, _, _ in steps:
+        statements = [s.strip() for s in query.split(";") if s.strip()]
+        assert statements[-1].split()[0].upper() == "INSERT", name
+    for query in (sql_queries.user_table_insert, sql_queries.song_table_insert, sql_queries.artist_table_insert):
+        statements = [s.strip() for s in query.split(";") if s.strip()]
+        assert statements[0].startswith("DROP TABLE IF EXISTS")
+        assert statements[-1].startswith("INSERT INTO")
+
+
+def ms(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def slice_of(slices, ts):
+    return [label for label, start, end in slices if (start is None or ts >= start) and (end is None or ts < end)]
+
+
+@pytest.mark.parametrize("unit, min_ts, max_ts, labels", [
+    ("day", ms(2018, 11, 30, 22), ms(2018, 12, 2, 1), ["2018-11-30", "2018-12-01", "2018-12-02"]),
+    ("month", ms(2018, 11, 15), ms(2019, 1, 3), ["2018-11", "2018-12", "2019-01"]),
+    ("month", ms(2018, 12, 31, 23, 59, 59), ms(2019, 1, 1), ["2018-12", "2019-01"]),
+])
+def test_time_slices_partition_the_range(unit, min_ts, max_ts, labels):
+    slices = sql_queries.time_slices(min_ts, max_ts, unit)
+    assert [label for label, _, _ in slices] == labels
+    # Open at both ends, and each slice starts where the previous one ends
+    assert slices[0][1] is None and slices[-1][2] is None
+    assert all(previous[2] == current[1] for previous, current in zip(slices, slices[1:]))
+    # Every event, including ones outside the sampled range, lands in exactly one slice
+    for ts in (min_ts - 1, min_ts, max_ts, max_ts + 1) + tuple(start for _, start, _ in slices[1:]):
+        assert len(slice_of(slices, ts)) == 1, ts
+    for _, start, _ in slices[1:]:
+        assert len(slice_of(slices, start - 1)) == 1
+
+
+def test_time_slices_single_timestamp():
+    ts = ms(2018, 11, 1, 12)
+    assert sql_queries.time_slices(ts, ts, "day") == [("2018-11-01", None, None)]
+    assert sql_queries.time_slices(ts, ts, "month") == [("2018-11", None, None)]
+
+
+def test_time_slices_rejects_unknown_units():
+    with pytest.raises(ValueError):
+        sql_queries.time_slices(0, 0, "week")
+
+
+def test_songplay_slice_steps_filter_on_the_slice_bounds():
+    slices = sql_queries.time_slices(ms(2018, 11, 30), ms(2018, 12, 1, 5), "day")
+    first, last = sql_queries.songplay_slice_steps(slices)
+    assert first[0] == "songplays 2018-11-30"
+    assert f"se.ts < {ms(2018, 12, 1)}" in first[1] and "se.ts >=" not in first[1]
+    assert f"se.ts >= {ms(2018, 12, 1)}" in last[1] and "se.ts <" not in last[1]
+    assert first[3] == last[3] == ["songplays"]
+    concurrent = sql_queries.songplay_slice_steps(slices, concurrent=True)
+    assert [step[3] for step in concurrent] == [["songplays:2018-11-30"], ["songplays:2018-12-01"]]
+
+
+def statements(query):
+    return [" ".join(s.split()) for s in query.split(";") if s.strip()]
+
+
+def test_pending_promote_moves_each_matched_row_once():
+    drop, stage, delete, insert = statements(sql_queries.songplay_pending_promote)
+    assert drop == "DROP TABLE IF EXISTS songplays_promote_stage"
+    # The rows staged for promotion are exactly the ones then deleted from songplays_pending...
+    assert stage.startswith("CREATE TEMP TABLE songplays_promote_stage AS SELECT")
+    assert stage.endswith("FROM songplays_pending p JOIN staging_songs_keyed ss ON p.match_key = ss.match_key")
+    assert delete == ("DELETE FROM songplays_pending USING staging_songs_keyed ss "
+                      "WHERE songplays_pending.match_key = ss.match_key")
+    # ...and songplays gets them from the stage only, so a rerun finds nothing left to promote
+    assert insert.startswith("INSERT INTO songplays (")
+    assert insert.endswith("FROM songplays_promote_stage")
+    assert "songplays_pending" not in insert
+
+
+def test_pending_insert_keeps_only_unmatched_events_once():
+    delete, insert = statements(sql_queries.songplay_pending_insert)
+    # Pending rows whose event matched a song in this batch were just loaded into songplays
+    assert delete.startswith("DELETE FROM songplays_pending USING staging_events_keyed se, staging_songs_keyed ss")
+    assert delete.endswith("AND se.match_key = ss.match_key")
+    assert insert.startswith("INSERT INTO songplays_pending")
+    assert insert.endswith("WHERE ss.match_key IS NULL AND p.match_key IS NULL")
+    assert "NOW()" in to_postgres(insert)
+
+
+def test_reconcile_step_records_the_promote_insert():
+    name, query, reads, writes = sql_queries.reconcile_steps()[-1]
+    assert name == "songplays_reconcile"
+    assert statements(query)[-1].startswith("INSERT INTO songplays (")
+    assert set(writes) == {"songplays", "songplays_pending"}
+    assert "staging_songs_keyed" in reads
@@ -0,0 +1,47 @@
+import json
+import os
+from synthetic_data import generate_events, generate_songs, song_record, write_jsonpaths
+
+
+def read_records(path):
+    records = []
+    for root, _, names in sorted(os.walk(path)):
+        for name in sorted(names):
+            with open(os.path.join(root, name)) as f:
+                records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_generate_songs_packs_many_songs_per_file(tmp_path):
+    assert generate_songs(str(tmp_path), 4500) == 3
+    songs = read_records(tmp_path)
+    assert len(songs) == 4500
+    assert len({song["song_id"] for song in songs}) == 4500
+    assert generate_songs(str(tmp_path / "one"), 3, songs_per_file=1) == 3
+
+
+def test_generate_events_layout_and_match_rate(tmp_path):
+    files = generate_events(str(tmp_path), 3000, 100, match_rate=1.0, events_per_file=500, days=3)
+    assert files == 6
+    assert sorted(os.listdir(tmp_path / "2018" / "11"))[:2] == ["2018-11-01-events-1.json", "2018-11-01-events.json"]
+    events = read_records(tmp_path)
+    assert len(events) == 3000
+    titles = {song_record(i)["title"] for i in range(100)}
+    plays = [event for event in events if event["page"] == "NextSong"]
+    assert 0.75 < len(plays) / len(events) < 0.85
+    assert all(event["song"] in titles for event in plays)
+    assert all(event["song"] is None for event in events if event["page"] != "NextSong")
+
+
+def test_generate_events_is_deterministic(tmp_path):
+    generate_events(str(tmp_path / "a"), 200, 10, days=2)
+    generate_events(str(tmp_path / "b"), 200, 10, days=2)
+    assert read_records(tmp_path / "a") == read_records(tmp_path / "b")
+
+
+def test_write_jsonpaths_matches_the_log_jsonpath_layout(tmp_path):
+    path = tmp_path / "log_json_path.json"
+    write_jsonpaths(str(path))
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "log_json_path.json")
+    with open(fixture) as f:
+        assert json.loads(path.read_text()) == json.load(f)
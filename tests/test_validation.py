@@ -0,0 +1,71 @@
+import pytest
+from validation import DEFAULT_THRESHOLDS, ValidationError, check_thresholds, collect_metrics, read_thresholds, validate
+
+TABLE_STATS = [("songplays", 320, 0, None), ("users", 96, None, 0), ("songs", 14896, 0, 0),
+               ("artists", 10025, 0, 2), ("time", 320, 0, 0)]
+
+
+class FakeCursor:
+    """
+    Answers the table stats query, then the integrity query, recording both.
+    """
+    def __init__(self, integrity=(0, 0, 0, 0, 400, 80)):
+        self.executed = []
+        self.integrity = integrity
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+    def fetchall(self):
+        return TABLE_STATS
+
+    def fetchone(self):
+        return self.integrity
+
+
+def test_collect_metrics():
+    metrics = collect_metrics(FakeCursor(integrity=(1, None, 0, 0, 400, 80)))
+    assert metrics["users.rows"] == 96
+    assert metrics["users.null_keys"] == 0
+    assert metrics["artists.duplicate_keys"] == 2
+    assert "songplays.duplicate_keys" not in metrics
+    assert metrics["songplays.orphaned_users"] == 1
+    assert metrics["songplays.orphaned_songs"] == 0
+    assert metrics["staging_events.unmatched_pct"] == 20.0
+
+
+def test_collect_metrics_without_keyed_events():
+    assert collect_metrics(FakeCursor(integrity=(0, 0, 0, 0, 0, 0)))["staging_events.unmatched_pct"] == 0.0
+
+
+@pytest.mark.parametrize("time_dimension, table", [("events", "FROM time"), ("calendar", "FROM calendar")])
+def test_collect_metrics_reads_the_configured_time_dimension(time_dimension, table):
+    cur = FakeCursor()
+    collect_metrics(cur, time_dimension)
+    stats, integrity = cur.executed
+    assert table in stats
+    assert ("calendar" in integrity) == (time_dimension == "calendar")
+
+
+def test_check_thresholds():
+    metrics = {"songplays.rows": 320, "artists.duplicate_keys": 2, "staging_events.unmatched_pct": 20.0}
+    thresholds = {"songplays.rows.min": 1, "songplays.rows.max": 300, "artists.duplicate_keys.max": 0,
+                  "staging_events.unmatched_pct.max": 25}
+    assert check_thresholds(metrics, thresholds) == [
+        "artists.duplicate_keys = 2 (max 0)", "songplays.rows = 320 (max 300)"]
+
+
+def test_check_thresholds_rejects_unknown_metrics_and_bounds():
+    failures = check_thresholds({"users.rows": 96}, {"user.rows.min": 1, "users.rows.avg": 1})
+    assert failures == ["user.rows.min: unknown metric user.rows", "users.rows.avg: threshold must end in .min or .max"]
+
+
+def test_read_thresholds(make_config):
+    assert read_thresholds(make_config()) == DEFAULT_THRESHOLDS
+
+
+def test_validate_raises_on_a_breach():
+    with pytest.raises(ValidationError, match="artists.duplicate_keys = 2"):
+        validate(FakeCursor(), DEFAULT_THRESHOLDS)
+    metrics = validate(FakeCursor(), {"users.rows.min": 1})
+    assert metrics["users.rows"] == 96
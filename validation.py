@@ -0,0 +1,95 @@
+import logging
+from sql_queries import table_stats_query_for, songplay_integrity_query_for # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Used when dwh.cfg has no [VALIDATION] section
+DEFAULT_THRESHOLDS = {
+    "songplays.rows.min": 1,
+    "users.rows.min": 1,
+    "songs.rows.min": 1,
+    "artists.rows.min": 1,
+    "time.rows.min": 1,
+    "songplays.null_keys.max": 0,
+    "users.duplicate_keys.max": 0,
+    "songs.duplicate_keys.max": 0,
+    "artists.duplicate_keys.max": 0,
+    "time.duplicate_keys.max": 0,
+    "songplays.orphaned_users.max": 0,
+    "songplays.orphaned_songs.max": 0,
+    "songplays.orphaned_artists.max": 0,
+    "songplays.orphaned_time.max": 0,
+}
+
+
+class ValidationError(Exception):
+    pass
+
+
+def collect_metrics(cur, time_dimension='events'):
+    """
+    Runs the two validation queries and returns a flat dict such as
+    {"users.rows": 96, "users.duplicate_keys": 0, "songplays.orphaned_songs": 0, ...}.
+    With `time_dimension` = "calendar", the time.* metrics describe the `calendar` table.
+    """
+    metrics = {}
+    cur.execute(table_stats_query_for(time_dimension))
+    for table, rows, null_keys, duplicate_keys in cur.fetchall():
+        metrics[f"{table}.rows"] = rows
+        metrics[f"{table}.null_keys"] = null_keys or 0
+        if duplicate_keys is not None:
+            metrics[f"{table}.duplicate_keys"] = duplicate_keys
+
+    cur.execute(songplay_integrity_query_for(time_dimension))
+    users, songs, artists, time, keyed_events, unmatched = cur.fetchone()
+    metrics["songplays.orphaned_users"] = users or 0
+    metrics["songplays.orphaned_songs"] = songs or 0
+    metrics["songplays.orphaned_artists"] = artists or 0
+    metrics["songplays.orphaned_time"] = time or 0
+    metrics["staging_events.unmatched_events"] = unmatched
+    metrics["staging_events.unmatched_pct"] = round(100.0 * unmatched / keyed_events, 2) if keyed_events else 0.0
+    return metrics
+
+
+def read_thresholds(config):
+    """
+    Reads `<table>.<metric>.min|max = value` entries from the `[VALIDATION]` section of `config`.
+    """
+    if not config.has_section('VALIDATION'):
+        return dict(DEFAULT_THRESHOLDS)
+    return {key: float(value) for key, value in config.items('VALIDATION')}
+
+
+def check_thresholds(metrics, thresholds):
+    """
+    Returns a message for every metric outside its threshold. Thresholds on metrics that
+    were not collected are reported too, so a typo in dwh.cfg does not pass silently.
+    """
+    failures = []
+    for key, limit in sorted(thresholds.items()):
+        name, _, bound = key.rpartition(".")
+        if bound not in ("min", "max"):
+            failures.append(f"{key}: threshold must end in .min or .max")
+            continue
+        if name not in metrics:
+            failures.append(f"{key}: unknown metric {name}")
+            continue
+        value = metrics[name]
+        if (bound == "min" and value < limit) or (bound == "max" and value > limit):
+            failures.append(f"{name} = {value} ({bound} {limit:g})")
+    return failures
+
+
+def validate(cur, thresholds, time_dimension='events'):
+    """
+    Collects the data-quality metrics, logs them and raises ValidationError listing every
+    threshold that was breached. Returns the metrics when the load passes.
+    """
+    metrics = collect_metrics(cur, time_dimension)
+    for name, value in metrics.items():
+        logger.info(f"{name}: {value}")
+    failures = check_thresholds(metrics, thresholds)
+    if failures:
+        raise ValidationError("Validation failed: " + "; ".join(failures))
+    logger.info("Validation passed")
+    return metrics